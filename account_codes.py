@@ -0,0 +1,57 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+from series_utils import map_unique_values
+
+# A valid account code, e.g. 010-0000-0-1110-0000-4300-000-0000-0000
+ACCOUNT_PATTERN = re.compile(r"^\d{3}-\d{4}-\d-\d{4}-\d{4}-\d{4}-\d{3}-\d{4}-\d{4}$")
+NON_ACCOUNT_CHARS = re.compile(r"[^0-9\-]")
+
+# Distinct account strings kept parsed. A run sees a few thousand at most.
+ACCOUNT_CACHE_SIZE = 65536
+
+# text: the string that was parsed
+# normalized: the account as it is booked. Periods become dashes and other characters are
+#   dropped when the result is a valid code, "" when it is not, and text with no digits
+#   (e.g. "BILL SUNOL GLEN") is kept stripped
+# segments: the nine parts of normalized when it is a valid code, else ()
+# valid: text itself is a valid code, i.e. it does not need a red highlight
+AccountCode = namedtuple("AccountCode", ["text", "normalized", "segments", "valid"])
+
+
+# Parse one account string. Cached on the raw string since the same codes repeat on every form.
+@lru_cache(maxsize=ACCOUNT_CACHE_SIZE)
+def parse_account(text):
+    valid = ACCOUNT_PATTERN.match(text) is not None
+    stripped = text.strip()
+    if not any(char.isdigit() for char in stripped):
+        return AccountCode(text, stripped, (), valid)
+
+    cleaned = NON_ACCOUNT_CHARS.sub("", stripped.replace(".", "-"))
+    if ACCOUNT_PATTERN.fullmatch(cleaned):
+        return AccountCode(text, cleaned, tuple(cleaned.split("-")), valid)
+    return AccountCode(text, "", (), valid)
+
+
+# Parsed AccountCode of every value of a Series, keyed on str(value) like the per-value helpers
+def parse_account_series(series, strip=False):
+    text = series.astype(str)
+    if strip:
+        text = text.str.strip()
+    return map_unique_values(text, parse_account)
+
+
+# Normalized account of every value of a Series, "" for None
+def normalize_account_series(series):
+    text = series.astype(str)
+    normalized = map_unique_values(text, lambda value: parse_account(value).normalized).to_numpy(dtype=object)
+    normalized[(series.isna() & text.eq("None")).to_numpy()] = ""
+    return normalized
+
+
+# True for every value of a Series that is not a valid account code. strip=True checks the
+# values with surrounding whitespace removed.
+def invalid_account_mask(series, strip=False):
+    parsed = parse_account_series(series, strip=strip)
+    return np.fromiter((not account.valid for account in parsed), dtype=bool, count=len(parsed))
@@ -0,0 +1,60 @@
+import argparse
+import time
+import pandas as pd
+from logic import process_api_data
+from benchmarks.synthetic import generate_responses, generate_field_mapping
+
+
+# Previous row-wise implementation: one dict per form, then pd.DataFrame(records)
+def process_api_data_records(data, field_mapping):
+    records = []
+    data_array = data.get("data", []) if isinstance(data, dict) else data
+    for form in data_array:
+        form_data = {}
+        fields = form.get("fields", [])
+        if not isinstance(fields, list):
+            continue
+        for field in fields:
+            try:
+                field_number = field.get("number")
+                if field_number in field_mapping:
+                    field_label = field_mapping[field_number]
+                    form_data[field_label] = field.get("value", "N/A")
+            except Exception:
+                pass
+        if form_data:
+            records.append(form_data)
+    return pd.DataFrame(records)
+
+
+# Best wall time of repeats calls
+def best_time(func, repeats, *args):
+    best = None
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the columnar process_api_data against the row-wise version.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'layout':<18}{'responses':>10}{'row-wise s':>12}{'columnar s':>12}{'speedup':>9}")
+    for category in ("expense", "mileage", "conference"):
+        field_mapping = generate_field_mapping(category)
+        for size in args.sizes:
+            data = generate_responses(size, category)
+            records_time, expected = best_time(process_api_data_records, args.repeats, data, field_mapping)
+            columnar_time, actual = best_time(process_api_data, args.repeats, data, field_mapping)
+            pd.testing.assert_frame_equal(expected, actual)
+            print(f"{category + ' (new)':<18}{size:>10}{records_time:>12.3f}{columnar_time:>12.3f}{records_time / columnar_time:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
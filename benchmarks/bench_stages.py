@@ -0,0 +1,180 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+import pandas as pd
+from logic import (
+    FORM_PIPELINES, extract_field_mapping, process_api_data, generate_invoice_number, combine_account_codes,
+    normalize_escape_roster, prepare_dataframes, merge_and_compare_data_combined, create_matched_data_sheet,
+    save_to_excel, save_to_excel_final,
+)
+from run_metrics import measure_run, measure_stage
+from benchmarks.synthetic import generate_responses, generate_escape_roster
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results", "stages.jsonl")
+
+# Stages in pipeline order, as reported
+STAGES = (
+    "process_api_data", "generate_invoice_number", "combine_account_codes", "normalize_escape_roster",
+    "prepare_dataframes", "merge_and_compare_data_combined", "create_matched_data_sheet",
+    "save_to_excel", "save_to_excel_final",
+)
+
+# Slowdown against the previous result of a stage that is flagged
+REGRESSION_RATIO = 1.2
+# Stages faster than this are too noisy to flag
+REGRESSION_MIN_SECONDS = 0.05
+
+FORMS = [(category, is_old_campaign) for category in ("expense", "mileage", "conference") for is_old_campaign in (True, False)]
+
+
+# Commit the benchmark ran on, None outside a git checkout
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# Run every stage once on size synthetic responses, split over the six old/new campaigns.
+# Returns the stage records of the run (see run_metrics.RunMetrics).
+def run_pipeline(size, seed):
+    forms = {
+        (category, is_old_campaign): generate_responses(size // len(FORMS) + (i < size % len(FORMS)), category, is_old_campaign, seed=seed + i)
+        for i, (category, is_old_campaign) in enumerate(FORMS)
+    }
+    roster = generate_escape_roster(seed=seed)
+    gc.collect()
+
+    with measure_run(f"bench_{size}") as run:
+        frames = {}
+        for (category, is_old_campaign), responses in forms.items():
+            target_fields, rename_columns, columns = FORM_PIPELINES[category]
+            field_mapping = extract_field_mapping(responses, target_fields[0] if is_old_campaign else target_fields[1])
+
+            with measure_stage("process_api_data", len(responses)) as record:
+                df = process_api_data(responses, field_mapping)
+                record["rows_out"] = len(df)
+            with measure_stage("generate_invoice_number", len(df)) as record:
+                df = generate_invoice_number(df, field_mapping, category, is_old_campaign=is_old_campaign)
+                record["rows_out"] = len(df)
+            if category == "conference":
+                with measure_stage("combine_account_codes", len(df)) as record:
+                    df = combine_account_codes(df, field_mapping)
+                    record["rows_out"] = len(df)
+            frames.setdefault(category, []).append(rename_columns(df, field_mapping, columns))
+        del forms
+
+        with measure_stage("normalize_escape_roster", len(roster)) as record:
+            df_escape = normalize_escape_roster(roster)
+            record["rows_out"] = len(df_escape)
+
+        prepared = {}
+        for category, parts in frames.items():
+            df = pd.concat(parts, ignore_index=True)
+            with measure_stage("prepare_dataframes", len(df)) as record:
+                prepared[category] = prepare_dataframes(df)
+                record["rows_out"] = len(prepared[category])
+
+        rows_in = sum(len(df) for df in prepared.values())
+        with measure_stage("merge_and_compare_data_combined", rows_in) as record:
+            final_comparison_df = merge_and_compare_data_combined(prepared["expense"], df_escape, prepared["mileage"], prepared["conference"])
+            record["rows_out"] = len(final_comparison_df)
+
+        with measure_stage("create_matched_data_sheet", len(final_comparison_df)) as record:
+            matched_df = create_matched_data_sheet(final_comparison_df)
+            record["rows_out"] = len(matched_df)
+
+        with measure_stage("save_to_excel", rows_in + len(df_escape) + len(final_comparison_df)) as record:
+            record["bytes"] = save_to_excel(prepared["expense"], prepared["mileage"], prepared["conference"], df_escape, final_comparison_df).getbuffer().nbytes
+
+        with measure_stage("save_to_excel_final", len(matched_df)) as record:
+            record["bytes"] = save_to_excel_final(matched_df).getbuffer().nbytes
+    return run.stages
+
+
+# Stage records of one run summed per stage (the form stages run once per form)
+def summarize(stages):
+    totals = {}
+    for record in stages:
+        total = totals.setdefault(record["stage"], {"seconds": 0.0, "rows_in": 0, "rows_out": 0, "bytes": None, "peak_rss_bytes": None})
+        total["seconds"] += record["seconds"]
+        total["rows_in"] += record["rows_in"] or 0
+        total["rows_out"] += record["rows_out"] or 0
+        if record["bytes"] is not None:
+            total["bytes"] = (total["bytes"] or 0) + record["bytes"]
+        if record["peak_rss_bytes"] is not None:
+            total["peak_rss_bytes"] = max(total["peak_rss_bytes"] or 0, record["peak_rss_bytes"])
+    return totals
+
+
+# Latest stored result per (stage, responses)
+def load_previous(path):
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                previous[(result["stage"], result["responses"])] = result
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every logic.py stage on synthetic Informed K12 data and store the results.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="total responses per run, split over the six campaigns")
+    parser.add_argument("--repeats", type=int, default=1, help="runs per size; the fastest time of each stage is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--results", default=RESULTS_PATH, help="JSON lines file the results are appended to")
+    parser.add_argument("--no-save", action="store_true", help="compare against the stored results without adding to them")
+    args = parser.parse_args()
+
+    previous = load_previous(args.results)
+    meta = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.node(),
+    }
+
+    results = []
+    print(f"{'stage':<34}{'responses':>10}{'rows in':>10}{'seconds':>10}{'rows/s':>12}{'peak MB':>9}{'previous':>10}")
+    for size in args.sizes:
+        best = {}
+        for _ in range(args.repeats):
+            for stage, total in summarize(run_pipeline(size, args.seed)).items():
+                if stage not in best or total["seconds"] < best[stage]["seconds"]:
+                    best[stage] = total
+
+        for stage in STAGES:
+            total = best[stage]
+            result = {**meta, "stage": stage, "responses": size, **total, "seconds": round(total["seconds"], 6)}
+            results.append(result)
+
+            before = previous.get((stage, size))
+            change = ""
+            if before:
+                ratio = result["seconds"] / before["seconds"] if before["seconds"] else float("inf")
+                change = f"{ratio:.2f}x"
+                if ratio > REGRESSION_RATIO and result["seconds"] > REGRESSION_MIN_SECONDS:
+                    change += " REGRESSION"
+            rate = total["rows_in"] / total["seconds"] if total["seconds"] else float("inf")
+            peak = f"{total['peak_rss_bytes'] / 2 ** 20:.0f}" if total["peak_rss_bytes"] else "-"
+            print(f"{stage:<34}{size:>10}{total['rows_in']:>10}{total['seconds']:>10.3f}{rate:>12.0f}{peak:>9}{change:>10}")
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.results), exist_ok=True)
+        with open(args.results, "a", encoding="utf-8", newline="\n") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+        print(f"Results appended to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
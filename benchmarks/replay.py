@@ -0,0 +1,388 @@
+import argparse
+import base64
+import email.parser
+import email.policy
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+import httplib2
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from googleapiclient.discovery import build
+import config
+import drive_ops
+import logic
+import main as jobs
+from response_store import ResponseStore
+from run_metrics import RUN_REPORT_FILE
+
+logger = logging.getLogger(__name__)
+
+JOBS = jobs.JOBS
+
+INDEX_FILE = "index.json"
+MANIFEST_FILE = "manifest.json"
+
+# Query parameters computed from the clock when the request is made. They are left out of the
+# key of a recorded request, so a capture replays on any day.
+VOLATILE_PARAMS = {"completedAtStart", "completedAtEnd", config.WATERMARK_PARAM}
+
+# Upload sessions of the fake Drive live under this made-up host
+FAKE_UPLOAD_URL = "https://fake-drive.invalid/upload/"
+
+
+# Key of a recorded request: method, host, path and the sorted query without volatile parameters
+def request_key(method, url):
+    parts = urllib.parse.urlsplit(url)
+    query = sorted(
+        (name, value) for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if name not in VOLATILE_PARAMS
+    )
+    return f"{method} {parts.netloc}{parts.path}?{urllib.parse.urlencode(query)}"
+
+
+# Recorded responses of one source (Informed K12 or Drive) in a directory: one JSON file per
+# request with its status, headers and base64 body, and index.json mapping request keys to files.
+# A request made more than once keeps its first response.
+class Capture:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.index = {}
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+
+    def save(self, key, status, headers, body):
+        file_name = hashlib.sha1(key.encode()).hexdigest()[:20] + ".json"
+        with self.lock:
+            if key in self.index:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, file_name), "w", encoding="utf-8", newline="\n") as f:
+                json.dump({"key": key, "status": status, "headers": headers, "body": base64.b64encode(body).decode("ascii")}, f)
+            self.index[key] = file_name
+
+    # (status, headers, body) of a recorded request, None when it was not recorded
+    def load(self, key):
+        file_name = self.index.get(key)
+        if file_name is None:
+            return None
+        with open(os.path.join(self.directory, file_name), "r", encoding="utf-8") as f:
+            recorded = json.load(f)
+        return recorded["status"], recorded["headers"], base64.b64decode(recorded["body"])
+
+    def close(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, INDEX_FILE), "w", encoding="utf-8", newline="\n") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+
+
+# Transport for the Informed K12 session that saves every successful response it receives
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, capture, **kwargs):
+        super().__init__(**kwargs)
+        self.capture = capture
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if response.status_code == 200:
+            # The body is stored decoded; Content-Length keeps the wire size for the byte stats
+            headers = {"Content-Type": response.headers.get("Content-Type", "application/json")}
+            headers["Content-Length"] = response.headers.get("Content-Length") or str(len(response.content))
+            self.capture.save(request_key(request.method, request.url), response.status_code, headers, response.content)
+        return response
+
+
+# Transport for the Informed K12 session that answers from a capture. A request that was not
+# recorded gets a 404, which fails the run the same way a live error would.
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, capture):
+        super().__init__()
+        self.capture = capture
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = "utf-8"
+        recorded = self.capture.load(request_key(request.method, request.url))
+        if recorded is None:
+            logger.error(f"Not in the capture: {request.method} {request.url}")
+            response.status_code = 404
+            response._content = b"{}"
+        else:
+            response.status_code, headers, response._content = recorded
+            response.headers.update(headers)
+        return response
+
+    def close(self):
+        pass
+
+
+# A JSON body as the (httplib2.Response, content) pair googleapiclient expects
+def json_response(status, body, headers=None):
+    return httplib2.Response({"status": str(status), "content-type": "application/json", **(headers or {})}), json.dumps(body).encode()
+
+
+# Local stand-in for the Drive calls that change something: resumable and multipart uploads,
+# file updates (moving to the trash) and batch requests of them. Uploaded files are written to
+# output_dir under their Drive name; nothing leaves the machine.
+class FakeDrive:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.created = []
+        self.updated = []
+        self.next_id = 0
+
+    def handles(self, method, uri):
+        return method != "GET" or uri.startswith(FAKE_UPLOAD_URL)
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return f"fake-{self.next_id}"
+
+    def request(self, uri, method, body, headers):
+        path = urllib.parse.urlsplit(uri).path
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(uri).query))
+        if uri.startswith(FAKE_UPLOAD_URL):
+            return self.upload_chunk(uri, body, headers)
+        if path.startswith("/batch/"):
+            return self.batch(body, headers)
+        if method == "POST" and query.get("uploadType") == "resumable":
+            metadata = json.loads(body or "{}")
+            session = self.new_id()
+            with self.lock:
+                self.sessions[session] = {"metadata": metadata, "data": bytearray()}
+            return httplib2.Response({"status": "200", "location": FAKE_UPLOAD_URL + session}), b""
+        if method == "POST" and path.endswith("/files"):
+            return json_response(200, self.create({"name": "untitled"} if query.get("uploadType") else json.loads(body or "{}"), b""))
+        if method == "PATCH":
+            file_id = path.rsplit("/", 1)[-1]
+            with self.lock:
+                self.updated.append((file_id, json.loads(body or "{}")))
+            return json_response(200, {"id": file_id})
+        logger.error(f"Fake Drive cannot answer {method} {uri}")
+        return json_response(404, {"error": {"code": 404, "message": "Not supported by the fake Drive"}})
+
+    # One chunk of a resumable upload, or a status query ("bytes */total") after an error
+    def upload_chunk(self, uri, body, headers):
+        session_id = uri[len(FAKE_UPLOAD_URL):]
+        with self.lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            return json_response(404, {"error": {"code": 404, "message": "Unknown upload session"}})
+
+        content_range = {key.lower(): value for key, value in headers.items()}.get("content-range", "")
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", content_range)
+        if match:
+            data = body.read() if hasattr(body, "read") else (body or b"")
+            start = int(match.group(1))
+            del session["data"][start:]
+            session["data"].extend(data)
+        total = content_range.rsplit("/", 1)[-1]
+        if total != "*" and len(session["data"]) >= int(total):
+            with self.lock:
+                del self.sessions[session_id]
+            return json_response(200, self.create(session["metadata"], bytes(session["data"])))
+        received = {"range": f"bytes=0-{len(session['data']) - 1}"} if session["data"] else {}
+        return httplib2.Response({"status": "308", **received}), b""
+
+    def create(self, metadata, data):
+        file_id = self.new_id()
+        name = os.path.basename(metadata.get("name") or file_id)
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, name), "wb") as f:
+            f.write(data)
+        with self.lock:
+            self.created.append({"id": file_id, "name": name, "bytes": len(data)})
+        return {"id": file_id, "name": name, "webViewLink": f"file://{os.path.abspath(os.path.join(self.output_dir, name))}"}
+
+    # Answer each call of a multipart/mixed batch request with its own fake response
+    def batch(self, body, headers):
+        content_type = {key.lower(): value for key, value in headers.items()}.get("content-type", "")
+        if isinstance(body, str):
+            body = body.encode()
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+        )
+        boundary = "batch_fake_drive"
+        parts = []
+        for part in message.iter_parts():
+            content_id = part["Content-ID"].strip("<>")
+            # The part is an HTTP request: request line, headers, blank line, body
+            head, _, request_body = part.get_payload().replace("\r\n", "\n").partition("\n\n")
+            method, uri = head.split("\n", 1)[0].split()[:2]
+            response, content = self.request(urllib.parse.urljoin("https://www.googleapis.com", uri), method, request_body.strip() or None, {})
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {response.status} OK\r\nContent-Type: application/json\r\n\r\n{content.decode()}\r\n"
+            )
+        content = "".join(parts) + f"--{boundary}--\r\n"
+        return httplib2.Response({"status": "200", "content-type": f"multipart/mixed; boundary={boundary}"}), content.encode()
+
+
+# httplib2-compatible connection for the Drive client. Reads (file lists, metadata, downloads)
+# go to live_http and are recorded when it is given, and are answered from the capture when it
+# is not. Writes always go to the fake Drive.
+class DriveHttp:
+    def __init__(self, capture, fake_drive, live_http=None):
+        self.capture = capture
+        self.fake_drive = fake_drive
+        self.live_http = live_http
+        self.lock = threading.Lock()
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        if self.fake_drive.handles(method, uri):
+            return self.fake_drive.request(uri, method, body, headers or {})
+
+        key = request_key(method, uri)
+        if self.live_http is not None:
+            with self.lock:
+                response, content = self.live_http.request(uri, method, body=body, headers=headers, redirections=redirections, connection_type=connection_type)
+            if response.status in (200, 206):
+                self.capture.save(key, response.status, {name: value for name, value in response.items() if name != "status"}, content)
+            return response, content
+
+        recorded = self.capture.load(key)
+        if recorded is None:
+            logger.error(f"Not in the capture: {method} {uri}")
+            return json_response(404, {"error": {"code": 404, "message": "Not in the capture"}})
+        status, headers, content = recorded
+        return httplib2.Response({**headers, "status": str(status)}), content
+
+
+# Point the jobs at the capture: the Informed K12 session gets the recording or replaying
+# transport, the Drive client drive_http and every upload thread shares drive_http too. State
+# (response store, roster cache) lives in work_dir so nothing of a scheduled install is read or
+# changed, and the incremental fetch and unchanged-run skip are off so every run does the full
+# work against the same requests.
+def install(informed_adapter, drive_http, work_dir, metrics_dir):
+    logic.informed_client.session.mount("https://", informed_adapter)
+    logic.informed_client.session.mount("http://", informed_adapter)
+
+    drive_service = build("drive", "v3", http=drive_http, static_discovery=True)
+    logic.drive_service = drive_service
+    jobs.drive_service = drive_service
+    drive_ops.new_connection = lambda credentials: drive_http
+
+    # Every replay starts with empty shared caches, so repeats are comparable
+    logic.clear_shared_caches()
+    logic.INCREMENTAL_FETCH = False
+    logic.SKIP_UNCHANGED_RUNS = False
+    logic.ROSTER_CACHE_DIR = os.path.join(work_dir, "roster")
+    logic.response_store = ResponseStore(os.path.join(work_dir, "responses.sqlite3"), logic.TARGET_FIELDS_BY_CAMPAIGN, logic.WATERMARK_FIELD)
+    jobs.METRICS_DIR = metrics_dir
+
+
+# Last run report written to metrics_dir
+def last_report(metrics_dir):
+    with open(os.path.join(metrics_dir, RUN_REPORT_FILE), "r", encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1])
+
+
+def print_report(report, label):
+    peak = f"{report['peak_rss_bytes'] / 2 ** 20:.0f} MB" if report["peak_rss_bytes"] else "-"
+    print(f"{label}: {report['outcome']} in {report['seconds']:.2f}s, peak memory {peak}")
+    totals = {}
+    for record in report["stages"]:
+        totals[record["stage"]] = totals.get(record["stage"], 0.0) + record["seconds"]
+    for stage, seconds in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {stage:<20}{seconds:>10.3f}s")
+
+
+# Run the job once against the live APIs and save every Informed K12 page and Drive read to
+# capture_dir. Uploads and trash calls go to the fake Drive, so the live folder is left alone.
+def record(job, capture_dir):
+    informed = Capture(os.path.join(capture_dir, "informed"))
+    drive = Capture(os.path.join(capture_dir, "drive"))
+    fake_drive = FakeDrive(os.path.join(capture_dir, "recorded_output"))
+    adapter = RecordingAdapter(informed, pool_connections=config.MAX_CONCURRENT_REQUESTS, pool_maxsize=config.MAX_CONCURRENT_REQUESTS, max_retries=0)
+    drive_http = DriveHttp(drive, fake_drive, live_http=drive_ops.new_connection(logic.creds))
+
+    work_dir = tempfile.mkdtemp(prefix="intellication_record_")
+    try:
+        install(adapter, drive_http, work_dir, os.path.join(capture_dir, "metrics"))
+        JOBS[job]()
+    finally:
+        informed.close()
+        drive.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = last_report(os.path.join(capture_dir, "metrics"))
+    with open(os.path.join(capture_dir, MANIFEST_FILE), "w", encoding="utf-8", newline="\n") as f:
+        json.dump({
+            "job": job,
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "outcome": report["outcome"],
+            "informed_requests": len(informed.index),
+            "drive_requests": len(drive.index),
+        }, f, indent=1)
+    print_report(report, f"Recorded {job}")
+    print(f"{len(informed.index)} Informed K12 and {len(drive.index)} Drive responses saved to {capture_dir}")
+
+
+# Run the recorded job repeats times from the capture, each with fresh state, and print the
+# run reports. Uploaded workbooks are written to output_dir and the reports appended to
+# output_dir/metrics/runs.jsonl for comparing versions. Peak memory is per process, so a
+# repeat reports the highest value of the runs so far.
+def replay(capture_dir, output_dir, repeats):
+    with open(os.path.join(capture_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    informed = Capture(os.path.join(capture_dir, "informed"))
+    drive = Capture(os.path.join(capture_dir, "drive"))
+    metrics_dir = os.path.join(output_dir, "metrics")
+
+    reports = []
+    for repeat in range(repeats):
+        fake_drive = FakeDrive(output_dir)
+        work_dir = tempfile.mkdtemp(prefix="intellication_replay_")
+        try:
+            install(ReplayAdapter(informed), DriveHttp(drive, fake_drive), work_dir, metrics_dir)
+            JOBS[manifest["job"]]()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        report = last_report(metrics_dir)
+        reports.append(report)
+        print_report(report, f"Replay {repeat + 1} of {manifest['job']}")
+        uploaded = ", ".join(f"{file['name']} ({file['bytes']} bytes)" for file in fake_drive.created)
+        print(f"  uploaded {uploaded or 'nothing'}")
+
+    if len(reports) > 1:
+        print(f"Fastest of {len(reports)}: {min(report['seconds'] for report in reports):.2f}s")
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record a job's Informed K12 and Drive traffic, or replay a recording offline with a fake Drive.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="run a job against the live APIs and save what it reads")
+    record_parser.add_argument("capture_dir")
+    record_parser.add_argument("--job", choices=sorted(JOBS), default="completed")
+    replay_parser = commands.add_parser("replay", help="run the recorded job from the capture")
+    replay_parser.add_argument("capture_dir")
+    replay_parser.add_argument("--output", help="directory for the uploaded workbooks and run reports (default CAPTURE_DIR/replay_output)")
+    replay_parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "record":
+        record(args.job, args.capture_dir)
+    else:
+        replay(args.capture_dir, args.output or os.path.join(args.capture_dir, "replay_output"), args.repeats)
+
+
+if __name__ == "__main__":
+    main()
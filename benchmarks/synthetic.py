@@ -0,0 +1,199 @@
+import random
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import config
+
+# Widths of the nine segments of a valid account code, e.g. 010-0000-0-1110-0000-4300-000-0000-0000
+ACCOUNT_SEGMENT_WIDTHS = (3, 4, 1, 4, 4, 4, 3, 4, 4)
+
+FIRST_NAMES = ["Maria", "James", "Wei", "Aisha", "Carlos", "Priya", "John", "Fatima", "Luis", "Emily", "Omar", "Grace"]
+LAST_NAMES = ["Garcia", "Smith", "Nguyen", "Patel", "Johnson", "Kim", "Lopez", "Brown", "Chen", "Davis", "Singh", "Wilson"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# Number of noise fields (questions the pipeline discards) on every form
+NOISE_FIELDS = 40
+
+# Employee ids used on the forms and the roster, about the size of the district
+EMPLOYEE_IDS = list(range(10000, 12000))
+
+CAMPAIGN_MAPPINGS = {
+    "expense": config.RENAME_MAPPING_EXPENSE,
+    "mileage": config.RENAME_MAPPING_MILEAGE,
+    "conference": config.COLUMN_MAPPING_CONFERENCE,
+}
+
+TARGET_FIELDS = {
+    ("expense", False): config.target_fields_expense,
+    ("mileage", False): config.target_fields_mileage,
+    ("conference", False): config.target_fields_conference,
+    ("expense", True): config.target_fields_expense_old,
+    ("mileage", True): config.target_fields_mileage_old,
+    ("conference", True): config.target_fields_conference_old,
+}
+
+ACCOUNT_SEGMENT_FIELDS = [sorted(config.account_code_1_fields), sorted(config.account_code_2_fields), sorted(config.account_code_3_fields)]
+
+
+# Role of a field number in a campaign layout, used to pick realistic values
+def field_role(category, number, is_old_campaign):
+    if is_old_campaign and number == config.invoice_field_old.get(category):
+        return "invoice"
+    if not is_old_campaign and number in config.date_fields_new.get(category, []):
+        return "date"
+    if category == "conference":
+        for group_index, group in enumerate(ACCOUNT_SEGMENT_FIELDS):
+            if number in group:
+                return ("segment", group_index, group.index(number))
+
+    name = CAMPAIGN_MAPPINGS[category].get(number, "")
+    if name == "Invoice Date":
+        return "date"
+    if name == "Employee #":
+        return "employee"
+    if name in ("First", "Last"):
+        return name.lower()
+    if name == "Email_API":
+        return "email"
+    if name.startswith("Account Code") and name.endswith("Total") or name == "Total Reimbursement":
+        return "amount"
+    if name.startswith("Account Code"):
+        return "account"
+    return "text"
+
+
+def random_date(rng, start=datetime(2024, 6, 1), days=540):
+    date = start + timedelta(days=rng.randrange(days))
+    if rng.random() < 0.3:
+        return f"{date.month}/{date.day}/{date.year}"
+    return date.strftime("%m/%d/%Y")
+
+
+def random_account(rng):
+    roll = rng.random()
+    segments = ["".join(rng.choice("0123456789") for _ in range(width)) for width in ACCOUNT_SEGMENT_WIDTHS]
+    if roll < 0.80:
+        return "-".join(segments)
+    if roll < 0.85:
+        return ".".join(segments)
+    if roll < 0.90:
+        return "-".join(segments[:-1])
+    if roll < 0.95:
+        return "BILL SUNOL GLEN"
+    return ""
+
+
+def random_amount(rng):
+    roll = rng.random()
+    value = rng.uniform(1, 2500)
+    if roll < 0.6:
+        return f"{value:.2f}"
+    if roll < 0.8:
+        return f"{value:,.2f}"
+    if roll < 0.9:
+        return str(int(value))
+    if roll < 0.95:
+        return ""
+    return "N/A"
+
+
+def random_employee_id(rng, employee_ids):
+    roll = rng.random()
+    employee_id = rng.choice(employee_ids)
+    if roll < 0.85:
+        return str(employee_id)
+    if roll < 0.92:
+        return f"F0{employee_id}"
+    if roll < 0.96:
+        return str(rng.randrange(900000, 999999))
+    return ""
+
+
+# Value for one field of one form
+def field_value(rng, role, form_state, employee_ids):
+    if role == "date":
+        return random_date(rng) if rng.random() < 0.7 else ""
+    if role == "invoice":
+        return f"{rng.choice(MONTHS)} {rng.choice([2024, 2025])} {rng.randrange(1000)}" if rng.random() < 0.9 else ""
+    if role == "employee":
+        return random_employee_id(rng, employee_ids)
+    if role == "first":
+        return rng.choice(FIRST_NAMES)
+    if role == "last":
+        return rng.choice(LAST_NAMES)
+    if role == "email":
+        return f"{rng.choice(FIRST_NAMES).lower()}.{rng.choice(LAST_NAMES).lower()}@pleasantonusd.net"
+    if role == "account":
+        return random_account(rng)
+    if role == "amount":
+        return random_amount(rng)
+    if isinstance(role, tuple):
+        # Conference account codes arrive as nine separate segment questions
+        segments = form_state.setdefault(role[1], random_account(rng).replace(".", "-").split("-"))
+        return segments[role[2]] if role[2] < len(segments) else ""
+    return rng.choice(["Yes", "No", "Conference travel", "Supplies", ""])
+
+
+# Generate n synthetic Informed K12 responses for a campaign layout. The forms carry the
+# campaign's target fields plus NOISE_FIELDS discarded questions, like the real API.
+def generate_responses(n, category, is_old_campaign=False, seed=0, employee_ids=None, noise_fields=NOISE_FIELDS):
+    rng = random.Random(seed)
+    employee_ids = employee_ids or EMPLOYEE_IDS
+    target_fields = sorted(TARGET_FIELDS[(category, is_old_campaign)])
+    noise = list(range(1000, 1000 + noise_fields))
+    roles = {number: field_role(category, number, is_old_campaign) for number in target_fields}
+    labels = {number: f"Q{number} {CAMPAIGN_MAPPINGS[category].get(number, 'Question')}" for number in target_fields + noise}
+
+    # Questions appear in the same order on every form of a campaign, noise interleaved
+    layout = target_fields + noise
+    rng.shuffle(layout)
+
+    base_time = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    responses = []
+    for i in range(n):
+        form_state = {}
+        fields = []
+        for number in layout:
+            if number in roles:
+                value = field_value(rng, roles[number], form_state, employee_ids)
+            else:
+                value = rng.choice(["Yes", "No", "", "Lorem ipsum dolor sit amet"])
+            fields.append({"number": number, "label": labels[number], "value": value})
+        completed_at = base_time + timedelta(minutes=i)
+        responses.append({
+            "id": seed * 10_000_000 + i,
+            "status": "pending",
+            "completedAt": completed_at.isoformat(),
+            "updatedAt": (completed_at + timedelta(minutes=rng.randrange(60))).isoformat(),
+            "fields": fields,
+        })
+    return responses
+
+
+# Field mapping the pipeline would extract for a campaign layout
+def generate_field_mapping(category, is_old_campaign=False):
+    target_fields = TARGET_FIELDS[(category, is_old_campaign)]
+    return {number: f"Q{number} {CAMPAIGN_MAPPINGS[category].get(number, 'Question')}" for number in target_fields}
+
+
+# Synthetic Escape roster the way it is read from the Drive xlsx, before the headers are renamed.
+# Most ids are numbers; some carry an F0 prefix, are text or are blank. A few employees are
+# missing so their forms come out as Not Found, and a few are terminated or have no email.
+def generate_escape_roster(employee_ids=None, seed=0, missing_share=0.03):
+    rng = random.Random(seed)
+    rows = []
+    for employee_id in employee_ids or EMPLOYEE_IDS:
+        if rng.random() < missing_share:
+            continue
+        roll = rng.random()
+        if roll < 0.90:
+            roster_id = employee_id
+        elif roll < 0.95:
+            roster_id = f"F0{employee_id}"
+        elif roll < 0.99:
+            roster_id = str(employee_id)
+        else:
+            roster_id = ""
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        email = f"{first.lower()}.{last.lower()}@pleasantonusd.net" if rng.random() < 0.97 else None
+        rows.append([rng.choice([33, 34, 35]), last, first, roster_id, "A" if rng.random() < 0.95 else "T", email])
+    return pd.DataFrame(rows, columns=["Org Id", "Last Name", "First Name", "Employee ID", "Status", "Email"])
@@ -0,0 +1,82 @@
+import argparse
+import json
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+import requests
+import config
+from benchmarks.synthetic import generate_responses
+from webhooks import sign
+
+DEFAULT_URL = f"http://localhost:{config.SERVICE_PORT}"
+
+
+# Response events for synthetic responses, spread over the campaigns of categories: each
+# response is submitted once, a duplicate_share of them is delivered twice and an archive_share
+# is archived later in the stream
+def sample_events(count, categories, seed, duplicate_share, archive_share):
+    rng = random.Random(seed)
+    campaigns = [
+        (category, is_old_campaign, config.CAMPAIGN_IDS[category]["old" if is_old_campaign else "new"])
+        for category in categories for is_old_campaign in (True, False)
+    ]
+    events = []
+    for i, (category, is_old_campaign, campaign_id) in enumerate(campaigns):
+        share = count // len(campaigns) + (i < count % len(campaigns))
+        for response in generate_responses(share, category, is_old_campaign, seed=seed * 100 + i + 1):
+            events.append({"event": "response.submitted", "campaignId": campaign_id, "response": response})
+    rng.shuffle(events)
+
+    for event in rng.sample(events, int(len(events) * duplicate_share)):
+        events.insert(rng.randrange(events.index(event), len(events)) + 1, event)
+    for event in rng.sample(events, int(len(events) * archive_share)):
+        archived = dict(event["response"], status="archived")
+        archived["updatedAt"] = (datetime.fromisoformat(archived["updatedAt"]) + timedelta(days=1)).isoformat()
+        events.append({"event": "response.archived", "campaignId": event["campaignId"], "response": archived})
+    return events
+
+
+# POST the events to the service in bursts of burst events, pause seconds apart, signed with
+# secret when it is set. Returns the count of each answer.
+def post_events(base_url, events, burst, pause, secret):
+    session = requests.Session()
+    answers = Counter()
+    for start in range(0, len(events), burst):
+        for event in events[start:start + burst]:
+            body = json.dumps(event).encode()
+            headers = {"Content-Type": "application/json"}
+            if secret:
+                headers[config.WEBHOOK_SIGNATURE_HEADER] = sign(secret, body)
+            response = session.post(f"{base_url}/webhooks/informed", data=body, headers=headers, timeout=30)
+            answer = response.json() if response.headers.get("Content-Type", "").startswith("application/json") else {}
+            answers[f"{response.status_code} {'stored' if answer.get('stored') else answer.get('reason') or answer.get('detail', '')}"] += 1
+        if start + burst < len(events):
+            time.sleep(pause)
+    return answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post sample Informed K12 response events to a running service (python service.py).")
+    parser.add_argument("--url", default=DEFAULT_URL, help="service base URL")
+    parser.add_argument("--events", type=int, default=60, help="responses to submit")
+    parser.add_argument("--categories", nargs="+", default=sorted(config.CAMPAIGN_IDS), choices=sorted(config.CAMPAIGN_IDS))
+    parser.add_argument("--burst", type=int, default=20, help="events per burst")
+    parser.add_argument("--pause", type=float, default=5.0, help="seconds between bursts")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of events delivered twice")
+    parser.add_argument("--archive", type=float, default=0.05, help="share of responses archived afterwards")
+    parser.add_argument("--seed", type=int, default=int(time.time()) % 10_000)
+    parser.add_argument("--secret", default=config.WEBHOOK_SECRET)
+    parser.add_argument("--token", default=config.SERVICE_API_TOKEN, help="service API token, for the pending builds")
+    args = parser.parse_args()
+
+    events = sample_events(args.events, args.categories, args.seed, args.duplicates, args.archive)
+    print(f"Posting {len(events)} events to {args.url} in bursts of {args.burst}")
+    for answer, count in sorted(post_events(args.url, events, args.burst, args.pause, args.secret).items()):
+        print(f"  {count:>5}  {answer}")
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    print("Builds waiting:", requests.get(f"{args.url}/webhooks/pending", headers=headers, timeout=30).json())
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,15 @@ DRIVE_CREDENTIALS = './informedk12-reimbursement-aac169d07799.json'
 
 SCOPES = ['https://www.googleapis.com/auth/drive']
 
+# Google Drive calls per batch request (Drive allows 100) and output files uploaded at once
+DRIVE_BATCH_SIZE = 100
+DRIVE_UPLOAD_WORKERS = 2
+
+# Outputs are uploaded from memory in resumable chunks of UPLOAD_CHUNK_SIZE bytes (a multiple of
+# 256 KiB). An upload cut off by a network error resumes up to UPLOAD_MAX_RESUMES times.
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+UPLOAD_MAX_RESUMES = 5
+
 # Google Drive Folder IDs
 # GOOGLE_DRIVE_FOLDER_ID_COMPLETED = "1sUzyfZw7wwA0lwBGHovIGRLfnRh9kj0z"
 GOOGLE_DRIVE_FOLDER_ID_COMPLETED = "138Gy6v8UaRAgDuexrkbkJQt3Rhd7Npf0"
@@ -14,11 +23,85 @@ GOOGLE_DRIVE_FOLDER_ID_ARCHIVED = "138Gy6v8UaRAgDuexrkbkJQt3Rhd7Npf0"
 FILE_NAME_TO_DOWNLOAD = "PUSD Employee Escape Data.xlsx" 
 # Escape File Folder ID
 GOOGLE_DRIVE_FOLDER_ID1 = "1o-kOlAHUNHMzDakkCakMjA2Swg0QtH3v"
+# Local copy of the parsed Escape roster, rebuilt only when the Drive file changes
+ROSTER_CACHE_DIR = "./state/roster"
 
 # Informed K12 URLs
 URL = "https://app.informedk12.com/api/v1/campaigns/"
 STATUS_COMPLETED = "/responses?statusGroup=pending"
 STATUS_ARCHIVED = "archived"
+STATUS_PENDING = "pending"
+
+# Maximum number of Informed K12 requests in flight at once across all campaigns
+MAX_CONCURRENT_REQUESTS = 6
+
+# Informed K12 client timeouts (connect, read) in seconds and retry policy
+REQUEST_TIMEOUT = (5, 60)
+MAX_RETRIES = 5
+RETRY_BACKOFF_FACTOR = 1
+RETRY_BACKOFF_MAX = 60
+
+# Worker processes for the six per-form pipelines (old and new expense, mileage and conference).
+# 1 runs them one after another in the job's own process. Sending the responses to a worker costs
+# more than the pipelines themselves at the usual sizes, so the pool is only used on hosts with
+# several CPUs, when PIPELINE_WORKERS > 1 and a run has at least PIPELINE_MIN_RESPONSES responses.
+PIPELINE_WORKERS = 1
+PIPELINE_MIN_RESPONSES = 100000
+
+# Incremental fetching of completed responses. Only responses whose WATERMARK_FIELD is newer
+# than the saved high-water mark are requested; a full download runs every FULL_RESYNC_HOURS.
+# Archived responses use the same watermark inside the 7 week completed window.
+INCREMENTAL_FETCH = True
+STATE_DIR = "./state"
+WATERMARK_FIELD = "updatedAt"
+WATERMARK_PARAM = "updatedAtStart"
+WATERMARK_OVERLAP_SECONDS = 300
+FULL_RESYNC_HOURS = 24
+
+# Local SQLite store of the fetched responses (target fields only). When the API fails a job
+# fails, unless OFFLINE_FALLBACK is set: then it reads the stored responses, reports the run as
+# degraded and leaves the uploaded workbooks alone.
+RESPONSE_STORE_PATH = "./state/responses.sqlite3"
+OFFLINE_FALLBACK = False
+
+# Skip building and uploading the workbooks when the responses (ids and update times), the Escape
+# roster and this config are the same as in the job's last successful run
+SKIP_UNCHANGED_RUNS = True
+
+# Run reports: every run is appended to METRICS_DIR/runs.jsonl with the time, rows, bytes and peak
+# memory of each stage, and METRICS_DIR/intellication_<job>.prom holds the last run for the
+# Prometheus node_exporter textfile collector
+METRICS_DIR = "./state/metrics"
+
+# Cache shared by the job runs of one process (scheduler, service and webhook builds). Informed
+# K12 pages and the Escape roster lookup are reused for FETCH_CACHE_TTL_SECONDS, and a run that
+# needs one another run is fetching waits for it instead of fetching it again. At most
+# FETCH_CACHE_MAX_RESPONSES responses are kept; 0 seconds keeps only the waiting. The parsed
+# roster of the current Drive version stays in memory for ROSTER_MEMORY_TTL_SECONDS.
+FETCH_CACHE_TTL_SECONDS = 30
+FETCH_CACHE_MAX_RESPONSES = 20000
+ROSTER_MEMORY_TTL_SECONDS = 3600
+
+# On-demand service (python service.py). A finished run's results are served for
+# SERVICE_RESULT_TTL_SECONDS before a request for the same campaigns starts a new run, and the
+# last SERVICE_RUN_HISTORY runs can be looked up by id. The service listens on this machine only;
+# to listen on other interfaces set SERVICE_API_TOKEN, which the run and result endpoints then
+# require as "Authorization: Bearer <token>" (the webhook endpoint checks WEBHOOK_SECRET instead).
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8000
+SERVICE_API_TOKEN = ""
+SERVICE_RESULT_TTL_SECONDS = 300
+SERVICE_RUN_HISTORY = 100
+
+# Informed K12 response webhooks (POST /webhooks/informed on the service). Events are signed with
+# an HMAC-SHA256 hex digest of the body, keyed with WEBHOOK_SECRET, in the WEBHOOK_SIGNATURE_HEADER
+# header; while WEBHOOK_SECRET is empty the endpoint refuses every event. A build starts
+# WEBHOOK_DEBOUNCE_SECONDS after the last event of a burst, and at most WEBHOOK_MAX_DELAY_SECONDS
+# after its first event.
+WEBHOOK_SECRET = ""
+WEBHOOK_SIGNATURE_HEADER = "X-Informed-Signature"
+WEBHOOK_DEBOUNCE_SECONDS = 30
+WEBHOOK_MAX_DELAY_SECONDS = 300
 
 # New Campaign Ids
 campaign_id_expense = 173260
@@ -133,6 +216,16 @@ target_fields_expense_old = {80, 74, 4, 3, 2, 60, 61, 62, 63, 83, 9}
 target_fields_mileage_old = {488, 368, 1, 489, 490, 415, 144,  699, 416, 148}
 target_fields_conference_old = {137, 3, 2, 1, 118, 76, 77, 78, 79, 80, 81, 82, 83, 84, 86, 87, 88, 89, 90, 91, 92, 93, 94, 95, 97, 98, 99, 100, 101, 102, 103, 104, 105, 106, 108, 75}
 
+# Target field numbers kept in the response store for each campaign
+TARGET_FIELDS_BY_CAMPAIGN = {
+    campaign_id_expense: target_fields_expense,
+    campaign_id_mileage: target_fields_mileage,
+    campaign_id_conference: target_fields_conference,
+    old_campaign_id_expense: target_fields_expense_old,
+    old_campaign_id_mileage: target_fields_mileage_old,
+    old_campaign_id_conference: target_fields_conference_old,
+}
+
 # Invoice # field numbers - Old Campaign Ids
 invoice_field_old = {
     "expense": 80,
@@ -0,0 +1,125 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload, build_http
+
+logger = logging.getLogger(__name__)
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+XLSX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Drive accepts at most 100 calls in one batch request
+MAX_BATCH_SIZE = 100
+# Largest page files().list returns
+LIST_PAGE_SIZE = 1000
+# Longest wait in seconds before resuming an interrupted upload
+MAX_RESUME_WAIT = 30
+
+
+# A string as a quoted Drive query value
+def query_value(value):
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+# Files in a folder, filtered by name and mime type on the Drive side. mime_type keeps only that
+# type, exclude_mime_type drops one (e.g. FOLDER_MIME_TYPE). One list call per 1000 files.
+def list_files(drive_service, folder_id, name=None, mime_type=None, exclude_mime_type=None, fields="id, name, mimeType", drive_id=None):
+    clauses = [f"{query_value(folder_id)} in parents", "trashed=false"]
+    if name is not None:
+        clauses.append(f"name = {query_value(name)}")
+    if mime_type is not None:
+        clauses.append(f"mimeType = {query_value(mime_type)}")
+    if exclude_mime_type is not None:
+        clauses.append(f"mimeType != {query_value(exclude_mime_type)}")
+
+    files = []
+    page_token = None
+    while True:
+        response = drive_service.files().list(
+            q=" and ".join(clauses),
+            fields=f"nextPageToken, files({fields})",
+            pageSize=LIST_PAGE_SIZE,
+            corpora="drive" if drive_id else "user",
+            driveId=drive_id if drive_id else None,
+            includeItemsFromAllDrives=True,
+            supportsAllDrives=True,
+            pageToken=page_token
+        ).execute()
+        files.extend(response.get("files", []))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return files
+
+
+# Move files (dicts with id and name) to the trash, batch_size calls per batch request. Returns
+# the files that were trashed; a file Drive refuses is logged and left where it is.
+def trash_files(drive_service, files, batch_size=MAX_BATCH_SIZE):
+    trashed = []
+
+    def on_response(request_id, response, exception):
+        file = files[int(request_id)]
+        if exception is not None:
+            logger.warning(f"Failed to delete file {file['name']} (ID: {file['id']}): {exception}")
+        else:
+            trashed.append(file)
+
+    for start in range(0, len(files), batch_size):
+        batch = drive_service.new_batch_http_request(callback=on_response)
+        for position in range(start, min(start + batch_size, len(files))):
+            batch.add(
+                drive_service.files().update(fileId=files[position]["id"], body={"trashed": True}, supportsAllDrives=True),
+                request_id=str(position)
+            )
+        batch.execute()
+    return trashed
+
+
+# A new authorized connection. httplib2 connections are not thread-safe, so every upload
+# thread gets its own.
+def new_connection(credentials):
+    return AuthorizedHttp(credentials, http=build_http())
+
+
+# An upload error worth resuming after: the connection failed, Drive had a server error or
+# asked us to slow down. Anything else (bad request, expired session) is raised.
+def is_resumable_error(error):
+    if isinstance(error, HttpError):
+        return error.resp.status >= 500 or error.resp.status == 429
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+
+# Create a file from an in-memory buffer with a resumable upload of chunk_size byte chunks
+# (a multiple of 256 KiB). After a network or server error the upload waits and resumes from
+# the last byte Drive acknowledged, up to max_resumes times. After a failed chunk the client
+# library asks Drive for the received range before sending the next one.
+def upload_resumable(drive_service, credentials, metadata, buffer, mimetype, chunk_size, max_resumes, fields="id, webViewLink"):
+    buffer.seek(0)
+    media = MediaIoBaseUpload(buffer, mimetype=mimetype, chunksize=chunk_size, resumable=True)
+    request = drive_service.files().create(body=metadata, media_body=media, fields=fields, supportsAllDrives=True)
+    http = new_connection(credentials)
+
+    response = None
+    resumes = 0
+    while response is None:
+        try:
+            _, response = request.next_chunk(http=http)
+        except Exception as e:
+            if not is_resumable_error(e) or resumes >= max_resumes:
+                raise
+            resumes += 1
+            logger.warning(f"Upload of {metadata['name']} interrupted after {request.resumable_progress} bytes, resuming ({resumes}/{max_resumes}): {e}")
+            time.sleep(min(2 ** resumes, MAX_RESUME_WAIT))
+    return response
+
+
+# Create files from (metadata, buffer) pairs with resumable uploads, up to max_workers at a time,
+# and return the created files in the same order. Each upload runs on its own connection.
+def upload_files(drive_service, credentials, uploads, max_workers, chunk_size, max_resumes, mimetype=XLSX_MIME_TYPE):
+    def upload(metadata, buffer):
+        return upload_resumable(drive_service, credentials, metadata, buffer, mimetype, chunk_size, max_resumes)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(uploads)))) as executor:
+        return list(executor.map(lambda pair: upload(*pair), uploads))
@@ -0,0 +1,180 @@
+import datetime
+import math
+from copy import copy
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_float_dtype, is_integer_dtype, is_scalar
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+# Header style DataFrame.to_excel gives the column names
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=Side(style="thin"), right=Side(style="thin"), top=Side(style="thin"), bottom=Side(style="thin"))
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
+
+# Number formats DataFrame.to_excel gives dates and datetimes
+DATE_FORMAT = "YYYY-MM-DD"
+DATETIME_FORMAT = "YYYY-MM-DD HH:MM:SS"
+
+
+# Value and number format DataFrame.to_excel writes for one value: NaN and None as "" (empty cells),
+# infinity as "inf", numpy scalars as Python numbers and anything else unknown as str
+def excel_value(value):
+    if is_scalar(value) and pd.isna(value):
+        return "", None
+    if getattr(value, "tzinfo", None) is not None:
+        raise ValueError("Excel does not support datetimes with timezones. Please ensure that datetimes are timezone unaware before writing to Excel.")
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value), None
+    if isinstance(value, (int, np.integer)):
+        return int(value), None
+    if isinstance(value, (float, np.floating)):
+        if math.isinf(value):
+            return "inf" if value > 0 else "-inf", None
+        return float(value), None
+    if isinstance(value, datetime.datetime):
+        return value, DATETIME_FORMAT
+    if isinstance(value, datetime.date):
+        return value, DATE_FORMAT
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds() / 86400, "0"
+    return str(value), None
+
+
+# Values of one column ready for openpyxl, with their number formats (None when no value needs one)
+def excel_column(series):
+    if is_float_dtype(series.dtype) and isinstance(series.dtype, np.dtype):
+        values = series.to_numpy()
+        column = values.astype(object)
+        column[np.isnan(values)] = ""
+        column[np.isposinf(values)] = "inf"
+        column[np.isneginf(values)] = "-inf"
+        return column.tolist(), None
+    if (is_integer_dtype(series.dtype) or is_bool_dtype(series.dtype)) and isinstance(series.dtype, np.dtype):
+        return series.tolist(), None
+
+    values, formats = [], []
+    for value in series.tolist():
+        value, number_format = excel_value(value)
+        values.append(value)
+        formats.append(number_format)
+    return values, (formats if any(formats) else None)
+
+
+# Writes DataFrames to an .xlsx file the way DataFrame.to_excel(index=False) lays them out, in
+# openpyxl's write-only mode. Fills are decided before a sheet is written and applied while its
+# rows are streamed out, so the finished workbook is never loaded back into memory. path may be
+# a file name or a binary buffer.
+class StreamingExcelWriter:
+    def __init__(self, path):
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.styles = {}
+
+    def __enter__(self):
+        return self
+
+    # Saved when the block succeeds; on an error nothing is written to path
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def close(self):
+        self.workbook.save(self.path)
+        self.workbook.close()
+
+    # Close the workbook without saving it. Each streamed sheet keeps its rows in a temporary file
+    # that only saving removes, so the sheets are finished and their files removed here.
+    def discard(self):
+        for ws in self.workbook.worksheets:
+            if not ws.closed:
+                ws.close()
+            ws._writer.cleanup()
+        self.workbook.close()
+
+    # Cell with a style. Registering a style with the workbook hashes every part of it, so each
+    # distinct style is built once and its style ids are copied onto later cells.
+    def cell(self, ws, value, number_format=None, fill=None, font=None, border=None, alignment=None):
+        cell = WriteOnlyCell(ws, value=value)
+        key = (number_format, id(fill), id(font), id(border), id(alignment))
+        style = self.styles.get(key)
+        if style is None:
+            if number_format:
+                cell.number_format = number_format
+            if fill is not None:
+                cell.fill = fill
+            if font is not None:
+                cell.font = font
+            if border is not None:
+                cell.border = border
+            if alignment is not None:
+                cell.alignment = alignment
+            self.styles[key] = (copy(cell._style), fill, font, border, alignment)
+        else:
+            cell._style = copy(style[0])
+        return cell
+
+    # Cells placed to the right of the table, e.g. a legend, as 1-based column -> (value, fill)
+    def extra_cells(self, ws, row_cells, extras):
+        row_cells = list(row_cells)
+        for column in sorted(extras):
+            value, fill = extras[column]
+            row_cells.extend([None] * (column - 1 - len(row_cells)))
+            row_cells.append(self.cell(ws, value, fill=fill))
+        return row_cells
+
+    # Write df as a sheet. columns are the positions of the df columns to write (all by default),
+    # row_fill is (mask, fill) for whole rows, cell_fills maps a df column position to (mask, fill)
+    # and extra_cells maps a 1-based sheet row to {1-based column: (value, fill)}.
+    def write_sheet(self, sheet_name, df, columns=None, header_fill=None, row_fill=None, cell_fills=None, extra_cells=None):
+        ws = self.workbook.create_sheet(sheet_name)
+        columns = list(range(len(df.columns))) if columns is None else list(columns)
+        cell_fills = cell_fills or {}
+        extra_cells = extra_cells or {}
+
+        header = [
+            self.cell(ws, *excel_value(df.columns[position]), fill=header_fill, font=HEADER_FONT, border=HEADER_BORDER, alignment=HEADER_ALIGNMENT)
+            for position in columns
+        ]
+        ws.append(self.extra_cells(ws, header, extra_cells.get(1, {})))
+
+        n_rows = len(df)
+        data = [excel_column(df.iloc[:, position]) for position in columns]
+        row_mask = np.zeros(n_rows, dtype=bool) if row_fill is None else np.asarray(row_fill[0], dtype=bool)
+        fills = [cell_fills.get(position) for position in columns]
+        styled = row_mask.copy()
+        for fill in fills:
+            if fill is not None:
+                styled |= np.asarray(fill[0], dtype=bool)
+        for _, formats in data:
+            if formats is not None:
+                styled |= np.array([number_format is not None for number_format in formats])
+
+        # Only highlighted rows and values that need a number format are written as styled cells
+        for i, row_values in enumerate(zip(*(values for values, _ in data)) if data else ([()] * n_rows)):
+            if styled[i]:
+                row_cells = []
+                for k, value in enumerate(row_values):
+                    formats = data[k][1]
+                    if row_mask[i]:
+                        fill = row_fill[1]
+                    elif fills[k] is not None and fills[k][0][i]:
+                        fill = fills[k][1]
+                    else:
+                        fill = None
+                    row_cells.append(self.cell(ws, value, number_format=formats[i] if formats else None, fill=fill))
+            else:
+                row_cells = row_values
+            ws.append(self.extra_cells(ws, row_cells, extra_cells.get(i + 2, {})))
+
+        # Extra cells below the table
+        written = n_rows + 1
+        for row in sorted(r for r in extra_cells if r > written):
+            for _ in range(row - written - 1):
+                ws.append([])
+            ws.append(self.extra_cells(ws, [], extra_cells[row]))
+            written = row
+        return ws
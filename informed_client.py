@@ -0,0 +1,151 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes worth retrying
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# Raised when a request still fails after all retries
+class InformedK12Error(Exception):
+    pass
+
+
+# Request counters per campaign: requests, retries, total and max latency, and bytes
+class RequestStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def counters(self, campaign):
+        return self.stats.setdefault(campaign, {"requests": 0, "retries": 0, "latency": 0.0, "max_latency": 0.0, "bytes": 0})
+
+    def record(self, campaign, latency, size):
+        with self.lock:
+            stats = self.counters(campaign)
+            stats["requests"] += 1
+            stats["latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            stats["bytes"] += size
+
+    def record_retry(self, campaign):
+        with self.lock:
+            self.counters(campaign)["retries"] += 1
+
+    # Copy of the per-campaign counters
+    def get(self):
+        with self.lock:
+            return {campaign: dict(stats) for campaign, stats in self.stats.items()}
+
+    # Log the per-campaign request counts, retries and latency
+    def log(self):
+        for campaign, stats in self.get().items():
+            average = stats["latency"] / stats["requests"] if stats["requests"] else 0.0
+            logger.info(f"Informed K12 campaign {campaign}: {stats['requests']} requests, {stats['retries']} retries, "
+                        f"{stats['bytes']} bytes, avg latency {average:.2f}s, max latency {stats['max_latency']:.2f}s")
+
+
+# Request stats collected in this context, set by measure_requests. Threads that make requests
+# for a run must run in a copy of its context.
+active_stats = contextvars.ContextVar("active_stats", default=())
+
+
+# Count the requests made in this context on a new RequestStats, e.g. for one job run. Runs
+# that overlap share the client but each counts only its own requests.
+@contextmanager
+def measure_requests():
+    stats = RequestStats()
+    token = active_stats.set(active_stats.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        active_stats.reset(token)
+
+
+# Shared Informed K12 client: pooled keep-alive connections, gzip transfer, per-request
+# timeouts and retries with exponential backoff that honor Retry-After.
+class InformedK12Client:
+    def __init__(self, api_key, max_connections, timeout, max_retries, backoff_factor, backoff_max):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "X-Authorization": api_key,
+        })
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Limits the number of requests in flight across all campaigns and pages
+        self.semaphore = threading.BoundedSemaphore(max_connections)
+
+    # GET a url and return the decoded JSON body, retrying transient failures
+    def get_json(self, url, headers=None, campaign=None):
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                with self.semaphore:
+                    response = self.session.get(url, headers=headers, timeout=self.timeout)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response = None
+                error = e
+            self.record(campaign, time.monotonic() - start, response)
+
+            retryable = error is not None or response.status_code in RETRY_STATUS_CODES
+            if not retryable:
+                response.raise_for_status()  # Raise for non-transient HTTP errors
+                return response.json()
+
+            if attempt >= self.max_retries:
+                reason = error if error is not None else f"HTTP {response.status_code}"
+                raise InformedK12Error(f"Giving up on {url} after {attempt + 1} attempts: {reason}")
+
+            delay = self.retry_delay(attempt, response)
+            attempt += 1
+            self.record_retry(campaign)
+            logger.warning(f"Retrying Informed K12 request for campaign {campaign} in {delay:.1f}s (attempt {attempt} of {self.max_retries}): {error or response.status_code}")
+            time.sleep(delay)
+
+    # Seconds to wait before the next attempt, preferring the server's Retry-After
+    def retry_delay(self, attempt, response):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0), self.backoff_max)
+
+        delay = self.backoff_factor * (2 ** attempt)
+        return min(delay + random.uniform(0, self.backoff_factor), self.backoff_max)
+
+    # Count a request and its latency against its campaign on the stats of this context
+    def record(self, campaign, latency, response):
+        # Content-Length is the compressed size on the wire when gzip was negotiated
+        size = int(response.headers.get("Content-Length") or len(response.content)) if response is not None else 0
+        for stats in active_stats.get():
+            stats.record(campaign, latency, size)
+
+    def record_retry(self, campaign):
+        for stats in active_stats.get():
+            stats.record_retry(campaign)
@@ -0,0 +1,109 @@
+import logging
+import re
+from datetime import datetime
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from series_utils import map_unique_values
+
+logger = logging.getLogger(__name__)
+
+# m/d/yyyy, the form the invoice date questions use
+SLASH_DATE = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+# MDDYYYY or MMDDYYYY, the form the AP template stores
+COMPACT_DATE = re.compile(r"^\d{7,8}$")
+
+# Distinct date strings kept parsed. Invoice dates repeat heavily, a run sees a few hundred.
+DATE_CACHE_SIZE = 65536
+
+
+# Date of a string the way pd.to_datetime reads it, NaT when it cannot be read. m/d/yyyy dates
+# with a real month are built directly, everything else goes through pandas.
+def parse_date_text(text):
+    match = SLASH_DATE.match(text)
+    if match:
+        month, day, year = (int(part) for part in match.groups())
+        if 1 <= month <= 12 and 1900 <= year < 2200:
+            try:
+                return pd.Timestamp(year, month, day)
+            except ValueError:
+                pass
+    return pd.to_datetime(text, errors="coerce")
+
+
+# Invoice date as MDDYYYY (month without leading zero, no slashes), "" when blank or unreadable
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def mddyyyy_from_text(text):
+    if not text:
+        return ""
+    try:
+        date = parse_date_text(text)
+        if pd.isna(date):
+            logger.warning(f"Unable to parse date: {text}")
+            return ""
+        return f"{date.month}{date.day:02d}{date.year}"
+    except Exception as e:
+        logger.error(f"Unexpected error formatting date '{text}': {e}")
+        return ""
+
+
+# "MON YYYY" of a date string. 7/8-digit MDDYYYY values are read as dates, then dd/mm/yyyy is
+# tried before mm/dd/yyyy. "" when blank or unreadable.
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def mon_year_from_text(text):
+    if not text:
+        return ""
+
+    try:
+        # Handle 7/8-digit compact formats like 012024 or 01012024
+        date_str = text
+        if COMPACT_DATE.match(date_str):
+            if len(date_str) == 7:
+                date_str = f"0{date_str[:1]}/{date_str[1:3]}/{date_str[3:]}"
+            else:
+                date_str = f"{date_str[:2]}/{date_str[2:4]}/{date_str[4:]}"
+
+        date = pd.to_datetime(date_str, format="%d/%m/%Y", errors="coerce")
+        if pd.isna(date):
+            date = pd.to_datetime(date_str, format="%m/%d/%Y", errors="coerce")
+        if pd.notna(date):
+            return date.strftime("%b %Y").upper()
+    except Exception as e:
+        logger.error(f"Error formatting date {text}: {e}")
+    return ""
+
+
+# A %m/%d/%Y date as the number yyyymmdd, NaN when it is not one
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def yyyymmdd_from_text(text):
+    try:
+        date = datetime.strptime(text, "%m/%d/%Y")
+    except ValueError as e:
+        logger.debug(f"Failed to parse date: {text} | Error: {e}")
+        return np.nan
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+# Raw values as stripped strings. Values of other types than str/int/float/Timestamp and
+# NaN/None come back as None so they can be given a default.
+def date_text(series):
+    text = series.astype(str).str.strip().astype(object)
+    readable = series.map(lambda value: isinstance(value, (str, int, float, pd.Timestamp)), na_action="ignore")
+    text[~readable.eq(True).to_numpy()] = None
+    return text
+
+
+# MDDYYYY for every value of a column, "" for blank, unreadable and NaN values
+def mddyyyy_column(series):
+    return map_unique_values(date_text(series), mddyyyy_from_text, na_value="")
+
+
+# "MON YYYY" for every value of a column of date strings, "" for blank or unreadable values
+def mon_year_column(series):
+    return map_unique_values(series.astype(str).str.strip(), mon_year_from_text, na_value="")
+
+
+# yyyymmdd numbers for every value of a column, NaN where there is no %m/%d/%Y date. Only
+# strings can hold one, so values are mapped as they are.
+def yyyymmdd_column(series):
+    return map_unique_values(series, lambda value: yyyymmdd_from_text(str(value).strip()), na_value=np.nan).to_numpy(dtype=float)
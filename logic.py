@@ -2,29 +2,48 @@ from difflib import SequenceMatcher
 import requests
 import pandas as pd
 import io
+import operator
 import numpy as np
 import warnings
 import re
-import tempfile
 import urllib.parse
 import pytz
 import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import config
-from openpyxl import load_workbook
 from openpyxl.styles import PatternFill
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
-from googleapiclient.http import MediaIoBaseUpload
 from googleapiclient.http import MediaIoBaseDownload
+from informed_client import InformedK12Client, measure_requests
+import watermarks
+from response_store import ResponseStore
+from roster_cache import load_cached_roster, save_cached_roster, roster_version
+from run_fingerprint import compute_fingerprint, config_settings, response_list
+from run_metrics import current_run, mark_run_degraded, measure_run, measure_stage
+from shared_cache import SharedCache
+from series_utils import map_unique_values
+from invoice_dates import mddyyyy_from_text, mon_year_from_text, mddyyyy_column, mon_year_column, yyyymmdd_column
+from account_codes import parse_account, parse_account_series, normalize_account_series, invalid_account_mask
+from excel_writer import StreamingExcelWriter
+from process_pool import run_in_processes
+from drive_ops import FOLDER_MIME_TYPE, list_files, trash_files, upload_files
 
 # Global variables from config
 DRIVE_CREDENTIALS = config.DRIVE_CREDENTIALS
 SCOPES = config.SCOPES
+DRIVE_BATCH_SIZE = config.DRIVE_BATCH_SIZE
+DRIVE_UPLOAD_WORKERS = config.DRIVE_UPLOAD_WORKERS
+UPLOAD_CHUNK_SIZE = config.UPLOAD_CHUNK_SIZE
+UPLOAD_MAX_RESUMES = config.UPLOAD_MAX_RESUMES
 FILE_NAME_TO_DOWNLOAD = config.FILE_NAME_TO_DOWNLOAD
 GOOGLE_DRIVE_FOLDER_ID1 = config.GOOGLE_DRIVE_FOLDER_ID1
+ROSTER_CACHE_DIR = config.ROSTER_CACHE_DIR
 X_Authorization = config.X_Authorization
 status_archived = config.STATUS_ARCHIVED
+status_pending = config.STATUS_PENDING
 common_column = config.COMMON_COLUMNS
 template_columns = config.template_columns
 correct_column_order = config.Merged_column_order
@@ -71,6 +90,25 @@ sheet4 = config.sheet4
 sheet5 = config.sheet5
 est = config.est
 upload_excel_true = config.upload_excel_true
+MAX_CONCURRENT_REQUESTS = config.MAX_CONCURRENT_REQUESTS
+REQUEST_TIMEOUT = config.REQUEST_TIMEOUT
+MAX_RETRIES = config.MAX_RETRIES
+RETRY_BACKOFF_FACTOR = config.RETRY_BACKOFF_FACTOR
+RETRY_BACKOFF_MAX = config.RETRY_BACKOFF_MAX
+PIPELINE_WORKERS = config.PIPELINE_WORKERS
+PIPELINE_MIN_RESPONSES = config.PIPELINE_MIN_RESPONSES
+INCREMENTAL_FETCH = config.INCREMENTAL_FETCH
+WATERMARK_FIELD = config.WATERMARK_FIELD
+WATERMARK_PARAM = config.WATERMARK_PARAM
+WATERMARK_OVERLAP_SECONDS = config.WATERMARK_OVERLAP_SECONDS
+FULL_RESYNC_HOURS = config.FULL_RESYNC_HOURS
+RESPONSE_STORE_PATH = config.RESPONSE_STORE_PATH
+OFFLINE_FALLBACK = config.OFFLINE_FALLBACK
+SKIP_UNCHANGED_RUNS = config.SKIP_UNCHANGED_RUNS
+TARGET_FIELDS_BY_CAMPAIGN = config.TARGET_FIELDS_BY_CAMPAIGN
+FETCH_CACHE_TTL_SECONDS = config.FETCH_CACHE_TTL_SECONDS
+FETCH_CACHE_MAX_RESPONSES = config.FETCH_CACHE_MAX_RESPONSES
+ROSTER_MEMORY_TTL_SECONDS = config.ROSTER_MEMORY_TTL_SECONDS
 
 # Handling the Warning related to SettingWithCopyWarning
 warnings.simplefilter(action='ignore', category=pd.errors.SettingWithCopyWarning)
@@ -83,78 +121,46 @@ logger = logging.getLogger(__name__)
 creds = service_account.Credentials.from_service_account_file(DRIVE_CREDENTIALS, scopes=SCOPES)
 drive_service = build('drive', 'v3', credentials=creds)
 
-# Get Escape data using folder id and file name
-def get_file_id_from_folder(folder_id, file_name):
-    query = f"'{folder_id}' in parents and trashed=false"
-    try:
-        results = drive_service.files().list(
-            q=query, 
-            fields="files(id, name, mimeType)", 
-            includeItemsFromAllDrives=True,  
-            supportsAllDrives=True
-        ).execute()
-        files = results.get('files', [])
-
-        if not files:
-            logger.info("No files found in the folder.")
-            return None
-
-        for file in files:
-            logger.info(f"Found file: {file['name']} ({file['id']})")
-            if file['name'] == file_name:  
-                return file['id']
-
-        return None 
-    
-    except Exception as e:
-        logger.error(f"Error retrieving file ID: {e}")
-        return None
+# Shared Informed K12 client used by every fetch
+informed_client = InformedK12Client(X_Authorization, MAX_CONCURRENT_REQUESTS, REQUEST_TIMEOUT, MAX_RETRIES, RETRY_BACKOFF_FACTOR, RETRY_BACKOFF_MAX)
+
+# Local store of the fetched responses shared by the completed and archived jobs
+response_store = ResponseStore(RESPONSE_STORE_PATH, TARGET_FIELDS_BY_CAMPAIGN, WATERMARK_FIELD)
+
+# Caches shared by overlapping job runs: Informed K12 pages (sized by their responses), Drive
+# roster metadata lookups and the parsed roster by Drive version
+shared_pages = SharedCache("pages", FETCH_CACHE_MAX_RESPONSES, FETCH_CACHE_TTL_SECONDS, getsizeof=lambda page: len(response_list(page)) or 1)
+shared_drive_lookups = SharedCache("drive lookups", 64, FETCH_CACHE_TTL_SECONDS)
+shared_roster = SharedCache("roster", 2, ROSTER_MEMORY_TTL_SECONDS)
+SHARED_CACHES = (shared_pages, shared_drive_lookups, shared_roster)
+
+# Log how often the shared caches were used
+def log_shared_caches():
+    logger.info("Shared caches: " + "; ".join(f"{cache.name} {cache.get_stats()}" for cache in SHARED_CACHES))
+
+def clear_shared_caches():
+    for cache in SHARED_CACHES:
+        cache.clear()
+
+# Get the id and version (modifiedTime, md5Checksum) of a file in a folder with one Drive call
+def get_file_metadata_from_folder(folder_id, file_name):
+    def lookup():
+        files = list_files(drive_service, folder_id, name=file_name, fields="id, name, modifiedTime, md5Checksum")
+        return files[0] if files else None
+    return shared_drive_lookups.get_or_load(("metadata", folder_id, file_name), lookup)
 
 # Extracts the base name from a filename by removing the timestamp if present.
 def extract_base_name(filename):
     match = re.search(r'^(.*?)(?: \d{14})?(?:\.\w+)?$', filename)  
     return match.group(1).strip() if match else filename
 
-# get the all the file id from the google drive
+# Trash every file (not folders) in the google drive folder: the listing pages and the trash
+# calls are batched, so a run sends a few requests however many files have piled up
 def get_all_file_ids_from_folder(folder_id, drive_id=None):
-    query = f"'{folder_id}' in parents and trashed=false"
-    page_token = None
-
     try:
-        while True:
-            response = drive_service.files().list(
-                q=query,
-                fields="nextPageToken, files(id, name, mimeType)",
-                corpora="drive" if drive_id else "user",
-                driveId=drive_id if drive_id else None,
-                includeItemsFromAllDrives=True,
-                supportsAllDrives=True,
-                pageToken=page_token
-            ).execute()
-
-            for file in response.get("files", []):
-                file_id = file["id"]
-                file_name = file["name"]
-                mime_type = file["mimeType"]
-
-                try:
-                    # Skip folders, only trash files
-                    if mime_type != "application/vnd.google-apps.folder":
-                        drive_service.files().update(
-                            fileId=file_id,
-                            body={"trashed": True},
-                            supportsAllDrives=True
-                        ).execute()
-                        logger.info(f"Moved to trash: {file_name}")
-                    else:
-                        logger.info(f"Skipped folder: {file_name}")
-
-                except Exception as delete_error:
-                    logger.warning(f"Failed to delete file {file_name} (ID: {file_id}): {delete_error}")
-
-            page_token = response.get("nextPageToken")
-            if not page_token:
-                break
+        files = list_files(drive_service, folder_id, exclude_mime_type=FOLDER_MIME_TYPE, drive_id=drive_id)
+        trashed = trash_files(drive_service, files, DRIVE_BATCH_SIZE)
+        logger.info(f"Moved to trash: {len(trashed)} of {len(files)} files")
 
     except Exception as e:
         logger.error(f"Error retrieving or deleting files: {e}")
@@ -176,102 +182,275 @@ def download_google_drive_file(file_id):
         logger.error(f"Fail the download: {e}")
         return None
 
-# Fetch the Informed K12 data from the API for completed status
-def fetch_api_data_completed(url, headers):
+# Whether the fetches in this context skip the pages other runs fetched moments ago, for a run
+# forced to pick up data that arrived after them. Set by fetch_all_campaigns.
+fresh_pages = contextvars.ContextVar("fresh_pages", default=False)
+
+# Fetch a single page from the Informed K12 API. A page another run fetched moments ago (or is
+# fetching) is shared; it must not be modified.
+def fetch_api_page(page_url, headers, campaign=None):
+    return shared_pages.get_or_load(page_url, lambda: informed_client.get_json(page_url, headers=headers, campaign=campaign), fresh=fresh_pages.get())
+
+# Fetch every page of an Informed K12 listing. Page 1 is fetched first; once it reports
+# totalPages the remaining pages are fetched in parallel and handled in page order.
+# parse_page(data, page) returns (records, has_more, total_pages).
+def fetch_paginated(build_url, headers, parse_page, campaign=None):
     all_data = []
     page = 1
+    total_pages = 1
 
-    while True:
-        try:
-            paginated_url = f"{url}&page={page}" if "?" in url else f"{url}?page={page}"
-            response = requests.get(paginated_url, headers=headers)
-            response.raise_for_status()  # Raise for HTTP errors
-            data = response.json()
-
-            if isinstance(data, dict):
-                if "data" in data and isinstance(data["data"], list):
-                    all_data.extend(data["data"])
-                elif "data" in data:
-                    all_data.append(data["data"])
-                else:
-                    all_data.append(data)
-
-                # Handle pagination
-                pagination = data.get("meta", {}).get("pagination", {})
-                current_page = pagination.get("currentPage", page)
-                total_pages = pagination.get("totalPages", page)
-
-                if current_page >= total_pages:
-                    break
-                page += 1
-            elif isinstance(data, list):
-                all_data.extend(data)
-                break
-            else:
-                logger.info(f"Unexpected API response format: {data}")
-                break
-        except Exception as e:
-            logger.error(f"Error fetching data from Informed K12 URL (page {page}): {e}")
-            break
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        while True:
+            pages = list(range(page, max(total_pages, page) + 1))
+            # In a copy of this context, so the requests count on this run's stats
+            futures = [executor.submit(contextvars.copy_context().run, fetch_api_page, build_url(p), headers, campaign) for p in pages]
 
-    return all_data
+            for p, future in zip(pages, futures):
+                try:
+                    records, has_more, total_pages = parse_page(future.result(), p)
+                except Exception as e:
+                    for pending in futures:
+                        pending.cancel()
+                    logger.error(f"Error fetching data from Informed K12 URL (page {p}): {e}")
+                    raise
+
+                all_data.extend(records)
+                if not has_more:
+                    for pending in futures:
+                        pending.cancel()
+                    return all_data
+
+            page = pages[-1] + 1
+
+# Read the records and pagination from a page of completed data
+def parse_completed_page(data, page):
+    if isinstance(data, dict):
+        if "data" in data and isinstance(data["data"], list):
+            records = data["data"]
+        elif "data" in data:
+            records = [data["data"]]
+        else:
+            records = [data]
+
+        # Handle pagination
+        pagination = data.get("meta", {}).get("pagination", {})
+        current_page = pagination.get("currentPage", page)
+        total_pages = pagination.get("totalPages", page)
+        return records, current_page < total_pages, total_pages
+    elif isinstance(data, list):
+        return data, False, page
+    else:
+        logger.info(f"Unexpected API response format: {data}")
+        return [], False, page
 
+# Read the records and pagination from a page of archived data
+def parse_archived_page(data, page):
+    records = []
+    if "data" in data and isinstance(data["data"], list):
+        records = data["data"]
+    elif "data" in data:
+        records = [data["data"]]
+
+    pagination = data.get("meta", {}).get("pagination", {})
+    current_page = pagination.get("currentPage", page)
+    total_pages = pagination.get("totalPages", page)
+    return records, current_page < total_pages, total_pages
+
+# Fetch the Informed K12 data from the API for completed status.
+# Failures that survive the client's retries are raised instead of returning partial data.
+def fetch_api_data_completed(url, headers, campaign=None):
+    def build_url(page):
+        return f"{url}&page={page}" if "?" in url else f"{url}?page={page}"
+
+    return fetch_paginated(build_url, headers, parse_completed_page, campaign)
+
+
+# Responses of a campaign archived since start, whatever their completed date. An incremental
+# pending fetch only sees responses that are still pending, so these are the ones it misses.
+def fetch_archived_since(base_url, campaign_id, headers, start):
+    endpoint = f"{base_url}{campaign_id}/responses"
+
+    def build_url(page):
+        return f"{endpoint}?{urllib.parse.urlencode({'statusGroup': status_archived, WATERMARK_PARAM: start, 'page': page})}"
+
+    return fetch_paginated(build_url, headers, parse_archived_page, campaign_id)
+
+
+# Fetch the completed data for one campaign incrementally. Only responses updated since the
+# saved high-water mark are requested and upserted into the response store, and responses
+# archived since then are moved out of the pending set, then the full pending set is read back
+# from the store. Responses that leave the pending group any other way (deleted, withdrawn)
+# stay until the next full resync. Falls back to a full download when there is no
+# saved watermark or a periodic full resync is due, and to the stored responses when the
+# API is unavailable. With refresh off a campaign that was synced before is read from the
+# store without calling the API, unless its full resync is due.
+def fetch_api_data_completed_incremental(base_url, campaign_id, status, headers, refresh=True):
+    url = f"{base_url}{campaign_id}{status}"
+    state = response_store.get_fetch_state(campaign_id, status_pending)
+    if not refresh and not watermarks.needs_full_sync(state, FULL_RESYNC_HOURS):
+        logger.info(f"Campaign {campaign_id}: not refreshed in this run, using the stored responses.")
+        return response_store.load_responses(campaign_id, status_pending)
 
-# Fetch the Informed K12 data from the API for archived status
-def fetch_api_data_archived(base_url, campaign_id, headers):
     try:
-        EST = pytz.timezone(est)
+        updates = None
+        if not watermarks.needs_full_sync(state, FULL_RESYNC_HOURS):
+            start = watermarks.watermark_start(state["watermark"], WATERMARK_OVERLAP_SECONDS)
+            separator = "&" if "?" in url else "?"
+            updates = fetch_api_data_completed(f"{url}{separator}{urllib.parse.urlencode({WATERMARK_PARAM: start})}", headers, campaign_id)
+            archived = fetch_archived_since(base_url, campaign_id, headers, start)
+            if not watermarks.supports_incremental(updates + archived, WATERMARK_FIELD):
+                logger.warning(f"Campaign {campaign_id}: responses are missing 'id' or '{WATERMARK_FIELD}', doing a full download.")
+                updates = None
+
+        if updates is None:
+            responses = fetch_api_data_completed(url, headers, campaign_id)
+            if not watermarks.supports_incremental(responses, WATERMARK_FIELD):
+                logger.info(f"Campaign {campaign_id}: incremental fetching is not possible for these responses.")
+                return responses
+            response_store.upsert_responses(campaign_id, status_pending, responses, replace=True)
+            response_store.save_fetch_state(campaign_id, status_pending, watermarks.compute_watermark(responses, WATERMARK_FIELD), datetime.now(pytz.utc).isoformat())
+            logger.info(f"Campaign {campaign_id}: full download of {len(responses)} responses.")
+        else:
+            response_store.upsert_responses(campaign_id, status_pending, updates)
+            response_store.upsert_responses(campaign_id, status_archived, archived)
+            response_store.save_fetch_state(campaign_id, status_pending, watermarks.compute_watermark(updates, WATERMARK_FIELD, state["watermark"]), state["last_full_sync"])
+            logger.info(f"Campaign {campaign_id}: {len(updates)} new or updated and {len(archived)} archived responses since {state['watermark']}.")
+    except Exception as e:
+        if not (OFFLINE_FALLBACK and state):
+            raise
+        logger.warning(f"Campaign {campaign_id}: Informed K12 unavailable, using the stored responses: {e}")
+        mark_run_degraded(f"campaign {campaign_id}: {e}")
+
+    return response_store.load_responses(campaign_id, status_pending)
+
+
+# Start and end of the 7 week archived window, formatted for the API
+def get_archived_window():
+    EST = pytz.timezone(est)
 
-        # Get current time in EST and 7 weeks ago
-        now_est = datetime.now(pytz.utc).astimezone(EST)
-        seven_weeks_ago_est = now_est - timedelta(weeks=7)
+    # Get current time in EST and 7 weeks ago
+    now_est = datetime.now(pytz.utc).astimezone(EST)
+    seven_weeks_ago_est = now_est - timedelta(weeks=7)
 
-        # Format as ISO 8601
-        completed_at_start = seven_weeks_ago_est.strftime("%Y-%m-%dT%H:%M:%S-07:00")
-        completed_at_end = now_est.strftime("%Y-%m-%dT%H:%M:%S-07:00")
+    # Format as ISO 8601
+    completed_at_start = seven_weeks_ago_est.strftime("%Y-%m-%dT%H:%M:%S-07:00")
+    completed_at_end = now_est.strftime("%Y-%m-%dT%H:%M:%S-07:00")
+    return completed_at_start, completed_at_end
+
+# Fetch the Informed K12 data from the API for archived status
+# updated_since limits the request to responses updated after that timestamp.
+def fetch_api_data_archived(base_url, campaign_id, headers, updated_since=None):
+    try:
+        completed_at_start, completed_at_end = get_archived_window()
         print(completed_at_start)
         print(completed_at_end)
 
-        all_data = []
-        page = 1
+        endpoint = f"{base_url}{campaign_id}/responses"
 
-        while True:
-            # Build URL with query string and page number
-            endpoint = f"{base_url}{campaign_id}/responses"
+        # Build URL with query string and page number
+        def build_url(page):
             params = {
                 "statusGroup": status_archived,
                 "completedAtStart": completed_at_start,
                 "completedAtEnd": completed_at_end,
                 "page": page
             }
+            if updated_since:
+                params[WATERMARK_PARAM] = updated_since
             query_string = urllib.parse.urlencode(params)
-            full_url = f"{endpoint}?{query_string}"
-
-            # Make request
-            response = requests.get(full_url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-
-            # Add results from this page
-            if "data" in data and isinstance(data["data"], list):
-                all_data.extend(data["data"])
-            elif "data" in data:
-                all_data.append(data["data"])
-
-            # Pagination logic
-            pagination = data.get("meta", {}).get("pagination", {})
-            current_page = pagination.get("currentPage", page)
-            total_pages = pagination.get("totalPages", page)
-
-            if current_page >= total_pages:
-                break
-            page += 1
+            return f"{endpoint}?{query_string}"
 
+        all_data = fetch_paginated(build_url, headers, parse_archived_page, campaign_id)
         return {"data": all_data}
 
     except Exception as e:
         logger.error(f"Error fetching archived data: {e}")
-        return {"data": []}
+        raise
+
+# Fetch the archived data for one campaign incrementally. After the first full 7 week download
+# only responses updated since the saved high-water mark are requested and upserted into the
+# response store; the 7 week window is then read back from the store with one indexed query.
+# With refresh off a campaign that was synced before is read from the store only, unless its
+# full resync is due.
+def fetch_api_data_archived_incremental(base_url, campaign_id, headers, refresh=True):
+    window_start, window_end = get_archived_window()
+    state = response_store.get_fetch_state(campaign_id, status_archived)
+    if not refresh and not watermarks.needs_full_sync(state, FULL_RESYNC_HOURS):
+        logger.info(f"Campaign {campaign_id}: not refreshed in this run, using the stored archived responses.")
+        return {"data": response_store.load_responses(campaign_id, status_archived, completed_start=window_start, completed_end=window_end)}
+
+    try:
+        if watermarks.needs_full_sync(state, FULL_RESYNC_HOURS):
+            responses = fetch_api_data_archived(base_url, campaign_id, headers)["data"]
+            if not watermarks.supports_incremental(responses, WATERMARK_FIELD):
+                logger.info(f"Campaign {campaign_id}: incremental fetching is not possible for these responses.")
+                return {"data": responses}
+            response_store.upsert_responses(campaign_id, status_archived, responses, replace=True)
+            response_store.save_fetch_state(campaign_id, status_archived, watermarks.compute_watermark(responses, WATERMARK_FIELD), datetime.now(pytz.utc).isoformat())
+            logger.info(f"Campaign {campaign_id}: full download of {len(responses)} archived responses.")
+        else:
+            start = watermarks.watermark_start(state["watermark"], WATERMARK_OVERLAP_SECONDS)
+            updates = fetch_api_data_archived(base_url, campaign_id, headers, updated_since=start)["data"]
+            if not watermarks.supports_incremental(updates, WATERMARK_FIELD):
+                logger.warning(f"Campaign {campaign_id}: responses are missing 'id' or '{WATERMARK_FIELD}', doing a full download.")
+                return fetch_api_data_archived(base_url, campaign_id, headers)
+            response_store.upsert_responses(campaign_id, status_archived, updates)
+            response_store.save_fetch_state(campaign_id, status_archived, watermarks.compute_watermark(updates, WATERMARK_FIELD, state["watermark"]), state["last_full_sync"])
+            logger.info(f"Campaign {campaign_id}: {len(updates)} new or updated archived responses since {state['watermark']}.")
+    except Exception as e:
+        if not (OFFLINE_FALLBACK and state):
+            raise
+        logger.warning(f"Campaign {campaign_id}: Informed K12 unavailable, using the stored responses: {e}")
+        mark_run_degraded(f"campaign {campaign_id}: {e}")
+
+    return {"data": response_store.load_responses(campaign_id, status_archived, completed_start=window_start, completed_end=window_end)}
+
+# Run fetch_campaign(campaign_id) for every old/new campaign in parallel, with fresh pages when
+# fresh is set. Returns the results shaped like CAMPAIGN_IDS, e.g. results["expense"]["old"].
+def fetch_all_campaigns(campaign_ids, fetch_campaign, fresh=False):
+    jobs = [(category, age, campaign_id) for category, ids in campaign_ids.items() for age, campaign_id in ids.items()]
+    token = fresh_pages.set(fresh)
+    # Each fetch runs in a copy of this context, so its stage and a fallback to the stored
+    # responses are recorded on the current run. Its bytes are those of the pages it downloaded
+    # itself; a page shared by another run counts for that run.
+    def fetch_measured(category, age, campaign_id):
+        with measure_stage("fetch", form=f"{category}_{age}") as record, measure_requests() as fetch_stats:
+            data = fetch_campaign(campaign_id)
+            record["rows_out"] = len(response_list(data))
+            record["bytes"] = sum(stats["bytes"] for stats in fetch_stats.get().values())
+        return data
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(jobs) or 1) as executor:
+            futures = [(category, age, executor.submit(contextvars.copy_context().run, fetch_measured, category, age, campaign_id)) for category, age, campaign_id in jobs]
+
+            results = {}
+            for category, age, future in futures:
+                results.setdefault(category, {})[age] = future.result()
+            return results
+    finally:
+        fresh_pages.reset(token)
+
+# Campaign ids of the categories (e.g. {"expense"}) to refresh from the API, all when None
+def refreshed_campaign_ids(campaign_ids, refresh):
+    return {campaign_id for category, ids in campaign_ids.items() if refresh is None or category in refresh for campaign_id in ids.values()}
+
+# Fetch the completed data of all the campaigns concurrently. With incremental fetching,
+# refresh limits the API calls to those categories and the others come from the response store.
+# fresh skips the pages other runs fetched moments ago.
+def fetch_all_completed(base_url, campaign_ids, status, headers, refresh=None, fresh=False):
+    if INCREMENTAL_FETCH:
+        refreshed = refreshed_campaign_ids(campaign_ids, refresh)
+        return fetch_all_campaigns(campaign_ids, lambda campaign_id: fetch_api_data_completed_incremental(base_url, campaign_id, status, headers, refresh=campaign_id in refreshed), fresh)
+    return fetch_all_campaigns(campaign_ids, lambda campaign_id: fetch_api_data_completed(f"{base_url}{campaign_id}{status}", headers, campaign_id), fresh)
+
+# Fetch the archived data of all the campaigns concurrently, refreshing the refresh categories
+# and fresh as in fetch_all_completed
+def fetch_all_archived(base_url, campaign_ids, headers, refresh=None, fresh=False):
+    if INCREMENTAL_FETCH:
+        refreshed = refreshed_campaign_ids(campaign_ids, refresh)
+        return fetch_all_campaigns(campaign_ids, lambda campaign_id: fetch_api_data_archived_incremental(base_url, campaign_id, headers, refresh=campaign_id in refreshed), fresh)
+    return fetch_all_campaigns(campaign_ids, lambda campaign_id: fetch_api_data_archived(base_url, f"{campaign_id}", headers), fresh)
 
 
 # Mapping the number and label to the target fields
@@ -321,8 +500,10 @@ def load_excel_from_drive(drive_service, file_id):
         downloader = MediaIoBaseDownload(file_stream, request)
 
         done = False
-        while not done:
-            _, done = downloader.next_chunk()
+        with measure_stage("roster_download") as record:
+            while not done:
+                _, done = downloader.next_chunk()
+            record["bytes"] = file_stream.getbuffer().nbytes
 
         file_stream.seek(0)
 
@@ -340,6 +521,88 @@ def load_excel_from_drive(drive_service, file_id):
         logger.error(f"Error loading Excel file: {e}")
         return pd.DataFrame() 
     
+# The parsed roster of a Drive file version, from the local cache or downloaded and parsed.
+# Empty when the download fails.
+def load_roster_version(drive_service, metadata):
+    cached = load_cached_roster(ROSTER_CACHE_DIR, metadata)
+    if cached is not None:
+        logger.info(f"Escape roster unchanged since {metadata.get('modifiedTime')}, using the cached copy.")
+        return cached
+
+    df_escape = load_excel_from_drive(drive_service, metadata["id"])
+    if df_escape.empty:
+        return df_escape
+
+    df_escape = normalize_escape_roster(df_escape)
+    try:
+        save_cached_roster(ROSTER_CACHE_DIR, metadata, df_escape)
+    except Exception as e:
+        logger.warning(f"Unable to cache the Escape roster: {e}")
+    return df_escape
+
+# Load the Escape roster from Google Drive. The parsed, renamed and ID-normalized roster is
+# cached locally, so an unchanged file costs one metadata call instead of a download and parse,
+# and kept in memory for the other job runs. Each run gets its own copy. A roster that cannot be
+# loaded is empty and marks the run degraded.
+def load_escape_roster(drive_service, folder_id, file_name):
+    try:
+        metadata = get_file_metadata_from_folder(folder_id, file_name)
+    except Exception as e:
+        cached = load_cached_roster(ROSTER_CACHE_DIR)
+        if cached is not None:
+            logger.warning(f"Error retrieving file ID, using the cached Escape roster: {e}")
+            return cached
+        logger.error(f"Error retrieving file ID: {e}")
+        mark_run_degraded(f"Escape roster: {e}")
+        return pd.DataFrame()
+
+    if metadata is None:
+        logger.info(f"File '{file_name}' not found in folder {folder_id}. Creating an empty Escape sheet.")
+        mark_run_degraded(f"Escape roster: {file_name} not found")
+        return pd.DataFrame()
+
+    key = tuple(sorted(roster_version(metadata).items()))
+    df_escape = shared_roster.get_or_load(key, lambda: load_roster_version(drive_service, metadata))
+    if df_escape.empty:
+        shared_roster.discard(key)
+        mark_run_degraded(f"Escape roster: {file_name} could not be loaded")
+    return df_escape.copy()
+
+# Fingerprint of what a job's workbooks are built from: every response id and update time, the
+# Escape roster version, the config and extra (e.g. the output folder). None when the roster
+# version cannot be read, so the run goes ahead.
+def compute_run_fingerprint(campaign_data, extra=()):
+    try:
+        metadata = get_file_metadata_from_folder(GOOGLE_DRIVE_FOLDER_ID1, FILE_NAME_TO_DOWNLOAD)
+    except Exception as e:
+        logger.warning(f"Unable to read the Escape roster version, not fingerprinting this run: {e}")
+        return None
+    roster = roster_version(metadata) if metadata else None
+    return compute_fingerprint(campaign_data, roster, config_settings(config), WATERMARK_FIELD, extra)
+
+# True when the job's last successful run had the same inputs, so its files are already up to date
+def inputs_unchanged(job, fingerprint):
+    if not SKIP_UNCHANGED_RUNS or fingerprint is None:
+        return False
+    state = response_store.get_run_state(job)
+    if state is None or state["fingerprint"] != fingerprint.digest:
+        return False
+    roster_modified = (fingerprint.roster or {}).get("modifiedTime")
+    logger.info(
+        f"Skipping the {job} run: {fingerprint.responses} responses, the Escape roster (modified {roster_modified}) "
+        f"and the config are unchanged since the successful run at {state['completed_at']} (fingerprint {fingerprint.digest[:12]})"
+    )
+    return True
+
+# Remember the inputs of a successful run that uploaded into folder_id
+def record_successful_run(job, folder_id, fingerprint):
+    if fingerprint is None:
+        return
+    try:
+        response_store.save_run_state(job, folder_id, fingerprint.digest, datetime.now(pytz.utc).isoformat())
+    except Exception as e:
+        logger.warning(f"Unable to save the {job} run fingerprint: {e}")
+
 # Fill missing columns with None/NaN
 def ensure_columns(df, required_columns):
     for col in required_columns:
@@ -427,11 +690,71 @@ def rename_escape_columns(df_escape, escape_header):
         logger.error(f"Error in rename_escape_columns: {e}")
     return ensure_columns(df_escape, escape_header)
 
-# Convert Informed K12 data to Dataframe
+# Rename the Escape headers and clean the employee ids
+def normalize_escape_roster(df_escape):
+    df_escape = rename_escape_columns(df_escape, escape_header)
+
+    try:
+        df_escape[Emp_id] = clean_employee_ids(df_escape.get(Emp_id, pd.Series(dtype=object)))
+    except Exception as e:
+        logger.warning(f"Error cleaning employee IDs: {e}")
+
+    try:
+        df_escape[Emp_id] = df_escape[Emp_id].astype("Int64")
+    except Exception as e:
+        logger.warning(f"Error converting df_escape[Emp_id] to Int64: {e}")
+
+    return df_escape
+
+# Field accessors applied with map() so the per-field work runs in C. They raise KeyError
+# when a field has no number or value, and the form is then projected one field at a time.
+get_field_number = operator.itemgetter("number")
+get_field_value = operator.itemgetter("value")
+
+# Map the fields of one form to {label: value}, logging and skipping bad fields
+def project_form_fields(fields, field_mapping, i):
+    form_data = {}
+    for field in fields:
+        try:
+            field_number = field.get("number")
+            if field_number in field_mapping:
+                field_label = field_mapping[field_number]
+                form_data[field_label] = field.get("value", "N/A")
+        except Exception as fe:
+            logger.warning(f"Error processing field in form index {i}: {fe}")
+    return form_data
+
+# Projection plan for one form layout (the sequence of field numbers on a form). Returns the
+# mapped labels in first-seen order, the same labels in field_mapping order (so layouts that
+# differ only in field order share a group) and a getter for the position of each label's last
+# occurrence, in field_mapping order.
+def build_form_layout(field_numbers, field_mapping, label_rank):
+    positions = {}
+    for position, field_number in enumerate(field_numbers):
+        if field_number in field_mapping:
+            positions[field_mapping[field_number]] = position
+
+    first_seen = tuple(positions)
+    labels = tuple(sorted(first_seen, key=label_rank.get))
+    if len(labels) == 1:
+        position = positions[labels[0]]
+        return first_seen, labels, lambda fields: (fields[position],)
+    return first_seen, labels, operator.itemgetter(*(positions[label] for label in labels)) if labels else None
+
+# Convert Informed K12 data to Dataframe. Forms of a campaign share a layout, so the mapped
+# field positions are worked out once per layout and each form is projected straight into
+# per-column values; the result matches building the frame from one dict per form.
 def process_api_data(data, field_mapping):
-    records = []
+    layouts = {}
+    groups = {}
+    column_labels = {}
+    n_rows = 0
 
     try:
+        label_rank = {}
+        for field_label in field_mapping.values():
+            label_rank.setdefault(field_label, len(label_rank))
+
         # Validate input data
         if isinstance(data, dict):
             data_array = data.get("data", [])
@@ -442,29 +765,74 @@ def process_api_data(data, field_mapping):
             return pd.DataFrame()
 
         for i, form in enumerate(data_array):
-            form_data = {}
             fields = form.get("fields", [])
             if not isinstance(fields, list):
                 logger.warning(f"Invalid 'fields' format in form index {i}. Skipping this entry.")
                 continue
 
-            for field in fields:
-                try:
-                    field_number = field.get("number")
-                    if field_number in field_mapping:
-                        field_label = field_mapping[field_number]
-                        form_data[field_label] = field.get("value", "N/A")
-                except Exception as fe:
-                    logger.warning(f"Error processing field in form index {i}: {fe}")
-
-            if form_data:
-                records.append(form_data)
+            try:
+                field_numbers = tuple(map(get_field_number, fields))
+                layout = layouts.get(field_numbers)
+                if layout is None:
+                    layout = layouts[field_numbers] = build_form_layout(field_numbers, field_mapping, label_rank)
+                first_seen, labels, getter = layout
+                values = tuple(map(get_field_value, getter(fields))) if labels else ()
+            except Exception:
+                # Malformed fields, fall back to one field at a time
+                form_data = project_form_fields(fields, field_mapping, i)
+                first_seen = labels = tuple(form_data)
+                values = tuple(form_data.values())
+
+            if labels:
+                # Columns are ordered by first appearance, as with one dict per form
+                if len(column_labels) < len(label_rank):
+                    column_labels.update(dict.fromkeys(first_seen))
+                # Values of a group go into one flat list, a container per row is slow to collect
+                group = groups.get(labels)
+                if group is None:
+                    group = groups[labels] = ([], [])
+                group[0].append(n_rows)
+                group[1].extend(values)
+                n_rows += 1
 
     except Exception as e:
         logger.error(f"Error in process_api_data: {e}")
+        mark_run_degraded(f"process_api_data: {e}")
         return pd.DataFrame()
 
-    return pd.DataFrame(records)
+    if not n_rows:
+        return pd.DataFrame([])
+
+    # Missing cells are NaN, as when a form dict has no value for a column
+    arrays = {field_label: np.full(n_rows, np.nan, dtype=object) for field_label in column_labels}
+    for labels, (rows, flat_values) in groups.items():
+        rows = np.asarray(rows)
+        block = np.fromiter(flat_values, dtype=object, count=len(flat_values)).reshape(len(rows), len(labels))
+        for j, field_label in enumerate(labels):
+            arrays[field_label][rows] = block[:, j]
+
+    return pd.DataFrame(arrays, copy=False).infer_objects()
+
+# Join the non-blank segment columns of each row with "-", skipping NaN and blank segments.
+# Rows are carried as integer codes into the distinct joined strings, so the string work is
+# done once per distinct value rather than once per row.
+def join_account_segments(df, cols):
+    if df.empty:
+        # DataFrame.apply returns an empty float column for an empty frame
+        return pd.Series(index=df.index, dtype=float)
+
+    codes = np.zeros(len(df), dtype=np.int64)
+    joined = np.array([""], dtype=object)
+    for col in cols:
+        segment = df[col]
+        segment_codes, uniques = pd.factorize(segment.astype(str))
+        texts = np.array([text.strip() for text in uniques] + [""], dtype=object)
+        # NaN segments point at the trailing "" and are skipped like blank ones
+        segment_codes = np.where(segment.notna().to_numpy(), segment_codes, len(uniques))
+        pairs, codes = np.unique(codes * len(texts) + segment_codes, return_inverse=True)
+        prefix, text = joined[pairs // len(texts)], texts[pairs % len(texts)]
+        joined = np.where(text == "", prefix, np.where(prefix == "", text, prefix + "-" + text))
+    return pd.Series(joined[codes], index=df.index, dtype=object)
 
 # Combine the field numbers to get Account codes from conference
 def combine_account_codes(df_conference, field_mapping):
@@ -479,21 +847,13 @@ def combine_account_codes(df_conference, field_mapping):
         acc2_cols = [col for col in acc2_cols if col in df_conference.columns]
         acc3_cols = [col for col in acc3_cols if col in df_conference.columns]
 
-        def concat_if_not_empty(row, cols):
-            try:
-                values = [str(row[col]).strip() for col in cols if pd.notna(row[col]) and str(row[col]).strip()]
-                return '-'.join(values) if values else ""
-            except Exception as e:
-                logger.warning(f"Error concatenating account code columns: {e}")
-                return ""
-
         # Apply concatenation safely
         if acc1_cols:
-            df_conference[account_code_1] = df_conference.apply(lambda row: concat_if_not_empty(row, acc1_cols), axis=1)
+            df_conference[account_code_1] = join_account_segments(df_conference, acc1_cols)
         if acc2_cols:
-            df_conference[account_code_2] = df_conference.apply(lambda row: concat_if_not_empty(row, acc2_cols), axis=1)
+            df_conference[account_code_2] = join_account_segments(df_conference, acc2_cols)
         if acc3_cols:
-            df_conference[account_code_3] = df_conference.apply(lambda row: concat_if_not_empty(row, acc3_cols), axis=1)
+            df_conference[account_code_3] = join_account_segments(df_conference, acc3_cols)
 
         # Safely drop the original individual columns
         all_cols_to_drop = list(set(acc1_cols + acc2_cols + acc3_cols))
@@ -530,6 +890,42 @@ def combine_account_codes(df_conference, field_mapping):
 #     except Exception:
 #         return amount 
 
+# Upper-case month abbreviations by month number, as strftime('%b').upper() gives them
+MONTH_ABBREVIATIONS = np.array([""] + [datetime(2000, month, 1).strftime('%b').upper() for month in range(1, 13)], dtype=object)
+
+# "MON YYYY" from an old campaign invoice number like "Jan 2025 123", "" otherwise
+def invoice_month_year(invoice_number):
+    invoice_parts = invoice_number.split()
+    if len(invoice_parts) >= 2:
+        return f"{invoice_parts[0].upper()} {invoice_parts[1]}"
+    return ""
+
+# "MON YYYY" or "MON-MON YYYY" per row from the earliest and latest date across the date
+# columns, always labelled with the year of the latest date. Each column is parsed once per
+# distinct value and the min/max and labels are computed over whole columns.
+def invoice_labels_from_dates(df, date_columns):
+    if df.empty:
+        # DataFrame.apply returns an empty float column for an empty frame
+        return pd.Series(index=df.index, dtype=float)
+
+    parsed = np.full((len(df), max(len(date_columns), 1)), np.nan)
+    for i, col in enumerate(date_columns):
+        parsed[:, i] = yyyymmdd_column(df[col])
+
+    # fmin/fmax skip NaN and stay NaN for rows without any valid date
+    first_date = np.fmin.reduce(parsed, axis=1)
+    last_date = np.fmax.reduce(parsed, axis=1)
+    has_date = ~np.isnan(first_date)
+
+    first_month = (np.nan_to_num(first_date) // 100 % 100).astype(int)
+    last_month = (np.nan_to_num(last_date) // 100 % 100).astype(int)
+    last_year = (np.nan_to_num(last_date) // 10000).astype(int).astype(str).astype(object)
+
+    first_label = MONTH_ABBREVIATIONS[first_month]
+    month_range = np.where(first_month == last_month, first_label, first_label + "-" + MONTH_ABBREVIATIONS[last_month])
+    labels = np.where(has_date, month_range + " " + last_year, "")
+    return pd.Series(labels, index=df.index, dtype=object)
+
 # Genarate and Fetch Invoice Number
 def generate_invoice_number(df, field_mapping, category, is_old_campaign, output_column=invoice_num):
     try:
@@ -539,22 +935,11 @@ def generate_invoice_number(df, field_mapping, category, is_old_campaign, output
 
             if invoice_field_label and invoice_field_label in df.columns:
                 try:
-                    df[output_column] = df[invoice_field_label].astype(str).str.strip()
-
-                    def extract_invoice_or_date(row):
-                        try:
-                            invoice_number = row.get(output_column, "").strip()
-                            if invoice_number:
-                                invoice_parts = invoice_number.split()
-                                if len(invoice_parts) >= 2:
-                                    month = invoice_parts[0].upper()
-                                    year = invoice_parts[1]
-                                    return f"{month} {year}"
-                        except Exception as e:
-                            logger.warning(f"Error extracting invoice number from row: {e}")
-                        return ""
-
-                    df[output_column] = df.apply(extract_invoice_or_date, axis=1)
+                    invoice_numbers = df[invoice_field_label].astype(str).str.strip()
+                    if df.empty:
+                        df[output_column] = pd.Series(index=df.index, dtype=float)
+                    else:
+                        df[output_column] = map_unique_values(invoice_numbers, invoice_month_year, na_value="")
 
                     if invoice_field_label != output_column:
                         df.drop(columns=[invoice_field_label], inplace=True, errors='ignore')
@@ -568,45 +953,8 @@ def generate_invoice_number(df, field_mapping, category, is_old_campaign, output
             date_columns = [field_mapping.get(num) for num in date_field_numbers if num in field_mapping]
             date_columns = [col for col in date_columns if col in df.columns]
 
-            def parse_date(value):
-                try:
-                    return datetime.strptime(str(value).strip(), "%m/%d/%Y")
-                except Exception as e:
-                    logger.debug(f"Failed to parse date: {value} | Error: {e}")
-                    return None
-
-            def compute_invoice(row):
-                try:
-                    parsed_dates = []
-                    for col in date_columns:
-                        val = row.get(col)
-                        if pd.notna(val) and str(val).strip():
-                            date = parse_date(val)
-                            if date:
-                                parsed_dates.append(date)
-
-                    if not parsed_dates:
-                        return ""
-
-                    first_date = min(parsed_dates)
-                    last_date = max(parsed_dates)
-
-                    if first_date.year == last_date.year:
-                        if first_date.month == last_date.month:
-                            return f"{first_date.strftime('%b').upper()} {last_date.year}"
-                        else:
-                            return f"{first_date.strftime('%b').upper()}-{last_date.strftime('%b').upper()} {last_date.year}"
-                    else:
-                        if first_date.strftime('%b').upper() == last_date.strftime('%b').upper():
-                            return f"{first_date.strftime('%b').upper()} {last_date.year}"
-                        else:
-                            return f"{first_date.strftime('%b').upper()}-{last_date.strftime('%b').upper()} {last_date.year}"
-                except Exception as e:
-                    logger.warning(f"Error computing invoice for row: {e}")
-                    return ""
-
             try:
-                df[output_column] = df.apply(compute_invoice, axis=1)
+                df[output_column] = invoice_labels_from_dates(df, date_columns)
                 df.drop(columns=date_columns, inplace=True, errors='ignore')
             except Exception as e:
                 logger.error(f"Error processing new campaign invoice number: {e}")
@@ -636,6 +984,14 @@ def clean_employee_id(emp_id):
         logger.warning(f"Error cleaning employee ID '{emp_id}': {e}")
         return ""
 
+# clean_employee_id for a whole column. The result only depends on str(emp_id) (NaN and None
+# have no digits), so the digits are stripped with one vectorized pass over the distinct strings.
+def clean_employee_ids(emp_ids):
+    codes, texts = pd.factorize(emp_ids.astype(str))
+    digits = pd.Series(texts, dtype=object).str.replace(r"\D", "", regex=True)
+    cleaned = np.array([int(emp_id) if emp_id else "" for emp_id in digits] + [""], dtype=object)
+    return pd.Series(cleaned[codes], index=emp_ids.index, dtype=object)
+
 # Delete the row if no data present
 def clean_and_drop_empty_rows(df):
     def is_blank(x):
@@ -647,13 +1003,21 @@ def clean_and_drop_empty_rows(df):
 
     return df
 
-# Create a dataframe using Emp Id from Informed K12 data and Escape data
-def prepare_dataframes(df_expense, df_escape):
+# Escape rows indexed by employee id, shared by the Expense, Mileage and Conference merges.
+# The ids are turned into the strings the form ids are compared as, also in df_escape itself
+# since the Escape sheet is written with them.
+def escape_roster_lookup(df_escape):
+    df_escape[Emp_id] = df_escape[Emp_id].astype(str)
+    return df_escape.set_index(Emp_id)
+
+# Create a dataframe using Emp Id from Informed K12 data. The Escape roster ids are already
+# cleaned by normalize_escape_roster when it is loaded.
+def prepare_dataframes(df_expense):
     try:
         df_expense = clean_and_drop_empty_rows(df_expense)
     except Exception as e:
         logger.error(f"Error cleaning and dropping rows from df_expense: {e}")
-        return df_expense, df_escape  # Early return if essential preprocessing fails
+        return df_expense  # Early return if essential preprocessing fails
 
     try:
         # Handle potentially invalid employee IDs
@@ -663,8 +1027,7 @@ def prepare_dataframes(df_expense, df_escape):
         if not invalid_emp_rows.empty:
             invalid_emp_rows[match_col] = not_found
 
-        df_expense[Emp_id] = df_expense.get(Emp_id, pd.Series(dtype=object)).apply(clean_employee_id)
-        df_escape[Emp_id] = df_escape.get(Emp_id, pd.Series(dtype=object)).apply(clean_employee_id)
+        df_expense[Emp_id] = clean_employee_ids(df_expense.get(Emp_id, pd.Series(dtype=object)))
 
         df_expense[Emp_id] = df_expense[Emp_id].replace("", pd.NA)
     except Exception as e:
@@ -675,187 +1038,129 @@ def prepare_dataframes(df_expense, df_escape):
     except Exception as e:
         logger.warning(f"Error converting df_expense[Emp_id] to Int64: {e}")
 
-    try:
-        df_escape[Emp_id] = df_escape[Emp_id].astype("Int64")
-    except Exception as e:
-        logger.warning(f"Error converting df_escape[Emp_id] to Int64: {e}")
-
-    return df_expense, df_escape
-
-# Comparison based on Emp Id and highlight is based on Email.
-def check_match(row):
-    if pd.isna(row.get(Emp_id)) or pd.isna(row.get("Email_Escape")):
-        return not_found
-    return matched
-
-# Merge the Escape, Mileage and Conference with Expense data, and compare them
-def merge_and_compare_common(df_source, df_escape, form_type, include_account_code_3=True, invalid_emp_rows=None):
-    try:
-        df_source[Emp_id] = df_source[Emp_id].astype(str)
-        df_escape[Emp_id] = df_escape[Emp_id].astype(str)
-    except Exception as e:
-        logger.error(f"Error converting Employee IDs to string: {e}")
-        return pd.DataFrame()
-
-    try:
-        comparison_df = df_source.merge(
-            df_escape,
-            on=Emp_id,
-            how="left",
-            indicator=True
-        ).copy()
-    except Exception as e:
-        logger.error(f"Error merging dataframes: {e}")
-        return pd.DataFrame()
-
-    try:
-        # Fill missing names
-        comparison_df["Last_y"] = comparison_df.get("Last_y", np.nan).fillna(comparison_df.get("Last_x"))
-        comparison_df["First_y"] = comparison_df.get("First_y", np.nan).fillna(comparison_df.get("First_x"))
-
-        # Match logic
-        comparison_df[match_col] = comparison_df.apply(check_match, axis=1)
-
-        # Fix columns
-        comparison_df.rename(columns={"Last_y": last, "First_y": first}, inplace=True)
-    except Exception as e:
-        logger.warning(f"Error applying name fix and match logic: {e}")
-
-    # Handle optional fields
-    extra_fields = [col for col in EXTRA_FIELDS if col in df_source.columns]
-
-    if include_account_code_3:
-        for col in [account_code_3, account_code_3_total]:
-            if col not in comparison_df.columns:
-                comparison_df[col] = None
+    return df_expense
 
-    comparison_df[form] = form_type
+# Forms matched against the Escape roster: (form name, include Account Code 3)
+COMPARED_FORMS = (("Expense", True), ("Mileage", True), ("Conference", False))
 
-    final_columns = required_cols + extra_fields
+# Merged sheet columns a form carries on its own rows: the required columns, the extra fields
+# the form has and Account Code 3 when it is included. Everything else is left empty.
+def carried_columns(df_source, include_account_code_3=True):
+    carried = set(required_cols) | {col for col in EXTRA_FIELDS if col in df_source.columns}
     if include_account_code_3:
-        final_columns += [account_code_3, account_code_3_total]
-    final_columns += [form]
-    final_columns = [col for col in final_columns if col in comparison_df.columns]
-
-    # Handle invalid employee rows if provided
-    try:
-        if invalid_emp_rows is not None:
-            for col in final_columns:
-                if col not in invalid_emp_rows.columns:
-                    invalid_emp_rows[col] = None
-
-            invalid_emp_rows[form] = form_type
-            matched_ids = comparison_df[Emp_id].astype(str).unique()
-            invalid_emp_rows = invalid_emp_rows[~invalid_emp_rows[Emp_id].astype(str).isin(matched_ids)]
-            invalid_emp_rows_final = invalid_emp_rows[final_columns]
+        carried |= {account_code_3, account_code_3_total}
+    return carried
+
+# A form's rows ready to be joined with the roster, tagged with the form name. Only columns the
+# roster does not supply are taken from the form (First and Last come from both, the roster
+# wins), with None for the ones the form does not carry.
+def form_comparison_rows(df_source, form_type, roster_columns, include_account_code_3=True):
+    df_source[Emp_id] = df_source[Emp_id].astype(str)
+    carried = carried_columns(df_source, include_account_code_3)
+
+    rows = {}
+    for col in correct_column_order:
+        if col == form or (col in roster_columns and col not in (first, last)):
+            continue
+        if col in carried and col in df_source.columns:
+            rows[col] = df_source[col]
         else:
-            invalid_emp_rows_final = pd.DataFrame(columns=final_columns)
-    except Exception as e:
-        logger.warning(f"Error processing invalid employee rows: {e}")
-        invalid_emp_rows_final = pd.DataFrame(columns=final_columns)
-
-    # Final assembly
-    try:
-        comparison_df_final = comparison_df[final_columns]
-        dfs_to_concat = [comparison_df_final]
-
-        if not invalid_emp_rows_final.empty and not invalid_emp_rows_final.isna().all().all():
-            dfs_to_concat.append(invalid_emp_rows_final)
-
-        final_df = pd.concat(dfs_to_concat, ignore_index=True)
-    except Exception as e:
-        logger.error(f"Error concatenating comparison results: {e}")
-        return pd.DataFrame()
-
-    try:
-        # Clean up and deduplicate
-        final_df[first] = final_df[first].replace(["Nan", "nan"], np.nan)
-        final_df[last] = final_df[last].replace(["Nan", "nan"], np.nan)
-
-        final_df = final_df[~(
-            final_df[Emp_id].isna() &
-            final_df[first].isna() &
-            final_df[last].isna()
-        )]
-
-        final_df[first] = final_df[first].astype(str).str.strip().str.lower()
-        final_df[last] = final_df[last].astype(str).str.strip().str.lower()
-
-        df_with_id = final_df[final_df[Emp_id].notna()]
-        df_without_id = final_df[final_df[Emp_id].isna()].drop_duplicates(subset=[first, last, form])
-
-        final_df = pd.concat([df_with_id, df_without_id], ignore_index=True)
-
-        final_df[first] = final_df[first].str.title()
-        final_df[last] = final_df[last].str.title()
-
-        comparison_df = final_df
-        return comparison_df
-    except Exception as e:
-        logger.error(f"Final cleanup or formatting error: {e}")
-        return pd.DataFrame()
-
-
-# Merge and comapre Expense and Escape
-def merge_and_compare_data_expense(df_expense, df_escape, invalid_emp_rows=None):
-    return merge_and_compare_common(df_expense, df_escape, form_type="Expense", include_account_code_3=True, invalid_emp_rows=invalid_emp_rows)
-
-# Merge and comapre Mileage and Escape
-def merge_and_compare_data_mileage(df_mileage, df_escape, invalid_emp_rows=None):
-    return merge_and_compare_common(df_mileage, df_escape, form_type="Mileage", include_account_code_3=True, invalid_emp_rows=invalid_emp_rows)
-
-# Merge and comapre Conference and Escape
-def merge_and_compare_data_conference(df_conference, df_escape, invalid_emp_rows=None):
-    return merge_and_compare_common(df_conference, df_escape, form_type="Conference", include_account_code_3=False, invalid_emp_rows=invalid_emp_rows)
-
-# Merge all the comparison_df to get final_comparison_df
+            rows[col] = pd.Series([None] * len(df_source), index=df_source.index, dtype=object)
+    rows = pd.DataFrame(rows, index=df_source.index)
+    rows[form] = form_type
+    return rows
+
+# Invalid employee rows listed under a form, unless their id is one of the form's employees.
+# They are not joined with the roster.
+def invalid_comparison_rows(invalid_emp_rows, df_source, form_type, include_account_code_3=True):
+    carried = carried_columns(df_source, include_account_code_3)
+    invalid_rows = invalid_emp_rows[~invalid_emp_rows[Emp_id].astype(str).isin(df_source[Emp_id].unique())]
+    rows = pd.DataFrame({
+        col: invalid_rows[col] if col in carried and col in invalid_rows.columns else pd.Series([None] * len(invalid_rows), index=invalid_rows.index, dtype=object)
+        for col in correct_column_order
+    })
+    rows[form] = form_type
+    if rows.empty or rows.drop(columns=[form]).isna().all().all():
+        return None
+    return rows
+
+# Join every form's rows against the roster index in one left join and classify them. Rows
+# whose employee is on the roster with an email are Matched, the rest Not Found. First and Last
+# are taken from the roster, else from the form, and title-cased.
+def match_forms(form_rows, escape_lookup, invalid_rows=None):
+    rows = pd.concat(form_rows, ignore_index=True)
+    roster_columns = [col for col in correct_column_order if col in escape_lookup.columns]
+    joined = rows.merge(escape_lookup[roster_columns], left_on=Emp_id, right_index=True, how="left").reset_index(drop=True)
+
+    # First and Last come from both sides and are suffixed by the join
+    for name in (first, last):
+        if f"{name}_y" in joined.columns:
+            joined[name] = joined[f"{name}_y"].fillna(joined[f"{name}_x"])
+
+    order = np.zeros(len(joined), dtype=np.int64)
+    if invalid_rows:
+        joined = pd.concat([joined] + invalid_rows, ignore_index=True)
+        order = np.concatenate([order] + [np.ones(len(invalid), dtype=np.int64) for invalid in invalid_rows])
+
+    joined = joined.reindex(columns=correct_column_order)
+    no_id = joined[Emp_id].isna().to_numpy()
+    if no_id.any():
+        # Rows without an employee id are dropped when they have no name either
+        blank_name = [(joined[name].isna() | joined[name].isin(["Nan", "nan"])).to_numpy() for name in (first, last)]
+        keep = ~(no_id & blank_name[0] & blank_name[1])
+        joined, order, no_id = joined[keep], order[keep], no_id[keep]
+
+    for name in (first, last):
+        joined[name] = map_unique_values(joined[name].astype(str), lambda value: value.strip().lower().title())
+
+    if no_id.any():
+        # One row per name for rows without an id
+        duplicate = np.zeros(len(joined), dtype=bool)
+        duplicate[no_id] = joined[no_id].duplicated(subset=[first, last, form]).to_numpy()
+        joined, order, no_id = joined[~duplicate], order[~duplicate], no_id[~duplicate]
+
+    if invalid_rows:
+        # Each form's rows first, then its invalid rows, then the ones without an id
+        form_position = joined[form].map({name: i for i, (name, _) in enumerate(COMPARED_FORMS)}).to_numpy()
+        joined = joined.iloc[np.argsort(form_position * 4 + no_id * 2 + order, kind="stable")]
+
+    email_missing = joined["Email_Escape"].isna().to_numpy()
+    joined[match_col] = np.where(joined[Emp_id].isna().to_numpy() | email_missing, not_found, matched).astype(object)
+    return joined.reset_index(drop=True)
+
+# Merge all the forms with the Escape roster to get final_comparison_df
 def merge_and_compare_data_combined(df_expense, df_escape, df_mileage, df_conference, invalid_emp_rows=None):
     try:
-        comparison_df = merge_and_compare_data_expense(df_expense, df_escape, invalid_emp_rows=invalid_emp_rows)
-    except Exception as e:
-        logger.error(f"Error in merge_and_compare_data_expense: {e}")
-        comparison_df = pd.DataFrame(columns=correct_column_order)
-
-    try:
-        comparison_df1 = merge_and_compare_data_mileage(df_mileage, df_escape, invalid_emp_rows=invalid_emp_rows)
-    except Exception as e:
-        logger.error(f"Error in merge_and_compare_data_mileage: {e}")
-        comparison_df1 = pd.DataFrame(columns=correct_column_order)
-
-    try:
-        comparison_df2 = merge_and_compare_data_conference(df_conference, df_escape, invalid_emp_rows=invalid_emp_rows)
-    except Exception as e:
-        logger.error(f"Error in merge_and_compare_data_conference: {e}")
-        comparison_df2 = pd.DataFrame(columns=correct_column_order)
-
-    try:
-        all_columns = set(correct_column_order)
-
-        for df in [comparison_df, comparison_df1, comparison_df2]:
-            missing_cols = all_columns - set(df.columns)
-            for col in missing_cols:
-                df[col] = None
-
-        comparison_df = comparison_df[correct_column_order]
-        comparison_df1 = comparison_df1[correct_column_order]
-        comparison_df2 = comparison_df2[correct_column_order]
+        escape_lookup = escape_roster_lookup(df_escape)
     except Exception as e:
-        logger.error(f"Error aligning columns: {e}")
+        logger.error(f"Error converting Employee IDs to string: {e}")
+        mark_run_degraded(f"merge: {e}")
         return pd.DataFrame(columns=correct_column_order)
 
-    try:
-        for df in [comparison_df, comparison_df1, comparison_df2]:
-            df.loc[:, match_col] = df.apply(lambda row: check_match(row), axis=1)
-    except Exception as e:
-        logger.warning(f"Error applying match logic: {e}")
+    form_rows, invalid_rows = [], []
+    for df_source, (form_type, include_account_code_3) in zip((df_expense, df_mileage, df_conference), COMPARED_FORMS):
+        try:
+            rows = form_comparison_rows(df_source, form_type, escape_lookup.columns, include_account_code_3)
+            invalid = None
+            if invalid_emp_rows is not None:
+                invalid = invalid_comparison_rows(invalid_emp_rows, df_source, form_type, include_account_code_3)
+        except Exception as e:
+            logger.error(f"Error preparing {form_type} rows for the comparison: {e}")
+            mark_run_degraded(f"merge {form_type}: {e}")
+            continue
+        form_rows.append(rows)
+        if invalid is not None:
+            invalid_rows.append(invalid)
+
+    if not form_rows:
+        return pd.DataFrame(columns=correct_column_order)
 
     try:
-        final_comparison_df = pd.concat([comparison_df, comparison_df1, comparison_df2], ignore_index=True)
+        return match_forms(form_rows, escape_lookup, invalid_rows)
     except Exception as e:
-        logger.error(f"Error concatenating comparison DataFrames: {e}")
-        final_comparison_df = pd.DataFrame(columns=correct_column_order)
-
-    return final_comparison_df
+        logger.error(f"Error matching the forms with the Escape roster: {e}")
+        mark_run_degraded(f"merge: {e}")
+        return pd.DataFrame(columns=correct_column_order)
 
 # Remove the 0 and / from the Invoice date
 def format_invoice_date(date_value):
@@ -864,19 +1169,8 @@ def format_invoice_date(date_value):
         if pd.isna(date_value) or not isinstance(date_value, (str, int, float, pd.Timestamp)):
             return ""
 
-        date_str = str(date_value).strip()
-        if not date_str:
-            return ""
-
-        # Convert to datetime
-        date_obj = pd.to_datetime(date_str, errors="coerce")
-
-        if pd.isna(date_obj):
-            logger.warning(f"Unable to parse date: {date_value}")
-            return ""
-
         # Format: MDDYYYY (remove leading zero from month, no slashes)
-        return f"{date_obj.month}{date_obj.day:02d}{date_obj.year}"
+        return mddyyyy_from_text(str(date_value).strip())
 
     except Exception as e:
         logger.error(f"Unexpected error formatting date '{date_value}': {e}")
@@ -889,28 +1183,7 @@ def mon_year_invoice_date(date):
         return ""
 
     try:
-        date_str = str(date).strip()
-
-        if not date_str:
-            return ""
-
-        # Handle 7/8-digit compact formats like 012024 or 01012024
-        if re.match(r"^\d{7,8}$", date_str):
-            if len(date_str) == 7:
-                date_str = f"0{date_str[:1]}/{date_str[1:3]}/{date_str[3:]}"
-            elif len(date_str) == 8:
-                date_str = f"{date_str[:2]}/{date_str[2:4]}/{date_str[4:]}"
-
-        # Try parsing using dd/mm/yyyy first
-        date_obj = pd.to_datetime(date_str, format="%d/%m/%Y", errors="coerce")
-
-        if pd.isna(date_obj):
-            # Fallback: attempt general parsing (e.g., mm/dd/yyyy, ISO, etc.)
-            date_obj = pd.to_datetime(date_str, format="%m/%d/%Y", errors="coerce")
-
-        if pd.notna(date_obj):
-            return date_obj.strftime("%b %Y").upper()
-
+        return mon_year_from_text(str(date).strip())
     except Exception as e:
         logger.error(f"Error formatting date {date}: {e}")
 
@@ -922,25 +1195,8 @@ def format_account_number(account):
         return ""
 
     try:
-        account = str(account).strip()
-
-        # Accept if it's a non-numeric string like "BILL SUNOL GLEN"
-        if not any(char.isdigit() for char in account):
-            return account
-
-        # Replace periods with dashes
-        account = account.replace(".", "-")
-
-        # Remove any characters that are not digits or dashes
-        account = re.sub(r"[^0-9\-]", "", account)
-
-        # Check if the cleaned account number matches the expected format
-        expected_format = r"^\d{3}-\d{4}-\d-\d{4}-\d{4}-\d{4}-\d{3}-\d{4}-\d{4}$"
-        if re.fullmatch(expected_format, account):
-            return account
-        else:
-            return ""
-
+        # Non-numeric strings like "BILL SUNOL GLEN" are accepted as they are, see parse_account
+        return parse_account(str(account)).normalized
     except Exception as e:
         logger.error(f"Error formatting account number '{account}': {e}")
         return ""
@@ -949,40 +1205,142 @@ def format_account_number(account):
 
 # Empty, string or invalid account code will be highlighted red
 def needs_red_highlight(account):
-    if not account or str(account).strip() == "":
-        return True
-    if not any(char.isdigit() for char in str(account)):
-        return True
-    expected_format = r"^\d{3}-\d{4}-\d-\d{4}-\d{4}-\d{4}-\d{3}-\d{4}-\d{4}$"
-    return not re.match(expected_format, str(account))
-
-# If amount is not empty then the account code will be highlighted. 
-def should_highlight_account(row):
-    # Check account_code_1
-    total_1_raw = str(row.get(account_code_1_total, "")).replace(",", "")
-    total_1 = pd.to_numeric(total_1_raw, errors="coerce")
-    if not pd.isna(total_1):
-        acc_1 = row.get(account_code_1, "")
-        if needs_red_highlight(acc_1):
-            return True
-
-    # Check account_code_2
-    total_2_raw = str(row.get(account_code_2_total, "")).replace(",", "")
-    total_2 = pd.to_numeric(total_2_raw, errors="coerce")
-    if not pd.isna(total_2):
-        acc_2 = row.get(account_code_2, "")
-        if needs_red_highlight(acc_2):
-            return True
-
-    # Check account_code_3
-    total_3_raw = str(row.get(account_code_3_total, "")).replace(",", "")
-    total_3 = pd.to_numeric(total_3_raw, errors="coerce")
-    if not pd.isna(total_3):
-        acc_3 = row.get(account_code_3, "")
-        if needs_red_highlight(acc_3):
-            return True
-
-    return False
+    return not parse_account(str(account)).valid
+
+# If amount is not empty then the account code will be highlighted. Returns a boolean mask,
+# True for rows where an account with a numeric total fails needs_red_highlight.
+def should_highlight_account(df):
+    highlight = np.zeros(len(df), dtype=bool)
+    for account_col, total_col in ACCOUNT_SLOTS:
+        if total_col not in df.columns:
+            continue
+        total = pd.to_numeric(df[total_col].astype(str).str.replace(",", "", regex=False), errors="coerce")
+        if account_col in df.columns:
+            red = invalid_account_mask(df[account_col])
+        else:
+            red = np.ones(len(df), dtype=bool)
+        highlight |= total.notna().to_numpy() & red
+    return pd.Series(highlight, index=df.index)
+
+# Account code / amount column pairs an AP row can come from, in the order they are used
+ACCOUNT_SLOTS = ((account_code_1, account_code_1_total), (account_code_2, account_code_2_total), (account_code_3, account_code_3_total))
+
+# Amounts as the AP rows read them: commas dropped, unparseable values NaN and zero as 0.0.
+# A missing column reads as 0.
+def parse_amount_column(df, col):
+    if col not in df.columns:
+        return np.zeros(len(df))
+    text = df[col].astype(str).str.replace(",", "", regex=False)
+    amounts = pd.to_numeric(text, errors="coerce").to_numpy(dtype=float, copy=True)
+    amounts[amounts == 0] = 0.0
+    return amounts
+
+# Raw account values of a column as objects, "" when the column is missing
+def raw_account_column(df, col):
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    return df[col].astype(object)
+
+# Truthiness of each raw account value. NaN is truthy and None is not, as in Python.
+def account_truthiness(raw):
+    text = raw.astype(str)
+    truthy = map_unique_values(raw, bool, na_value=True).to_numpy(dtype=bool)
+    truthy[(raw.isna() & text.eq("None")).to_numpy()] = False
+    return truthy
+
+# Account an AP row is booked to: the formatted account, else the raw value when it is not
+# blank, else "".
+def final_account_column(raw):
+    final = normalize_account_series(raw)
+
+    unformatted = final == ""
+    keep_raw = map_unique_values(raw[unformatted], lambda value: bool(value and str(value).strip()), na_value=False).to_numpy(dtype=bool)
+    final[np.flatnonzero(unformatted)[keep_raw]] = raw.to_numpy(dtype=object)[unformatted][keep_raw]
+    return final
+
+# Expand matched rows into AP upload rows, one per distinct account of a row with the amounts
+# of repeated accounts summed. A row with a single account books the Total Reimbursement when
+# it is positive, a row without accounts books it to " " and a row with neither gets a zero
+# amount row. Same rows, order and values as expanding row by row; a row whose invoice number
+# cannot be built (non-finite amount) is cut short from that account on.
+def expand_account_rows(matched_df, columns):
+    n_rows = len(matched_df)
+    if not n_rows:
+        return pd.DataFrame([])
+
+    # Invoice number base: the form's invoice number, else the month of the invoice date
+    invoice_number = matched_df["Invoice #"].astype(str).str.strip() if "Invoice #" in matched_df.columns else pd.Series("", index=matched_df.index)
+    invoice_date = matched_df["Invoice Date"].astype(str).str.strip() if "Invoice Date" in matched_df.columns else pd.Series("", index=matched_df.index)
+    invoice_base = np.where(
+        invoice_number.ne(""), invoice_number,
+        np.where(invoice_date.ne(""), mon_year_column(invoice_date), "")
+    ).astype(object)
+
+    total_reimbursement = parse_amount_column(matched_df, "Total Reimbursement")
+    raw_accounts = [raw_account_column(matched_df, account_col) for account_col, _ in ACCOUNT_SLOTS]
+    accounts = [final_account_column(raw) for raw in raw_accounts]
+    amounts = [parse_amount_column(matched_df, amount_col) for _, amount_col in ACCOUNT_SLOTS]
+    included = [(account != "") & ~np.isnan(amount) for account, amount in zip(accounts, amounts)]
+
+    # Repeated accounts are summed into their first slot, left to right
+    merge_2_into_1 = included[1] & included[0] & (accounts[1] == accounts[0])
+    merge_3_into_1 = included[2] & included[0] & (accounts[2] == accounts[0])
+    merge_3_into_2 = included[2] & ~merge_3_into_1 & included[1] & ~merge_2_into_1 & (accounts[2] == accounts[1])
+    leads = [included[0], included[1] & ~merge_2_into_1, included[2] & ~merge_3_into_1 & ~merge_3_into_2]
+
+    sums = [amounts[0].copy(), amounts[1].copy(), amounts[2].copy()]
+    with np.errstate(invalid="ignore"):
+        sums[0] = np.where(merge_2_into_1, sums[0] + amounts[1], sums[0])
+        sums[0] = np.where(merge_3_into_1, sums[0] + amounts[2], sums[0])
+        sums[1] = np.where(merge_3_into_2, sums[1] + amounts[2], sums[1])
+
+    has_account = included[0] | included[1] | included[2]
+    single_account = has_account & (leads[0].astype(int) + leads[1] + leads[2] == 1) & (total_reimbursement > 0)
+    sums = [np.where(single_account, total_reimbursement, amount) for amount in sums]
+
+    # Rows without accounts: the total against " ", else a zero row against the first truthy raw account
+    fallback = ~has_account & (total_reimbursement > 0)
+    zero = ~has_account & ~(total_reimbursement > 0)
+    truthy = [account_truthiness(raw) for raw in raw_accounts]
+    pick = np.where(truthy[0], 0, np.where(truthy[1], 1, 2))
+    picked = np.choose(pick, [raw.to_numpy(dtype=object) for raw in raw_accounts])
+    picked_truthy = np.choose(pick, truthy)
+    picked_text = pd.Series(picked, dtype=object).astype(str).str.strip().to_numpy(dtype=object)
+    zero_account = np.where(picked_truthy & (picked_text != ""), picked, " ")
+
+    positions, order, account, amount = [], [], [], []
+    for slot, lead in enumerate(leads):
+        rows = np.flatnonzero(lead)
+        positions.append(rows)
+        order.append(np.full(len(rows), slot))
+        account.append(accounts[slot][rows])
+        amount.append(sums[slot][rows])
+    for mask, row_account, row_amount in ((fallback, " ", total_reimbursement), (zero, zero_account, np.zeros(n_rows))):
+        rows = np.flatnonzero(mask)
+        positions.append(rows)
+        order.append(np.zeros(len(rows), dtype=int))
+        account.append(np.full(len(rows), row_account, dtype=object) if isinstance(row_account, str) else row_account[rows])
+        amount.append(row_amount[rows])
+
+    positions, order = np.concatenate(positions), np.concatenate(order)
+    sort = np.lexsort((order, positions))
+    positions, account, amount = positions[sort], np.concatenate(account)[sort], np.concatenate(amount)[sort]
+
+    # The invoice number needs int(amount * 100), which fails for inf and NaN
+    base = invoice_base[positions]
+    has_base = base != ""
+    failed = pd.Series(has_base & ~np.isfinite(amount)).groupby(positions).cummax().to_numpy()
+    if failed.any():
+        positions, account, amount, base, has_base = (values[~failed] for values in (positions, account, amount, base, has_base))
+        if not len(positions):
+            return pd.DataFrame([])
+
+    cents = map_unique_values(pd.Series(np.where(np.isfinite(amount), amount, 0.0)), lambda value: str(int(value * 100)))
+    invoice = np.where(has_base, base + " " + cents.to_numpy(dtype=object), "")
+
+    expanded = {col: matched_df[col].to_numpy(dtype=object)[positions].tolist() for col in columns if col in matched_df.columns}
+    expanded.update({"Account": account.tolist(), "Amount": amount.tolist(), "Invoice #": invoice.tolist()})
+    return pd.DataFrame(expanded, index=matched_df.index[positions])
 
 # Create the csv file using the merged sheet
 def create_matched_data_sheet(comparison_df):
@@ -992,7 +1350,7 @@ def create_matched_data_sheet(comparison_df):
 
         # Highlight accounts (catch errors per row)
         try:
-            comparison_df["Highlight_Account"] = comparison_df.apply(should_highlight_account, axis=1)
+            comparison_df["Highlight_Account"] = should_highlight_account(comparison_df)
         except Exception as e:
             logger.error(f"Error applying should_highlight_account: {e}")
             comparison_df["Highlight_Account"] = False
@@ -1016,7 +1374,7 @@ def create_matched_data_sheet(comparison_df):
 
         if "Invoice Date" in comparison_df.columns:
             try:
-                matched_df["Invoice Date"] = matched_df["Invoice Date"].apply(format_invoice_date)
+                matched_df["Invoice Date"] = mddyyyy_column(matched_df["Invoice Date"])
             except Exception as e:
                 logger.error(f"Error formatting 'Invoice Date': {e}")
                 matched_df["Invoice Date"] = matched_df["Invoice Date"]
@@ -1024,116 +1382,11 @@ def create_matched_data_sheet(comparison_df):
             logger.warning("Invoice Date column is missing from comparison_df.")
             matched_df["Invoice Date"] = None
 
-        # Ensure match_col is in template_columns
-        if match_col not in template_columns:
-            template_columns.append(match_col)
-
-        expanded_rows = []
+        # Template columns with match_col, without changing the config list: the run fingerprint
+        # covers the config, so changing it would make the next run look different
+        columns = template_columns if match_col in template_columns else template_columns + [match_col]
 
-        for idx, row in matched_df.iterrows():
-            try:
-                row_copy = row.copy()
-
-                invoice_number = str(row_copy.get("Invoice #", "")).strip()
-                invoice_date = str(row_copy.get("Invoice Date", "")).strip()
-
-                if invoice_number:
-                    invoice_base = invoice_number
-                elif invoice_date:
-                    invoice_base = mon_year_invoice_date(invoice_date)
-                else:
-                    invoice_base = ""
-
-                amount_1 = str(row_copy.get(account_code_1_total, "0")).replace(",", "")
-                amount_2 = str(row_copy.get(account_code_2_total, "0")).replace(",", "")
-                amount_3 = str(row_copy.get(account_code_3_total, "0")).replace(",", "")
-                total_reimbursement = str(row_copy.get("Total Reimbursement", "0")).replace(",", "")
-
-                # amount_1 = clean_amount(row_copy.get(account_code_1_total, "0"))
-                # amount_2 = clean_amount(row_copy.get(account_code_2_total, "0"))
-                # amount_3 = clean_amount(row_copy.get(account_code_3_total, "0"))
-                # total_reimbursement = clean_amount(row_copy.get("Total Reimbursement", "0"))
-
-
-                amount_1 = pd.to_numeric(amount_1, errors="coerce") or 0.0
-                amount_2 = pd.to_numeric(amount_2, errors="coerce") or 0.0
-                amount_3 = pd.to_numeric(amount_3, errors="coerce") or 0.0
-                total_reimbursement = pd.to_numeric(total_reimbursement, errors="coerce") or 0.0
-
-                account_amounts = {}
-                original_accounts = [
-                    (row_copy.get(account_code_1, ""), amount_1),
-                    (row_copy.get(account_code_2, ""), amount_2),
-                    (row_copy.get(account_code_3, ""), amount_3)
-                ]
-
-                has_account = False
-
-                for raw_acc, amt in original_accounts:
-                    formatted_acc = ""
-                    try:
-                        formatted_acc = format_account_number(raw_acc)
-                    except Exception as e:
-                        logger.error(f"Error formatting account number '{raw_acc}': {e}")
-
-                    final_acc = formatted_acc if formatted_acc else (raw_acc if raw_acc and str(raw_acc).strip() else "")
-
-                    if str(final_acc).strip() and pd.notna(amt):
-                        has_account = True
-                        if final_acc in account_amounts:
-                            account_amounts[final_acc] += amt
-                        else:
-                            account_amounts[final_acc] = amt
-
-                # Logic for only one account with total reimbursement > 0
-                if has_account and len(account_amounts) == 1 and total_reimbursement > 0:
-                    only_account = next(iter(account_amounts))
-                    account_amounts[only_account] = total_reimbursement
-
-                # Add rows based on accounts and amounts
-                if has_account:
-                    for account, amount in account_amounts.items():
-                        row_copy_new = row.copy()
-                        row_copy_new["Account"] = account
-                        row_copy_new["Amount"] = amount
-                        row_copy_new["Invoice #"] = f"{invoice_base} {int(amount * 100)}" if invoice_base else ""
-                        row_copy_new[match_col] = row.get(match_col, "")
-                        try:
-                            row_copy_new["Highlight_Account"] = needs_red_highlight(account)
-                        except Exception as e:
-                            logger.error(f"Error determining highlight for account '{account}': {e}")
-                            row_copy_new["Highlight_Account"] = False
-                        expanded_rows.append(row_copy_new)
-
-                elif total_reimbursement > 0:
-                    row_copy_new = row.copy()
-                    # raw_acc_fallback = row_copy.get(account_code_1, "") or row_copy.get(account_code_2, "") or row_copy.get(account_code_3, "")
-                    # row_copy_new["Account"] = raw_acc_fallback if raw_acc_fallback and str(raw_acc_fallback).strip() else " "
-                    row_copy_new["Account"] = " "
-                    row_copy_new["Amount"] = total_reimbursement
-                    row_copy_new["Invoice #"] = f"{invoice_base} {int(total_reimbursement * 100)}" if invoice_base else ""
-                    row_copy_new[match_col] = row.get(match_col, "")
-                    row_copy_new["Highlight_Account"] = True
-                    expanded_rows.append(row_copy_new)
-
-                else:
-                    row_copy_new = row.copy()
-                    raw_acc_fallback = row_copy.get(account_code_1, "") or row_copy.get(account_code_2, "") or row_copy.get(account_code_3, "")
-                    row_copy_new["Account"] = raw_acc_fallback if raw_acc_fallback and str(raw_acc_fallback).strip() else " "
-                    row_copy_new["Amount"] = 0
-                    row_copy_new["Invoice #"] = f"{invoice_base} 0" if invoice_base else ""
-                    row_copy_new[match_col] = row.get(match_col, "")
-                    try:
-                        row_copy_new["Highlight_Account"] = needs_red_highlight(raw_acc_fallback)
-                    except Exception as e:
-                        logger.error(f"Error determining highlight for fallback account '{raw_acc_fallback}': {e}")
-                        row_copy_new["Highlight_Account"] = False
-                    expanded_rows.append(row_copy_new)
-
-            except Exception as e:
-                logger.error(f"Error processing row index {idx}: {e}")
-
-        matched_df = pd.DataFrame(expanded_rows)
+        matched_df = expand_account_rows(matched_df, columns)
 
         # Rename and create columns based on mapping
         for new_col, old_col in column_mapping.items():
@@ -1179,27 +1432,28 @@ def create_matched_data_sheet(comparison_df):
             logger.warning("comment variable not found; 'Comment' column set to None.")
 
         # Ensure all template columns exist
-        for col in template_columns:
+        for col in columns:
             if col not in matched_df.columns:
                 matched_df.loc[:, col] = None
 
         # Reorder columns based on template
-        matched_df = matched_df[template_columns]
+        matched_df = matched_df[columns]
 
         return matched_df
 
     except Exception as e:
         logger.error(f"Fatal error in create_matched_data_sheet: {e}")
+        mark_run_degraded(f"create_matched_data_sheet: {e}")
         # Return empty DataFrame with template columns on fatal failure
         return pd.DataFrame(columns=template_columns)
     
 
-# Apply highlighting to the sheet based on Match Status.
-def apply_highlighting(excel_file_path, include_legend=True, highlight=True):
-    wb = load_workbook(excel_file_path)
-    ws = wb[sheet5]
-
-    # Define highlight colors
+# Decide the Merged sheet fills from the DataFrame before it is written. Rows with a blank
+# Payee Name or an employee that was not found are red. With highlight=True every Account
+# column is checked, otherwise only Account Code 1-3 cells whose total is a number. Match Status
+# and Highlight_Account are left out, the header is green and the legend goes four columns
+# right of the table. Returns the write_sheet arguments, or None when there is no Match Status.
+def highlight_plan(df, include_legend=True, highlight=True):
     red_fill = PatternFill(start_color="FF6347", end_color="FF6347", fill_type="solid")
     green_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
 
@@ -1207,9 +1461,8 @@ def apply_highlighting(excel_file_path, include_legend=True, highlight=True):
     account_code_cols = []
     payee_name_col = None
 
-    # Identify required column indices
-    for col in range(1, ws.max_column + 1):
-        col_value = ws.cell(row=1, column=col).value
+    # Identify required column positions
+    for col, col_value in enumerate(df.columns):
         if col_value == match_col:
             match_status_col = col
         elif isinstance(col_value, str) and col_value.startswith("Account") and "Total" not in col_value:
@@ -1218,111 +1471,86 @@ def apply_highlighting(excel_file_path, include_legend=True, highlight=True):
             payee_name_col = col
 
     if match_status_col is None:
-        return {"error": "Match Status column not found!"}
-
-    # Highlight rows with missing Payee Name
-    if payee_name_col:
-        for row in range(2, ws.max_row + 1):
-            payee_name = ws.cell(row=row, column=payee_name_col).value
-            if not str(payee_name).strip():
-                for col in range(1, ws.max_column + 1):
-                    ws.cell(row=row, column=col).fill = red_fill
-
-    # Highlight rows based on Match Status
-    for row in range(2, ws.max_row + 1):
-        match_status = ws.cell(row=row, column=match_status_col).value
-        if match_status == not_found:
-            for col in range(1, ws.max_column + 1):
-                ws.cell(row=row, column=col).fill = red_fill
-
-    # Highlight invalid Account Codes
-    if highlight:
-        for row in range(2, ws.max_row + 1):
-            for col in account_code_cols:
-                account_value = ws.cell(row=row, column=col).value
-                account_str = str(account_value).strip() if account_value is not None else ""
+        return None
 
-                if not format_account_number(account_value) or needs_red_highlight(account_str):
-                    ws.cell(row=row, column=col).fill = red_fill
-    else:
-        # Use column names to find account/total pairings
-        account_code_cols = [
-            correct_column_order.index("Account Code 1") + 1,
-            correct_column_order.index("Account Code 2") + 1,
-            correct_column_order.index("Account Code 3") + 1,
-        ]
+    # Values as they read back from the sheet: NaN, None and "" are all empty cells
+    def column(position):
+        values = df.iloc[:, position]
+        return values.where(values.ne(""), None).astype(object)
 
-        account_col_to_total_col = {
-            account_code_cols[0]: account_code_1_total,
-            account_code_cols[1]: account_code_2_total,
-            account_code_cols[2]: account_code_3_total,
-        }
+    # Rows with a blank Payee Name or Match Status Not Found
+    row_mask = column(match_status_col).eq(not_found).to_numpy(dtype=bool)
+    if payee_name_col is not None:
+        row_mask |= map_unique_values(column(payee_name_col), lambda value: not str(value).strip(), na_value=False).to_numpy(dtype=bool)
 
-        for row in range(2, ws.max_row + 1):
-            for col in account_code_cols:
-                account_value = ws.cell(row=row, column=col).value
-                total_col_name = account_col_to_total_col.get(col)
-                total_col_index = correct_column_order.index(total_col_name) + 1
-                total_value = ws.cell(row=row, column=total_col_index).value
-                total_numeric = pd.to_numeric(str(total_value).replace(",", ""), errors="coerce") if total_value else None
-
-                if pd.isna(total_numeric):
-                    continue
-
-                account_str = str(account_value).strip() if account_value is not None else ""
-                if needs_red_highlight(account_str):
-                    ws.cell(row=row, column=col).fill = red_fill
-
-    # Delete "Highlight_Account" column if present
-    highlight_col_index = None
-    for col in range(1, ws.max_column + 1):
-        if ws.cell(row=1, column=col).value == "Highlight_Account":
-            highlight_col_index = col
-            break
-    if highlight_col_index:
-        ws.delete_cols(highlight_col_index)
-
-    # Delete Match Status column
-    ws.delete_cols(match_status_col)
-
-    # Apply green header highlight
-    for col in range(1, ws.max_column + 1):
-        ws.cell(row=1, column=col).fill = green_fill
-
-    # Add legend if needed
+    # Invalid account codes
+    cell_fills = {}
+    if highlight:
+        for col in account_code_cols:
+            parsed = parse_account_series(column(col), strip=True)
+            red = np.fromiter((not account.normalized or not account.valid for account in parsed), dtype=bool, count=len(parsed))
+            cell_fills[col] = (red, red_fill)
+    else:
+        for account_name, total_name in ((account_code_1, account_code_1_total), (account_code_2, account_code_2_total), (account_code_3, account_code_3_total)):
+            col, total_col = correct_column_order.index(account_name), correct_column_order.index(total_name)
+            if col >= len(df.columns) or total_col >= len(df.columns):
+                continue
+            has_total = map_unique_values(
+                column(total_col),
+                lambda value: bool(value) and pd.notna(pd.to_numeric(str(value).replace(",", ""), errors="coerce")),
+                na_value=False,
+            )
+            red = invalid_account_mask(column(col), strip=True)
+            cell_fills[col] = (has_total.to_numpy(dtype=bool) & red, red_fill)
+
+    # Drop Highlight_Account, then the column at Match Status's original position
+    columns = list(range(len(df.columns)))
+    if "Highlight_Account" in list(df.columns):
+        del columns[list(df.columns).index("Highlight_Account")]
+    if match_status_col < len(columns):
+        del columns[match_status_col]
+
+    extra_cells = {}
     if include_legend:
-        last_column = ws.max_column
-        label_col = last_column + 4
-        ws.cell(row=1, column=label_col, value="").fill = red_fill
-        ws.cell(row=1, column=label_col + 1, value=not_found + " (Employee ID Missing or Incorrect Account Code Format)")
-        ws.cell(row=2, column=label_col + 1, value=matched)
-
-    wb.save(excel_file_path)
-    wb.close()
+        label_col = max(len(columns), 1) + 4
+        extra_cells[1] = {label_col: ("", red_fill), label_col + 1: (not_found + " (Employee ID Missing or Incorrect Account Code Format)", None)}
+        extra_cells[2] = {label_col + 1: (matched, None)}
+
+    return {
+        "columns": columns,
+        "header_fill": green_fill,
+        "row_fill": (row_mask, red_fill),
+        "cell_fills": cell_fills,
+        "extra_cells": extra_cells,
+    }
+
+# Write the Match Status sheet with its highlighting, or as is when it has no Match Status
+def write_highlighted_sheet(writer, df, include_legend=True, highlight=True):
+    with measure_stage("highlight", len(df)):
+        plan = highlight_plan(df, include_legend=include_legend, highlight=highlight)
+    if plan is None:
+        logger.warning("Match Status column not found! Writing the sheet without highlighting.")
+        writer.write_sheet(sheet5, df)
+    else:
+        writer.write_sheet(sheet5, df, **plan)
 
-# Save processed data to an Excel file. 
+# Save processed data to an in-memory Excel file
 def save_to_excel(df_expense, df_mileage, df_conference, df_escape, final_comparison_df):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_file:
-        temp_excel_path = temp_file.name
-
-    with pd.ExcelWriter(temp_excel_path, engine='openpyxl') as writer:
-        df_expense.to_excel(writer, sheet_name=sheet1, index=False)
-        df_mileage.to_excel(writer, sheet_name=sheet2, index=False)
-        df_conference.to_excel(writer, sheet_name=sheet3, index=False)
-        df_escape.to_excel(writer, sheet_name=sheet4, index=False)
-        final_comparison_df.to_excel(writer, sheet_name=sheet5, index=False)
-    apply_highlighting(temp_excel_path, include_legend=True, highlight=False) # Apply the highlight
-    return temp_excel_path
-
-# Save final data to an Excel file. 
+    excel_buffer = io.BytesIO()
+    with StreamingExcelWriter(excel_buffer) as writer:
+        writer.write_sheet(sheet1, df_expense)
+        writer.write_sheet(sheet2, df_mileage)
+        writer.write_sheet(sheet3, df_conference)
+        writer.write_sheet(sheet4, df_escape)
+        write_highlighted_sheet(writer, final_comparison_df, include_legend=True, highlight=False) # Apply the highlight
+    return excel_buffer
+
+# Save final data to an in-memory Excel file
 def save_to_excel_final(matched_df):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_csv_file:
-            temp_csv_path = temp_csv_file.name
-
-    with pd.ExcelWriter(temp_csv_path, engine='openpyxl') as writer:
-        matched_df.to_excel(writer, sheet_name=sheet5, index=False)
-    apply_highlighting(temp_csv_path, include_legend=False, highlight=True)
-    return temp_csv_path
+    csv_buffer = io.BytesIO()
+    with StreamingExcelWriter(csv_buffer) as writer:
+        write_highlighted_sheet(writer, matched_df, include_legend=False, highlight=True)
+    return csv_buffer
     
 # Find the next Sunday at 23:59:59
 def get_current_timestamp():
@@ -1344,62 +1572,77 @@ def get_date_range_filename():
     return start_date_str, end_date_str
 
 # Process to fetch data, transform and upload back to google drive.
+# Target fields (old, new), rename function and columns of each form's pipeline
+FORM_PIPELINES = {
+    'expense': ((target_fields_expense_old, target_fields_expense), rename_expense_columns, EXPENSE_COLUMNS),
+    'mileage': ((target_fields_mileage_old, target_fields_mileage), rename_mileage_columns, common_column),
+    'conference': ((target_fields_conference_old, target_fields_conference), rename_conference_columns, common_column),
+}
+
+
+# Turn one campaign's responses into its form DataFrame. Runs in a worker process when
+# PIPELINE_WORKERS > 1, so it depends on nothing but its arguments and module constants.
+def build_form_dataframe(category, is_old_campaign, data):
+    target_fields, rename_columns, columns = FORM_PIPELINES[category]
+    form_name = f"{category}_{'old' if is_old_campaign else 'new'}"
+
+    with measure_stage("parse", len(response_list(data)), form=form_name) as record:
+        field_mapping = extract_field_mapping(data, target_fields[0] if is_old_campaign else target_fields[1])
+        df = process_api_data(data, field_mapping)
+        record["rows_out"] = len(df)
+
+    with measure_stage("invoice", len(df), form=form_name) as record:
+        df = generate_invoice_number(df, field_mapping, category, is_old_campaign=is_old_campaign)
+        record["rows_out"] = len(df)
+
+    with measure_stage("rename", len(df), form=form_name) as record:
+        if category == 'conference':
+            df = combine_account_codes(df, field_mapping)
+        df = rename_columns(df, field_mapping, columns)
+        record["rows_out"] = len(df)
+    return df
+
+
+# build_form_dataframe with its stage records and degraded marks, which a worker process has
+# to send back
+def build_form_dataframe_measured(category, is_old_campaign, data):
+    with measure_run(category) as run:
+        df = build_form_dataframe(category, is_old_campaign, data)
+    return df, run.stages, run.degraded
+
+
 def process_and_upload_files(old_expense_data, new_expense_data, old_mileage_data, new_mileage_data, old_conference_data, new_conference_data, drive_service, GOOGLE_DRIVE_FOLDER_ID1, GOOGLE_DRIVE_FOLDER_ID2, FILE_NAME_TO_DOWNLOAD, X_Authorization, new_excel_name, new_csv_name, upload_excel_true):
     try:
         logger.info("Creating new file..")
-        file_id = get_file_id_from_folder(GOOGLE_DRIVE_FOLDER_ID1, FILE_NAME_TO_DOWNLOAD)
-
-        if file_id:
-            df_escape = load_excel_from_drive(drive_service, file_id)
-            logger.info("Fetched the Escape data")
-            if df_escape.empty:
-                logger.info(f"Warning: File {FILE_NAME_TO_DOWNLOAD} is empty. Initializing an empty DataFrame.")
-                df_escape = pd.DataFrame()  # Ensure df_escape is empty if the file has no data
-        else:
-            logger.info(f"File '{FILE_NAME_TO_DOWNLOAD}' not found in folder {GOOGLE_DRIVE_FOLDER_ID1}. Creating an empty Escape sheet.")
-            df_escape = pd.DataFrame()
+        with measure_stage("roster_load") as record:
+            df_escape = load_escape_roster(drive_service, GOOGLE_DRIVE_FOLDER_ID1, FILE_NAME_TO_DOWNLOAD)
+            record["rows_out"] = len(df_escape)
+        logger.info("Fetched the Escape data")
+        if df_escape.empty:
+            logger.info(f"Warning: File {FILE_NAME_TO_DOWNLOAD} is empty or missing. Initializing an empty DataFrame.")
 
         logger.info("Fetched the API data")
 
-        new_expense_mapping = extract_field_mapping(new_expense_data, target_fields_expense)
-        old_expense_mapping = extract_field_mapping(old_expense_data, target_fields_expense_old)
-
-        df_expense_new = process_api_data(new_expense_data, new_expense_mapping)
-        df_expense_new = generate_invoice_number(df_expense_new, new_expense_mapping, 'expense', is_old_campaign=False)
-        df_expense_new = rename_expense_columns(df_expense_new, new_expense_mapping, EXPENSE_COLUMNS)
-
-        df_expense_old = process_api_data(old_expense_data, old_expense_mapping)
-        df_expense_old = generate_invoice_number(df_expense_old, old_expense_mapping, 'expense', is_old_campaign=True)
-        df_expense_old = rename_expense_columns(df_expense_old, old_expense_mapping, EXPENSE_COLUMNS)
+        form_jobs = [
+            ('expense', True, old_expense_data), ('expense', False, new_expense_data),
+            ('mileage', True, old_mileage_data), ('mileage', False, new_mileage_data),
+            ('conference', True, old_conference_data), ('conference', False, new_conference_data),
+        ]
+        # Small runs are faster in this process than sent to the workers
+        responses = sum(len(response_list(data)) for _, _, data in form_jobs)
+        forms = run_in_processes(build_form_dataframe_measured, form_jobs, PIPELINE_WORKERS if responses >= PIPELINE_MIN_RESPONSES else 1)
+        run = current_run.get()
+        if run is not None:
+            for _, stages, degraded in forms:
+                run.add_stages(stages)
+                for reason in degraded:
+                    run.mark_degraded(reason)
+        (df_expense_old, df_expense_new,
+         df_mileage_old, df_mileage_new,
+         df_conference_old, df_conference_new) = (df for df, _, _ in forms)
 
         df_expense = pd.concat([df_expense_old, df_expense_new], ignore_index=True)
-
-        new_mileage_mapping = extract_field_mapping(new_mileage_data, target_fields_mileage)
-        old_mileage_mapping = extract_field_mapping(old_mileage_data, target_fields_mileage_old)
-
-        df_mileage_new = process_api_data(new_mileage_data, new_mileage_mapping)
-        df_mileage_new = generate_invoice_number(df_mileage_new, new_mileage_mapping, 'mileage', is_old_campaign=False)
-        df_mileage_new = rename_mileage_columns(df_mileage_new, new_mileage_mapping, common_column)
-
-        df_mileage_old = process_api_data(old_mileage_data, old_mileage_mapping)
-        df_mileage_old = generate_invoice_number(df_mileage_old, old_mileage_mapping, 'mileage', is_old_campaign=True)
-        df_mileage_old = rename_mileage_columns(df_mileage_old, old_mileage_mapping, common_column)
-
         df_mileage = pd.concat([df_mileage_old, df_mileage_new], ignore_index=True)
-
-        new_conference_mapping = extract_field_mapping(new_conference_data, target_fields_conference)
-        old_conference_mapping = extract_field_mapping(old_conference_data, target_fields_conference_old)
-
-        df_conference_new = process_api_data(new_conference_data, new_conference_mapping)
-        df_conference_new = generate_invoice_number(df_conference_new, new_conference_mapping, 'conference', is_old_campaign=False)
-        df_conference_new = combine_account_codes(df_conference_new, new_conference_mapping)
-        df_conference_new = rename_conference_columns(df_conference_new, new_conference_mapping, common_column)
-
-        df_conference_old = process_api_data(old_conference_data, old_conference_mapping)
-        df_conference_old = generate_invoice_number(df_conference_old, old_conference_mapping, 'conference', is_old_campaign=True)
-        df_conference_old = combine_account_codes(df_conference_old, old_conference_mapping)
-        df_conference_old = rename_conference_columns(df_conference_old, old_conference_mapping, common_column)
-
         df_conference= pd.concat([df_conference_old, df_conference_new], ignore_index=True)
 
         if df_escape.empty:
@@ -1409,61 +1652,52 @@ def process_and_upload_files(old_expense_data, new_expense_data, old_mileage_dat
             matched_df = create_matched_data_sheet(final_comparison_df) 
 
         else:
-            df_escape = rename_escape_columns(df_escape, escape_header)
-            
-            if df_expense.empty:
-                logger.info("Expense data is empty. Initializing with headers only.")
-                df_expense = pd.DataFrame(columns=EXPENSE_COLUMNS)
-            else:
-                df_expense, df_escape = prepare_dataframes(df_expense, df_escape)
-
-            if df_mileage.empty:
-                logger.info("Mileage data is empty. Initializing with headers only.")
-                df_mileage = pd.DataFrame(columns=common_column)
-            else:
-                df_mileage, df_escape = prepare_dataframes(df_mileage, df_escape)
+            with measure_stage("merge", len(df_expense) + len(df_mileage) + len(df_conference)) as record:
+                if df_expense.empty:
+                    logger.info("Expense data is empty. Initializing with headers only.")
+                    df_expense = pd.DataFrame(columns=EXPENSE_COLUMNS)
+                else:
+                    df_expense = prepare_dataframes(df_expense)
 
-            if df_conference.empty:
-                logger.info("Conference data is empty. Initializing with headers only.")
-                df_conference = pd.DataFrame(columns=common_column)
-            else:
-                df_conference, df_escape = prepare_dataframes(df_conference, df_escape)
+                if df_mileage.empty:
+                    logger.info("Mileage data is empty. Initializing with headers only.")
+                    df_mileage = pd.DataFrame(columns=common_column)
+                else:
+                    df_mileage = prepare_dataframes(df_mileage)
 
-            final_comparison_df = merge_and_compare_data_combined(df_expense, df_escape, df_mileage, df_conference)
-            matched_df = create_matched_data_sheet(final_comparison_df)
+                if df_conference.empty:
+                    logger.info("Conference data is empty. Initializing with headers only.")
+                    df_conference = pd.DataFrame(columns=common_column)
+                else:
+                    df_conference = prepare_dataframes(df_conference)
 
-        temp_excel_path = save_to_excel(df_expense, df_mileage, df_conference, df_escape, final_comparison_df)
-        temp_csv_path = save_to_excel_final(matched_df)
+                final_comparison_df = merge_and_compare_data_combined(df_expense, df_escape, df_mileage, df_conference)
+                record["rows_out"] = len(final_comparison_df)
 
-        get_all_file_ids_from_folder(GOOGLE_DRIVE_FOLDER_ID2)
+            with measure_stage("expansion", len(final_comparison_df)) as record:
+                matched_df = create_matched_data_sheet(final_comparison_df)
+                record["rows_out"] = len(matched_df)
 
-        uploaded_excel = None
-        uploaded_csv = None
+        with measure_stage("workbook_write", len(final_comparison_df) + len(matched_df)) as record:
+            excel_buffer = save_to_excel(df_expense, df_mileage, df_conference, df_escape, final_comparison_df)
+            csv_buffer = save_to_excel_final(matched_df)
+            record["bytes"] = excel_buffer.getbuffer().nbytes + csv_buffer.getbuffer().nbytes
 
-        # Step 1: Upload the new files first
-        file_metadata_csv = {
-            'name': new_csv_name,
-            'parents': [GOOGLE_DRIVE_FOLDER_ID2]
-        }
-        with open(temp_csv_path, 'rb') as csv_file:
-            media_csv = MediaIoBaseUpload(csv_file, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            uploaded_csv = drive_service.files().create(
-                body=file_metadata_csv, media_body=media_csv, 
-                fields='id, webViewLink', supportsAllDrives=True
-            ).execute()
+        with measure_stage("rotate"):
+            get_all_file_ids_from_folder(GOOGLE_DRIVE_FOLDER_ID2)
 
+        # Step 1: Upload the new files first, side by side
+        uploads = [({'name': new_csv_name, 'parents': [GOOGLE_DRIVE_FOLDER_ID2]}, csv_buffer)]
         if upload_excel_true:
-            file_metadata_excel = {
-                'name': new_excel_name,
-                'parents': [GOOGLE_DRIVE_FOLDER_ID2]
-            }
-            with open(temp_excel_path, 'rb') as excel_file:
-                media_excel = MediaIoBaseUpload(excel_file, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-                uploaded_excel = drive_service.files().create(
-                    body=file_metadata_excel, media_body=media_excel, 
-                    fields='id, webViewLink', supportsAllDrives=True
-                ).execute()
+            uploads.append(({'name': new_excel_name, 'parents': [GOOGLE_DRIVE_FOLDER_ID2]}, excel_buffer))
+
+        with measure_stage("upload") as record:
+            uploaded = upload_files(drive_service, creds, uploads, DRIVE_UPLOAD_WORKERS, UPLOAD_CHUNK_SIZE, UPLOAD_MAX_RESUMES)
+            record["rows_out"] = len(uploaded)
+            record["bytes"] = sum(buffer.getbuffer().nbytes for _, buffer in uploads)
 
+        uploaded_csv = uploaded[0]
+        uploaded_excel = uploaded[1] if upload_excel_true else None
 
         # Return the new file links
         return {
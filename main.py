@@ -3,6 +3,8 @@ from logic import *
 from apscheduler.schedulers.background import BackgroundScheduler
 import time
 import config
+from run_metrics import measure_run
+from informed_client import measure_requests
 
 # Feteching required variables from the config file
 CAMPAIGN_IDS = config.CAMPAIGN_IDS
@@ -11,6 +13,7 @@ status_completed = config.STATUS_COMPLETED
 upload_excel_true = config.upload_excel_true
 upload_excel_false = config.upload_excel_false
 est = config.est
+METRICS_DIR = config.METRICS_DIR
 
 # logger called
 logging.basicConfig(level=logging.INFO)
@@ -21,61 +24,112 @@ logger = logging.getLogger(__name__)
 scheduler = BackgroundScheduler(timezone=est)  
 
 # Runs the status completed api for Expense, Mileage and Conference
-# data processing and creates the Merged Sheet and AP-Reimbursement Upload CSV files
-def run_script_completed():
+# data processing and creates the Merged Sheet and AP-Reimbursement Upload CSV files.
+# categories (e.g. ["expense"]) limits the API refresh to those campaigns, the others use the
+# stored responses. fresh skips the API pages fetched by another run moments ago, for a forced
+# run. Returns the run, with the uploaded file links in run.result.
+def run_script_completed(categories=None, fresh=False):
     """Runs every hour to process completed data."""
     logger.info("Executing hourly scheduled task for completed data...")
-    try:
-        GOOGLE_DRIVE_FOLDER_ID2 = config.GOOGLE_DRIVE_FOLDER_ID_COMPLETED
-        headers = {"accept": "application/json", "X-Authorization": X_Authorization}
-        
-        old_expense_url = f"{url}{CAMPAIGN_IDS['expense']['old']}{status_completed}"
-        new_expense_url = f"{url}{CAMPAIGN_IDS['expense']['new']}{status_completed}"
-        old_expense_data = fetch_api_data_completed(old_expense_url, headers)
-        new_expense_data = fetch_api_data_completed(new_expense_url, headers)
+    with measure_run("completed", METRICS_DIR) as run:
+        try:
+            GOOGLE_DRIVE_FOLDER_ID2 = config.GOOGLE_DRIVE_FOLDER_ID_COMPLETED
+            headers = {"accept": "application/json", "X-Authorization": X_Authorization}
         
-        old_mileage_url = f"{url}{CAMPAIGN_IDS['mileage']['old']}{status_completed}"
-        new_mileage_url = f"{url}{CAMPAIGN_IDS['mileage']['new']}{status_completed}"
-        old_mileage_data = fetch_api_data_completed(old_mileage_url, headers)
-        new_mileage_data = fetch_api_data_completed(new_mileage_url, headers)
-
-        old_conference_url = f"{url}{CAMPAIGN_IDS['conference']['old']}{status_completed}"
-        new_conference_url = f"{url}{CAMPAIGN_IDS['conference']['new']}{status_completed}"
-        old_conference_data = fetch_api_data_completed(old_conference_url, headers)
-        new_conference_data = fetch_api_data_completed(new_conference_url, headers)
+            # Fetch the old and new Expense, Mileage and Conference campaigns concurrently
+            with measure_requests() as request_stats:
+                campaign_data = fetch_all_completed(url, CAMPAIGN_IDS, status_completed, headers, refresh=categories, fresh=fresh)
+            request_stats.log()
+            log_shared_caches()
+
+            # Stale stored responses must not replace the uploaded workbooks
+            if run.degraded:
+                run.outcome = "degraded"
+                logger.warning(f"Completed run degraded, nothing uploaded: {'; '.join(run.degraded)}")
+                return run
+
+            old_expense_data, new_expense_data = campaign_data["expense"]["old"], campaign_data["expense"]["new"]
+            old_mileage_data, new_mileage_data = campaign_data["mileage"]["old"], campaign_data["mileage"]["new"]
+            old_conference_data, new_conference_data = campaign_data["conference"]["old"], campaign_data["conference"]["new"]
+
+            # Nothing to rebuild when no response, roster row or setting changed since the last upload
+            fingerprint = compute_run_fingerprint(campaign_data, extra=(GOOGLE_DRIVE_FOLDER_ID2, upload_excel_true))
+            if inputs_unchanged("completed", fingerprint):
+                run.outcome = "skipped"
+                return run
         
-        new_excel_name = f"Merged Data {get_current_timestamp()}.xlsx"
-        new_csv_name = f"AP-Reimbursement Upload {get_current_timestamp()}.xlsx"
-        result = process_and_upload_files(old_expense_data, new_expense_data, old_mileage_data, new_mileage_data, old_conference_data, new_conference_data, drive_service, GOOGLE_DRIVE_FOLDER_ID1, GOOGLE_DRIVE_FOLDER_ID2, FILE_NAME_TO_DOWNLOAD, X_Authorization, new_excel_name, new_csv_name, upload_excel_true)
-        logger.info("Uploaded Files: " + str(result))
-    except Exception as e:
-        logger.error("Error in run_script_completed: " + str(e))
+            new_excel_name = f"Merged Data {get_current_timestamp()}.xlsx"
+            new_csv_name = f"AP-Reimbursement Upload {get_current_timestamp()}.xlsx"
+            result = process_and_upload_files(old_expense_data, new_expense_data, old_mileage_data, new_mileage_data, old_conference_data, new_conference_data, drive_service, GOOGLE_DRIVE_FOLDER_ID1, GOOGLE_DRIVE_FOLDER_ID2, FILE_NAME_TO_DOWNLOAD, X_Authorization, new_excel_name, new_csv_name, upload_excel_true)
+            logger.info("Uploaded Files: " + str(result))
+            run.result = result
+            if result and run.degraded:
+                # Rebuilt by the next run instead of being skipped as up to date
+                run.outcome = "degraded"
+                logger.warning(f"Completed workbooks built from incomplete inputs, not recorded as up to date: {'; '.join(run.degraded)}")
+            elif result:
+                record_successful_run("completed", GOOGLE_DRIVE_FOLDER_ID2, fingerprint)
+            else:
+                run.outcome = "failed"
+        except Exception as e:
+            run.outcome = "failed"
+            logger.error("Error in run_script_completed: " + str(e))
+    return run
 
 # Runs the status archived api for Expense, Mileage and Conference
-# data processing and creates the Merged Sheet and AP-Reimbursement Upload CSV files
-def run_script_archived():
+# data processing and creates the Merged Sheet and AP-Reimbursement Upload CSV files.
+# categories, fresh and the return value as in run_script_completed.
+def run_script_archived(categories=None, fresh=False):
     """Runs every Sunday at midnight EST to process archived data."""
     logger.info("Executing weekly scheduled task for archived data...")
-    try:
-        start_date_str, end_date_str = get_date_range_filename()
-        GOOGLE_DRIVE_FOLDER_ID2 = config.GOOGLE_DRIVE_FOLDER_ID_ARCHIVED
-        headers = {"accept": "application/json", "X-Authorization": X_Authorization}
+    with measure_run("archived", METRICS_DIR) as run:
+        try:
+            start_date_str, end_date_str = get_date_range_filename()
+            GOOGLE_DRIVE_FOLDER_ID2 = config.GOOGLE_DRIVE_FOLDER_ID_ARCHIVED
+            headers = {"accept": "application/json", "X-Authorization": X_Authorization}
+
+            # Fetch the old and new Expense, Mileage and Conference campaigns concurrently
+            with measure_requests() as request_stats:
+                campaign_data = fetch_all_archived(url, CAMPAIGN_IDS, headers, refresh=categories, fresh=fresh)
+            request_stats.log()
+            log_shared_caches()
+
+            # Stale stored responses must not replace the uploaded workbooks
+            if run.degraded:
+                run.outcome = "degraded"
+                logger.warning(f"Archived run degraded, nothing uploaded: {'; '.join(run.degraded)}")
+                return run
 
-        old_expense_data = fetch_api_data_archived(url,f"{CAMPAIGN_IDS['expense']['old']}", headers)
-        new_expense_data = fetch_api_data_archived(url,f"{CAMPAIGN_IDS['expense']['new']}", headers)
+            old_expense_data, new_expense_data = campaign_data["expense"]["old"], campaign_data["expense"]["new"]
+            old_mileage_data, new_mileage_data = campaign_data["mileage"]["old"], campaign_data["mileage"]["new"]
+            old_conference_data, new_conference_data = campaign_data["conference"]["old"], campaign_data["conference"]["new"]
 
-        old_mileage_data = fetch_api_data_archived(url,f"{CAMPAIGN_IDS['mileage']['old']}", headers)
-        new_mileage_data= fetch_api_data_archived(url,f"{CAMPAIGN_IDS['mileage']['new']}", headers)
+            # The weekly file names carry the date range, so a new week always builds new files
+            fingerprint = compute_run_fingerprint(campaign_data, extra=(GOOGLE_DRIVE_FOLDER_ID2, upload_excel_true, start_date_str, end_date_str))
+            if inputs_unchanged("archived", fingerprint):
+                run.outcome = "skipped"
+                return run
 
-        old_conference_data = fetch_api_data_archived(url,f"{CAMPAIGN_IDS['conference']['old']}", headers)
-        new_conference_data = fetch_api_data_archived(url,f"{CAMPAIGN_IDS['conference']['new']}", headers)
+            new_excel_name = f"Merged Data {start_date_str}-{end_date_str}.xlsx"
+            new_csv_name = f"AP-Reimbursement Upload {start_date_str}-{end_date_str}.xlsx"
+            result = process_and_upload_files(old_expense_data, new_expense_data, old_mileage_data, new_mileage_data, old_conference_data, new_conference_data, drive_service, GOOGLE_DRIVE_FOLDER_ID1, GOOGLE_DRIVE_FOLDER_ID2, FILE_NAME_TO_DOWNLOAD, X_Authorization, new_excel_name, new_csv_name, upload_excel_true)
+            logger.info("Uploaded Files: " + str(result))
+            run.result = result
+            if result and run.degraded:
+                # Rebuilt by the next run instead of being skipped as up to date
+                run.outcome = "degraded"
+                logger.warning(f"Archived workbooks built from incomplete inputs, not recorded as up to date: {'; '.join(run.degraded)}")
+            elif result:
+                record_successful_run("archived", GOOGLE_DRIVE_FOLDER_ID2, fingerprint)
+            else:
+                run.outcome = "failed"
+        except Exception as e:
+            run.outcome = "failed"
+            logger.error("Error in run_script_archived: " + str(e))
+    return run
 
-        new_excel_name = f"Merged Data {start_date_str}-{end_date_str}.xlsx"
-        new_csv_name = f"AP-Reimbursement Upload {start_date_str}-{end_date_str}.xlsx"
-        result = process_and_upload_files(old_expense_data, new_expense_data, old_mileage_data, new_mileage_data, old_conference_data, new_conference_data, drive_service, GOOGLE_DRIVE_FOLDER_ID1, GOOGLE_DRIVE_FOLDER_ID2, FILE_NAME_TO_DOWNLOAD, X_Authorization, new_excel_name, new_csv_name, upload_excel_true)
-        logger.info("Uploaded Files: " + str(result))
-    except Exception as e:
-        logger.error("Error in run_script_archived: " + str(e))
+# Jobs by name, for the service and the replay harness
+JOBS = {"completed": run_script_completed, "archived": run_script_archived}
 
 # Schedular declared for completed status every 1 hour and archived status on every Sunday midnight.
 def start_scheduler():
@@ -0,0 +1,71 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Worker pool kept for the life of the process, so its workers start and import once
+pool = None
+pool_workers = 0
+pool_lock = threading.Lock()
+
+
+# Start method for the workers. Forking a process with live threads (scheduler jobs, logging
+# locks, SQLite and HTTP connection pools) can deadlock the child, so workers start from a
+# clean interpreter: forkserver where the platform has it, spawn otherwise.
+def worker_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def run_sequentially(func, jobs):
+    return [func(*args) for args in jobs]
+
+
+# The process pool with at least workers workers, created on first use
+def get_pool(workers):
+    global pool, pool_workers
+    with pool_lock:
+        if pool is not None and pool_workers < workers:
+            pool.shutdown(wait=False, cancel_futures=True)
+            pool = None
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=worker_context())
+            pool_workers = workers
+        return pool
+
+
+# Drop a pool whose workers died, so the next call starts a new one
+def discard_pool(broken):
+    global pool
+    with pool_lock:
+        if pool is broken:
+            pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+# Run func(*args) for every args in jobs in up to workers processes and return the results in
+# job order. func must be a module-level function and the arguments picklable; each job's
+# arguments are sent to its worker, so concurrent calls from different threads never see each
+# other's data. Workers are capped at the CPU count. Runs in this process when that leaves one
+# worker, and falls back to that when the pool cannot be used. The pool is shared by every call
+# in the process. Exceptions raised by func itself are not retried.
+def run_in_processes(func, jobs, workers):
+    jobs = list(jobs)
+    workers = min(workers or 1, len(jobs), os.cpu_count() or 1)
+    if workers <= 1:
+        return run_sequentially(func, jobs)
+
+    executor = None
+    try:
+        executor = get_pool(workers)
+        return list(executor.map(func, *zip(*jobs)))
+    except (BrokenProcessPool, pickle.PicklingError, OSError) as e:
+        if isinstance(e, BrokenProcessPool) and executor is not None:
+            discard_pool(executor)
+        logger.warning(f"Process pool unavailable, running {len(jobs)} jobs sequentially: {e}")
+        return run_sequentially(func, jobs)
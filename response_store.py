@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import timezone
+from watermarks import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Top-level response keys kept in the store next to the target fields
+RESPONSE_KEYS = ("id", "status", "completedAt", "updatedAt")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    response_id TEXT PRIMARY KEY,
+    campaign_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    completed_at TEXT,
+    updated_at TEXT,
+    position INTEGER NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_campaign_status_completed ON responses (campaign_id, status, completed_at);
+CREATE INDEX IF NOT EXISTS idx_responses_status ON responses (status);
+CREATE INDEX IF NOT EXISTS idx_responses_completed ON responses (completed_at);
+CREATE TABLE IF NOT EXISTS fetch_state (
+    campaign_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    watermark TEXT,
+    last_full_sync TEXT,
+    PRIMARY KEY (campaign_id, status)
+);
+CREATE TABLE IF NOT EXISTS run_state (
+    job TEXT PRIMARY KEY,
+    folder_id TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    completed_at TEXT NOT NULL
+);
+"""
+
+
+# Timestamp in UTC with a fixed width so that string comparison in SQL matches time order
+def normalize_timestamp(value):
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        return None
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+# Local embedded store of Informed K12 responses keyed by response id. Only the target
+# fields of each campaign are kept, so the jobs can rebuild their inputs with one indexed
+# query and fall back to it when the API is unavailable. The updated_at column holds each
+# response's watermark_field, the one incremental fetches and webhook deliveries are ordered by.
+class ResponseStore:
+    def __init__(self, path, target_fields_by_campaign, watermark_field="updatedAt"):
+        self.path = path
+        self.target_fields_by_campaign = target_fields_by_campaign
+        self.watermark_field = watermark_field
+        self.write_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    # A new connection per call keeps the store safe to use from the fetch threads.
+    # Commits on success, rolls back on error and always closes.
+    @contextmanager
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    # Drop everything but the target fields and the top-level keys the pipeline uses
+    def prune(self, campaign_id, response):
+        target_fields = self.target_fields_by_campaign.get(campaign_id)
+        pruned = {key: response[key] for key in (*RESPONSE_KEYS, self.watermark_field) if key in response}
+        fields = response.get("fields", [])
+        if target_fields is not None and isinstance(fields, list):
+            fields = [field for field in fields if isinstance(field, dict) and field.get("number") in target_fields]
+        pruned["fields"] = fields
+        return pruned
+
+    # Insert or update responses by id. With replace=True the given responses become the
+    # complete set for the campaign and status, in the given order.
+    def upsert_responses(self, campaign_id, status, responses, replace=False):
+        with self.write_lock, self.connect() as connection:
+            if replace:
+                connection.execute("DELETE FROM responses WHERE campaign_id = ? AND status = ?", (campaign_id, status))
+                next_position = 0
+            else:
+                next_position = connection.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM responses WHERE campaign_id = ? AND status = ?",
+                    (campaign_id, status)
+                ).fetchone()[0]
+
+            rows = []
+            for i, response in enumerate(responses):
+                rows.append((
+                    str(response["id"]), campaign_id, status,
+                    normalize_timestamp(response.get("completedAt")),
+                    normalize_timestamp(response.get(self.watermark_field)),
+                    next_position + i,
+                    json.dumps(self.prune(campaign_id, response)),
+                ))
+
+            # Existing responses keep their position unless the whole set is replaced
+            connection.executemany(
+                """
+                INSERT INTO responses (response_id, campaign_id, status, completed_at, updated_at, position, payload)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (response_id) DO UPDATE SET
+                    campaign_id = excluded.campaign_id,
+                    status = excluded.status,
+                    completed_at = excluded.completed_at,
+                    updated_at = excluded.updated_at,
+                    position = CASE WHEN responses.campaign_id = excluded.campaign_id AND responses.status = excluded.status
+                                    THEN responses.position ELSE excluded.position END,
+                    payload = excluded.payload
+                """,
+                rows
+            )
+
+    # Responses for a campaign and status in fetch order, optionally within a completed date window
+    def load_responses(self, campaign_id, status, completed_start=None, completed_end=None):
+        query = "SELECT payload FROM responses WHERE campaign_id = ? AND status = ?"
+        params = [campaign_id, status]
+        if completed_start is not None:
+            query += " AND completed_at >= ?"
+            params.append(normalize_timestamp(completed_start))
+        if completed_end is not None:
+            query += " AND completed_at <= ?"
+            params.append(normalize_timestamp(completed_end))
+        query += " ORDER BY position"
+
+        with self.connect() as connection:
+            return [json.loads(payload) for (payload,) in connection.execute(query, params)]
+
+    # Campaign, status and normalized update time of a stored response, or None
+    def get_response_version(self, response_id):
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT campaign_id, status, updated_at FROM responses WHERE response_id = ?",
+                (str(response_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"campaign_id": row[0], "status": row[1], "updated_at": row[2]}
+
+    # Saved high-water mark and last full download for a campaign and status, or None
+    def get_fetch_state(self, campaign_id, status):
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT watermark, last_full_sync FROM fetch_state WHERE campaign_id = ? AND status = ?",
+                (campaign_id, status)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"watermark": row[0], "last_full_sync": row[1]}
+
+    def save_fetch_state(self, campaign_id, status, watermark, last_full_sync):
+        with self.write_lock, self.connect() as connection:
+            connection.execute(
+                """
+                INSERT INTO fetch_state (campaign_id, status, watermark, last_full_sync) VALUES (?, ?, ?, ?)
+                ON CONFLICT (campaign_id, status) DO UPDATE SET
+                    watermark = excluded.watermark,
+                    last_full_sync = excluded.last_full_sync
+                """,
+                (campaign_id, status, watermark, last_full_sync)
+            )
+
+    # Input fingerprint and finish time of a job's last successful run, or None
+    def get_run_state(self, job):
+        with self.connect() as connection:
+            row = connection.execute("SELECT fingerprint, completed_at FROM run_state WHERE job = ?", (job,)).fetchone()
+        if row is None:
+            return None
+        return {"fingerprint": row[0], "completed_at": row[1]}
+
+    # A run trashes everything else in its Drive folder, so the other jobs that upload there
+    # lose their saved state and build their files again on their next run
+    def save_run_state(self, job, folder_id, fingerprint, completed_at):
+        with self.write_lock, self.connect() as connection:
+            connection.execute("DELETE FROM run_state WHERE folder_id = ? AND job != ?", (folder_id, job))
+            connection.execute(
+                """
+                INSERT INTO run_state (job, folder_id, fingerprint, completed_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (job) DO UPDATE SET
+                    folder_id = excluded.folder_id,
+                    fingerprint = excluded.fingerprint,
+                    completed_at = excluded.completed_at
+                """,
+                (job, folder_id, fingerprint, completed_at)
+            )
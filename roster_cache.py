@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import tempfile
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ROSTER_FILE = "roster.pkl"
+METADATA_FILE = "roster.json"
+
+# Drive metadata fields that identify a version of the roster file
+VERSION_KEYS = ("id", "modifiedTime", "md5Checksum")
+
+
+# Metadata to compare, md5Checksum is missing for native Google Sheets files
+def roster_version(metadata):
+    return {key: metadata.get(key) for key in VERSION_KEYS}
+
+
+# Return the cached roster DataFrame when it was built from this version of the Drive file,
+# otherwise None. With metadata=None any cached roster is returned (used when Drive is down).
+def load_cached_roster(cache_dir, metadata=None):
+    try:
+        with open(os.path.join(cache_dir, METADATA_FILE), "r", encoding="utf-8") as f:
+            cached_version = json.load(f)
+        if metadata is not None and cached_version != roster_version(metadata):
+            return None
+        return pd.read_pickle(os.path.join(cache_dir, ROSTER_FILE))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable roster cache in {cache_dir}: {e}")
+        return None
+
+
+# Write a file with write(binary_file) into a temporary file of its own next to path, then move
+# it into place, so writers that overlap never write into each other's temporary file
+def replace_file(path, write):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+# Save the parsed roster with the version it was built from. The metadata file is written
+# last so a partially written cache is never treated as valid.
+def save_cached_roster(cache_dir, metadata, df_escape):
+    os.makedirs(cache_dir, exist_ok=True)
+    metadata_path = os.path.join(cache_dir, METADATA_FILE)
+    try:
+        os.remove(metadata_path)
+    except FileNotFoundError:
+        pass
+
+    replace_file(os.path.join(cache_dir, ROSTER_FILE), df_escape.to_pickle)
+    replace_file(metadata_path, lambda f: f.write(json.dumps(roster_version(metadata)).encode("utf-8")))
@@ -0,0 +1,59 @@
+import hashlib
+import json
+from collections import namedtuple
+
+# digest: sha256 hex digest of everything the run's workbooks are built from
+# responses: number of responses covered
+# roster: version of the Escape roster file ({id, modifiedTime, md5Checksum})
+RunFingerprint = namedtuple("RunFingerprint", ["digest", "responses", "roster"])
+
+
+# A value as plain JSON data with a stable order: sets are sorted and unknown objects use repr
+def canonical(value):
+    if isinstance(value, dict):
+        return {str(key): canonical(item) for key, item in value.items()}
+    if isinstance(value, (set, frozenset)):
+        return sorted((canonical(item) for item in value), key=repr)
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return repr(value)
+
+
+# Public settings of a config module, e.g. the target fields and column mappings
+def config_settings(config_module):
+    return {
+        name: value for name, value in vars(config_module).items()
+        if not name.startswith("_") and not callable(value) and not hasattr(value, "__file__")
+    }
+
+
+# Responses of one campaign as a list, whether the API returned a list or {"data": [...]}
+def response_list(data):
+    if isinstance(data, dict):
+        data = data.get("data", [])
+    return data if isinstance(data, list) else []
+
+
+# Fingerprint of a run's inputs. A response counts by its id and watermark_field value (its last
+# update); one without them counts by its full content. campaign_data is the
+# {category: {"old": data, "new": data}} fetch result and extra anything else the output
+# depends on, e.g. the destination folder.
+def compute_fingerprint(campaign_data, roster_version, settings, watermark_field, extra=()):
+    digest = hashlib.sha256()
+    count = 0
+    for category in sorted(campaign_data):
+        for age in sorted(campaign_data[category]):
+            digest.update(f"\0{category}/{age}\0".encode())
+            for response in response_list(campaign_data[category][age]):
+                if isinstance(response, dict) and response.get("id") is not None and response.get(watermark_field):
+                    key = [response["id"], response[watermark_field]]
+                else:
+                    key = canonical(response)
+                digest.update(json.dumps(key, sort_keys=True).encode())
+                digest.update(b"\n")
+                count += 1
+
+    digest.update(json.dumps(canonical({"roster": roster_version, "settings": settings, "extra": extra}), sort_keys=True).encode())
+    return RunFingerprint(digest.hexdigest(), count, roster_version)
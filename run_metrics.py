@@ -0,0 +1,210 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+RUN_REPORT_FILE = "runs.jsonl"
+METRIC_PREFIX = "intellication"
+# Fields of a stage record that are measurements; the others (besides stage) are labels
+MEASUREMENTS = ("seconds", "rows_in", "rows_out", "bytes", "peak_rss_bytes")
+
+# Run being measured in this thread, set by measure_run
+current_run = contextvars.ContextVar("current_run", default=None)
+
+
+# Peak resident memory of this process so far in bytes, None where the platform does not report it
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Stage records of one job run. Each record has the stage name, its labels (e.g. form), wall
+# seconds, rows_in, rows_out, bytes transferred and the process peak memory when it ended.
+# result holds what the run produced, e.g. the uploaded file links, and degraded the inputs it
+# had to take from stale data or do without.
+class RunMetrics:
+    def __init__(self, job):
+        self.job = job
+        self.started_at = time.time()
+        self.finished_at = None
+        self.outcome = None
+        self.result = None
+        self.degraded = []
+        self.stages = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **labels):
+        record = {"stage": name, **labels, "rows_in": rows_in, "rows_out": None, "bytes": None}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 6)
+            record["peak_rss_bytes"] = peak_rss_bytes()
+            self.add_stages([record])
+
+    # Records measured elsewhere, e.g. returned by a worker process
+    def add_stages(self, records):
+        with self.lock:
+            self.stages.extend(records)
+
+    # Record an input replaced with stale data or left empty, e.g. a campaign read from the
+    # response store because the API failed, or a roster that could not be loaded
+    def mark_degraded(self, reason):
+        with self.lock:
+            self.degraded.append(reason)
+
+    def finish(self, outcome=None):
+        self.finished_at = time.time()
+        if outcome is not None or self.outcome is None:
+            self.outcome = outcome or "succeeded"
+
+    def report(self):
+        with self.lock:
+            stages = [dict(record) for record in self.stages]
+            degraded = list(self.degraded)
+        finished_at = self.finished_at or time.time()
+        return {
+            "job": self.job,
+            "started_at": self.started_at,
+            "finished_at": finished_at,
+            "seconds": round(finished_at - self.started_at, 6),
+            "outcome": self.outcome,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "result": self.result,
+            "degraded": degraded,
+            "stages": stages,
+        }
+
+
+# Measure a job run: stages started in this thread are recorded on the returned RunMetrics.
+# With metrics_dir the run report is written there when the run ends.
+@contextmanager
+def measure_run(job, metrics_dir=None):
+    run = RunMetrics(job)
+    token = current_run.set(run)
+    try:
+        yield run
+    except BaseException:
+        run.outcome = "failed"
+        raise
+    finally:
+        current_run.reset(token)
+        run.finish()
+        if metrics_dir is not None:
+            write_run_report(run, metrics_dir)
+
+
+# Measure a stage of the current run, or of run when given (for worker threads, which do not
+# see the current run). When nothing is being measured the record is filled in and dropped.
+@contextmanager
+def measure_stage(name, rows_in=None, run=None, **labels):
+    run = run or current_run.get()
+    if run is None:
+        yield {}
+        return
+    with run.stage(name, rows_in, **labels) as record:
+        yield record
+
+
+# Mark the current run degraded, when one is being measured
+def mark_run_degraded(reason):
+    run = current_run.get()
+    if run is not None:
+        run.mark_degraded(reason)
+
+
+# Prometheus label set, e.g. {job="completed",stage="fetch"}
+def prometheus_labels(labels):
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+# Report as Prometheus text exposition. Stages that ran more than once with the same labels
+# (e.g. highlighting for each workbook) are summed, peak memory keeps the highest value.
+def prometheus_text(report):
+    job = report["job"]
+    totals = {}
+    for record in report["stages"]:
+        labels = {"job": job, **{key: value for key, value in record.items() if key not in MEASUREMENTS}}
+        key = tuple(labels.items())
+        total = totals.setdefault(key, {"seconds": 0.0, "rows_in": None, "rows_out": None, "bytes": None, "peak_rss_bytes": None, "count": 0})
+        total["count"] += 1
+        total["seconds"] += record["seconds"]
+        for field in ("rows_in", "rows_out", "bytes"):
+            if record.get(field) is not None:
+                total[field] = (total[field] or 0) + record[field]
+        if record.get("peak_rss_bytes") is not None:
+            total["peak_rss_bytes"] = max(total["peak_rss_bytes"] or 0, record["peak_rss_bytes"])
+
+    metrics = [
+        ("stage_duration_seconds", "gauge", "Wall time of the stage in the last run", "seconds"),
+        ("stage_rows_in", "gauge", "Rows the stage received in the last run", "rows_in"),
+        ("stage_rows_out", "gauge", "Rows the stage produced in the last run", "rows_out"),
+        ("stage_bytes", "gauge", "Bytes the stage downloaded or uploaded in the last run", "bytes"),
+        ("stage_peak_rss_bytes", "gauge", "Peak resident memory of the process at the end of the stage", "peak_rss_bytes"),
+        ("stage_calls", "gauge", "Times the stage ran in the last run", "count"),
+    ]
+    lines = []
+    for name, kind, help_text, field in metrics:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        for key, total in totals.items():
+            if total[field] is not None:
+                lines.append(f"{METRIC_PREFIX}_{name}{prometheus_labels(dict(key))} {total[field]}")
+
+    job_labels = prometheus_labels({"job": job})
+    run_metrics = [
+        ("run_duration_seconds", "Wall time of the last run", report["seconds"]),
+        ("run_finished_timestamp_seconds", "Unix time the last run finished", report["finished_at"]),
+        ("run_success", "1 when the last run succeeded or was skipped, 0 when it failed or was degraded", int(report["outcome"] in ("succeeded", "skipped"))),
+        ("run_skipped", "1 when the last run stopped early because its inputs were unchanged", int(report["outcome"] == "skipped")),
+        ("run_degraded", "1 when the last run had incomplete inputs: nothing uploaded, or its files are rebuilt next run", int(report["outcome"] == "degraded")),
+    ]
+    if report["peak_rss_bytes"] is not None:
+        run_metrics.append(("run_peak_rss_bytes", "Peak resident memory of the process after the last run", report["peak_rss_bytes"]))
+    for name, help_text, value in run_metrics:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        lines.append(f"{METRIC_PREFIX}_{name}{job_labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Append the run to metrics_dir/runs.jsonl and replace metrics_dir/<prefix>_<job>.prom, the
+# file a node_exporter textfile collector scrapes. Failures are logged, never raised.
+def write_run_report(run, metrics_dir):
+    try:
+        report = run.report()
+        os.makedirs(metrics_dir, exist_ok=True)
+        with open(os.path.join(metrics_dir, RUN_REPORT_FILE), "a", encoding="utf-8", newline="\n") as f:
+            f.write(json.dumps(report) + "\n")
+
+        prom_path = os.path.join(metrics_dir, f"{METRIC_PREFIX}_{run.job}.prom")
+        with open(f"{prom_path}.tmp", "w", encoding="utf-8", newline="\n") as f:
+            f.write(prometheus_text(report))
+        os.replace(f"{prom_path}.tmp", prom_path)
+
+        slowest = sorted(report["stages"], key=lambda record: record["seconds"], reverse=True)[:3]
+        logger.info(
+            f"Run report {run.job}: {report['outcome']} in {report['seconds']:.2f}s, slowest stages "
+            + ", ".join(f"{record['stage']} {record['seconds']:.2f}s" for record in slowest)
+        )
+    except Exception as e:
+        logger.warning(f"Unable to write the {run.job} run report: {e}")
@@ -0,0 +1,15 @@
+import numpy as np
+import pandas as pd
+
+
+# Apply func once per distinct value of a Series and broadcast the results back to its rows.
+# Columns like dates and invoice labels repeat a small set of values across many responses.
+# NaN/None rows get na_value without calling func. Values that compare equal (1 and 1.0)
+# share one result.
+def map_unique_values(series, func, na_value=None):
+    codes, uniques = pd.factorize(series)
+    results = np.empty(len(uniques) + 1, dtype=object)
+    for i, value in enumerate(uniques):
+        results[i] = func(value)
+    results[-1] = na_value
+    return pd.Series(results[codes], index=series.index, dtype=object)
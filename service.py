@@ -0,0 +1,292 @@
+import hmac
+import ipaddress
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Literal, Optional
+import uvicorn
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from pydantic import BaseModel
+import config
+import logic
+import main as jobs
+from webhooks import BuildDebouncer, IgnoredEvent, WebhookError, parse_event, store_response, verify_signature
+
+logger = logging.getLogger(__name__)
+
+CAMPAIGN_IDS = config.CAMPAIGN_IDS
+SERVICE_HOST = config.SERVICE_HOST
+SERVICE_PORT = config.SERVICE_PORT
+SERVICE_API_TOKEN = config.SERVICE_API_TOKEN
+SERVICE_RESULT_TTL_SECONDS = config.SERVICE_RESULT_TTL_SECONDS
+SERVICE_RUN_HISTORY = config.SERVICE_RUN_HISTORY
+WEBHOOK_SECRET = config.WEBHOOK_SECRET
+WEBHOOK_SIGNATURE_HEADER = config.WEBHOOK_SIGNATURE_HEADER
+WEBHOOK_DEBOUNCE_SECONDS = config.WEBHOOK_DEBOUNCE_SECONDS
+WEBHOOK_MAX_DELAY_SECONDS = config.WEBHOOK_MAX_DELAY_SECONDS
+
+# Category of every old and new campaign id, e.g. {173260: "expense"}
+CAMPAIGN_CATEGORIES = {campaign_id: category for category, ids in CAMPAIGN_IDS.items() for campaign_id in ids.values()}
+# Job that builds the workbooks of each response status group
+STATUS_JOBS = {config.STATUS_PENDING: "completed", config.STATUS_ARCHIVED: "archived"}
+
+
+# A run request: the job and the campaign categories to refresh from the API (all when omitted).
+# force starts a run even when a recent result covers the request.
+class RunRequest(BaseModel):
+    job: Literal["completed", "archived"]
+    campaigns: Optional[List[str]] = None
+    force: bool = False
+
+
+# Job runs started on request, at most one at a time per job. A run is for some campaigns and
+# refreshes some of them from the API (the rest come from the response store). A request covered
+# by a result younger than result_ttl seconds gets that result. A request arriving while its job
+# runs joins that run when the run refreshes its campaigns; otherwise it joins the job's
+# follow-up run, which collects the campaigns of every such request and starts when the current
+# run ends.
+class RunCoordinator:
+    def __init__(self, job_functions, result_ttl, history):
+        self.job_functions = job_functions
+        self.result_ttl = result_ttl
+        self.history = history
+        self.lock = threading.Lock()
+        self.runs = OrderedDict()
+        self.active = {}
+        self.pending = {}
+        self.latest = {}
+        self.latest_result = {}
+        self.executor = ThreadPoolExecutor(max_workers=len(job_functions), thread_name_prefix="job")
+
+    # Run record as returned by the API
+    def new_run(self, job, campaigns, refresh, force):
+        run = {
+            "id": uuid.uuid4().hex,
+            "job": job,
+            "campaigns": sorted(campaigns),
+            "refresh": sorted(refresh),
+            "force": force,
+            "status": "queued",
+            "requests": 1,
+            "requested_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "report": None,
+        }
+        self.runs[run["id"]] = run
+        finished = [run_id for run_id, old in self.runs.items() if old["finished_at"] is not None]
+        for run_id in finished[:max(0, len(self.runs) - self.history)]:
+            del self.runs[run_id]
+        return run
+
+    # Handle a run request for campaigns, refreshing refresh of them from the API (all when
+    # None). Returns a copy of the run that answers it and how: "cached" (a recent result),
+    # "merged" (the running run), "queued" (the follow-up run) or "started". force skips the
+    # cached result, the running run and the API pages other runs fetched moments ago, for data
+    # that arrived after they fetched theirs.
+    def trigger(self, job, campaigns, force=False, refresh=None):
+        campaigns = set(campaigns)
+        refresh = campaigns if refresh is None else set(refresh)
+        with self.lock:
+            latest = self.latest.get(job)
+            if (not force and latest is not None and latest["status"] in ("succeeded", "skipped")
+                    and time.time() - latest["finished_at"] < self.result_ttl and refresh <= set(latest["refresh"])):
+                return dict(latest), "cached"
+
+            active = self.active.get(job)
+            if active is None:
+                run = self.new_run(job, campaigns, refresh, force)
+                self.active[job] = run
+                self.executor.submit(self.execute, run)
+                return dict(run), "started"
+
+            if not force and campaigns <= set(active["campaigns"]) and refresh <= set(active["refresh"]):
+                active["requests"] += 1
+                return dict(active), "merged"
+
+            follow_up = self.pending.get(job)
+            if follow_up is None:
+                follow_up = self.pending[job] = self.new_run(job, campaigns, refresh, force)
+            else:
+                follow_up["force"] = follow_up["force"] or force
+                follow_up["campaigns"] = sorted(campaigns | set(follow_up["campaigns"]))
+                follow_up["refresh"] = sorted(refresh | set(follow_up["refresh"]))
+                follow_up["requests"] += 1
+            return dict(follow_up), "queued"
+
+    # Run the job in a worker thread, then start the job's follow-up run if one was requested
+    def execute(self, run):
+        with self.lock:
+            run["status"] = "running"
+            run["started_at"] = time.time()
+        # Refreshing every campaign is a regular run; fewer refresh only those
+        categories = None if set(run["refresh"]) >= set(CAMPAIGN_IDS) else run["refresh"]
+
+        status, result, report = "failed", None, None
+        try:
+            metrics = self.job_functions[run["job"]](categories, fresh=run["force"])
+            status, result, report = metrics.outcome, metrics.result, metrics.report()
+        except Exception as e:
+            logger.error(f"Error in the {run['job']} run {run['id']}: {e}")
+
+        with self.lock:
+            run.update(status=status, finished_at=time.time(), result=result, report=report)
+            self.latest[run["job"]] = run
+            if result:
+                self.latest_result[run["job"]] = run
+
+            follow_up = self.pending.pop(run["job"], None)
+            if follow_up is None:
+                del self.active[run["job"]]
+            else:
+                self.active[run["job"]] = follow_up
+                self.executor.submit(self.execute, follow_up)
+        logger.info(f"Run {run['id']} of {run['job']} {status} for {', '.join(run['campaigns'])} ({run['requests']} requests)")
+
+    def get(self, run_id):
+        with self.lock:
+            run = self.runs.get(run_id)
+            return dict(run) if run is not None else None
+
+    # Most recent runs first, without their reports
+    def recent(self, job=None):
+        with self.lock:
+            return [
+                {key: value for key, value in run.items() if key != "report"}
+                for run in reversed(self.runs.values()) if job is None or run["job"] == job
+            ]
+
+    # Latest workbook links of a job and the report of its latest finished run
+    def results(self, job):
+        with self.lock:
+            latest = self.latest.get(job)
+            latest_result = self.latest_result.get(job)
+            return {
+                "job": job,
+                "files": latest_result["result"] if latest_result else None,
+                "files_run_id": latest_result["id"] if latest_result else None,
+                "files_finished_at": latest_result["finished_at"] if latest_result else None,
+                "run": dict(latest) if latest else None,
+            }
+
+
+coordinator = RunCoordinator(jobs.JOBS, SERVICE_RESULT_TTL_SECONDS, SERVICE_RUN_HISTORY)
+# Webhook builds read the new responses from the store, so they refresh nothing from the API
+debouncer = BuildDebouncer(
+    lambda job, categories: coordinator.trigger(job, categories, force=True, refresh=()),
+    WEBHOOK_DEBOUNCE_SECONDS, WEBHOOK_MAX_DELAY_SECONDS
+)
+app = FastAPI(title="Intellication", description="Builds and uploads the Informed K12 reimbursement workbooks on request.")
+
+
+# Whether host only accepts connections from this machine
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# Bearer token check of the run and result endpoints, open when no token is configured
+def require_token(request: Request):
+    if not SERVICE_API_TOKEN:
+        return
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), SERVICE_API_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Missing or invalid API token", headers={"WWW-Authenticate": "Bearer"})
+
+
+def check_job(job):
+    if job not in jobs.JOBS:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job!r}, expected one of {sorted(jobs.JOBS)}")
+
+
+# Trigger a run. Answers at once with the run to poll; 200 when a cached result answers it.
+@app.post("/runs", status_code=202, dependencies=[Depends(require_token)])
+def trigger_run(request: RunRequest, response: Response):
+    unknown = set(request.campaigns or ()) - set(CAMPAIGN_IDS)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown campaigns {sorted(unknown)}, expected some of {sorted(CAMPAIGN_IDS)}")
+    run, how = coordinator.trigger(request.job, request.campaigns or CAMPAIGN_IDS, request.force)
+    if how == "cached":
+        response.status_code = 200
+    return {"request": how, "run": run}
+
+
+@app.get("/runs", dependencies=[Depends(require_token)])
+def list_runs(job: Optional[str] = None):
+    if job is not None:
+        check_job(job)
+    return coordinator.recent(job)
+
+
+@app.get("/runs/{run_id}", dependencies=[Depends(require_token)])
+def get_run(run_id: str):
+    run = coordinator.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"Unknown run {run_id}")
+    return run
+
+
+@app.get("/results/{job}", dependencies=[Depends(require_token)])
+def get_results(job: str):
+    check_job(job)
+    return coordinator.results(job)
+
+
+# Raw request body, for the signature check. A dependency so that the webhook endpoint stays a
+# plain def and its SQLite writes run in the threadpool instead of on the event loop.
+async def raw_body(request: Request):
+    return await request.body()
+
+
+# Informed K12 response event: check its signature, store the response and schedule a build of
+# its job. Without a configured secret every event is refused. A repeated or out-of-date
+# delivery, one for a campaign we do not build, or one that puts its response in no status group
+# (a draft, a deletion...) is acknowledged without a build so Informed K12 does not retry it.
+@app.post("/webhooks/informed", status_code=202)
+def receive_webhook(request: Request, response: Response, body: bytes = Depends(raw_body)):
+    if not WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Webhooks are disabled: WEBHOOK_SECRET is not set")
+    if not verify_signature(WEBHOOK_SECRET, body, request.headers.get(WEBHOOK_SIGNATURE_HEADER)):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        campaign_id, status, informed_response = parse_event(
+            json.loads(body), CAMPAIGN_CATEGORIES, logic.WATERMARK_FIELD, config.STATUS_PENDING, config.STATUS_ARCHIVED
+        )
+    except IgnoredEvent as e:
+        response.status_code = 200
+        return {"stored": False, "reason": str(e)}
+    except (ValueError, WebhookError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid webhook event: {e}")
+
+    response.status_code = 200
+    changed = store_response(logic.response_store, campaign_id, status, informed_response, logic.WATERMARK_FIELD)
+    if not changed:
+        return {"stored": False, "reason": "already stored"}
+
+    builds = {STATUS_JOBS[group]: round(debouncer.touch(STATUS_JOBS[group], [CAMPAIGN_CATEGORIES[campaign_id]]), 1) for group in changed}
+    response.status_code = 202
+    return {"stored": True, "builds_in_seconds": builds}
+
+
+@app.get("/webhooks/pending", dependencies=[Depends(require_token)])
+def pending_builds():
+    return debouncer.waiting()
+
+
+# Service mode: the jobs run on request, and on webhook events, instead of on the main.py
+# schedule
+if __name__ == "__main__":
+    if not SERVICE_API_TOKEN and not is_loopback(SERVICE_HOST):
+        raise SystemExit(f"Refusing to listen on {SERVICE_HOST} without SERVICE_API_TOKEN; set a token or use 127.0.0.1")
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is not set, /webhooks/informed refuses every event")
+    uvicorn.run(app, host=SERVICE_HOST, port=SERVICE_PORT)
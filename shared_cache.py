@@ -0,0 +1,70 @@
+import logging
+import threading
+from concurrent.futures import Future
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+# Cache shared by the job runs of this process, limited by entry age (ttl seconds) and total
+# size (maxsize, in getsizeof units; entries count 1 by default). get_or_load runs the loader
+# once per key: a run that needs a value another run is loading waits for it. Values are shared
+# between runs and must not be modified. Failed loads are not cached; waiters get the error.
+# With fresh=True a cached value is ignored and loaded again, but a load already in progress is
+# still joined.
+class SharedCache:
+    def __init__(self, name, maxsize, ttl, getsizeof=None):
+        self.name = name
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl, getsizeof=getsizeof)
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.stats = {"hits": 0, "waits": 0, "loads": 0}
+
+    def get_or_load(self, key, loader, fresh=False):
+        with self.lock:
+            if not fresh:
+                try:
+                    value = self.cache[key]
+                    self.stats["hits"] += 1
+                    return value
+                except KeyError:
+                    pass
+            future = self.loading.get(key)
+            owner = future is None
+            if owner:
+                future = self.loading[key] = Future()
+                self.stats["loads"] += 1
+            else:
+                self.stats["waits"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            try:
+                self.cache[key] = value
+            except ValueError:
+                logger.debug(f"{self.name} cache: value for {key!r} is larger than the whole cache")
+            del self.loading[key]
+        future.set_result(value)
+        return value
+
+    # Forget a value, e.g. one that turned out to be unusable
+    def discard(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "entries": len(self.cache), "size": self.cache.currsize}
@@ -0,0 +1,53 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Parse an Informed K12 ISO 8601 timestamp, None when missing or invalid
+def parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+# Newest watermark_field value across the responses, kept as the API's own string
+def compute_watermark(responses, watermark_field, current=None):
+    newest = current
+    newest_parsed = parse_timestamp(current)
+    for response in responses:
+        value = response.get(watermark_field) if isinstance(response, dict) else None
+        parsed = parse_timestamp(value)
+        if parsed is not None and (newest_parsed is None or parsed > newest_parsed):
+            newest, newest_parsed = value, parsed
+    return newest
+
+
+# Value to send as the lower bound of the next request, moved back by the overlap to
+# tolerate clock skew. Responses fetched twice are merged by id.
+def watermark_start(watermark, overlap_seconds):
+    parsed = parse_timestamp(watermark)
+    if parsed is None:
+        return None
+    return (parsed - timedelta(seconds=overlap_seconds)).isoformat(timespec="seconds")
+
+
+# True when every response carries an id and a watermark value, so they can be merged
+def supports_incremental(responses, watermark_field):
+    return all(isinstance(r, dict) and r.get("id") is not None and r.get(watermark_field) for r in responses)
+
+
+# Whether the saved state is too old to be trusted and a full download is due.
+# Pending responses that are deleted or withdrawn are only dropped by a full download.
+def needs_full_sync(state, full_sync_hours):
+    if not state or state.get("watermark") is None:
+        return True
+    last_full_sync = parse_timestamp(state.get("last_full_sync"))
+    if last_full_sync is None:
+        return True
+    return datetime.now(timezone.utc) - last_full_sync >= timedelta(hours=full_sync_hours)
@@ -0,0 +1,139 @@
+import hashlib
+import hmac
+import logging
+import threading
+import time
+from response_store import normalize_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Event types, and response statuses, of the pending group the completed job reads and of the
+# archived group. Any other event (a draft, a deletion, a withdrawal...) is ignored.
+PENDING_EVENTS = ("response.submitted", "response.completed")
+ARCHIVED_EVENTS = ("response.archived",)
+PENDING_STATUSES = ("pending",)
+ARCHIVED_STATUSES = ("archived",)
+
+
+# Raised for an event that cannot be stored: a malformed body or missing fields
+class WebhookError(Exception):
+    pass
+
+
+# Raised for a valid event that is not stored: one for a campaign we do not build, or of a type
+# that does not put its response in a status group
+class IgnoredEvent(Exception):
+    pass
+
+
+# Check the HMAC-SHA256 hex digest of the raw body, with or without a "sha256=" prefix
+def verify_signature(secret, body, signature):
+    if not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.removeprefix("sha256="))
+
+
+# Signature header value for a body, as the simulator sends it
+def sign(secret, body):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+# The response, its campaign id and its status group from a response event. The response is
+# event["response"] or event["data"] (or the event itself); the campaign id is the event's
+# campaignId or the response's campaignId / campaign.id. The group comes from the event type
+# (event["event"] or event["type"]) and the response status, which must agree.
+def parse_event(event, campaign_ids, watermark_field, status_pending, status_archived):
+    if not isinstance(event, dict):
+        raise WebhookError("Event is not a JSON object")
+    response = event.get("response") or event.get("data") or event
+    if not isinstance(response, dict):
+        raise WebhookError("Event has no response object")
+
+    campaign = response.get("campaign") if isinstance(response.get("campaign"), dict) else {}
+    campaign_id = event.get("campaignId") or response.get("campaignId") or campaign.get("id")
+    try:
+        campaign_id = int(campaign_id)
+    except (TypeError, ValueError):
+        raise WebhookError(f"Event has no campaign id: {campaign_id!r}")
+    if campaign_id not in campaign_ids:
+        raise IgnoredEvent(f"campaign {campaign_id} is not built")
+
+    if response.get("id") is None or not response.get(watermark_field):
+        raise WebhookError(f"Response is missing 'id' or '{watermark_field}'")
+    if not isinstance(response.get("fields", []), list):
+        raise WebhookError("Response 'fields' is not a list")
+
+    event_type = str(event.get("event") or event.get("type") or "").lower()
+    response_status = str(response.get("status") or "").lower()
+    if event_type in PENDING_EVENTS and response_status in ("", *PENDING_STATUSES):
+        status = status_pending
+    elif event_type in ARCHIVED_EVENTS and response_status in ("", *ARCHIVED_STATUSES):
+        status = status_archived
+    elif not event_type and response_status in PENDING_STATUSES:
+        status = status_pending
+    elif not event_type and response_status in ARCHIVED_STATUSES:
+        status = status_archived
+    else:
+        raise IgnoredEvent(f"event {event_type or '(none)'} for a {response_status or 'response'} is not stored")
+    return campaign_id, status, response
+
+
+# Store a response from an event. Returns the status groups whose workbooks it changes: its
+# own, plus the one it left when its status changed; none for a repeated or late delivery,
+# judged by the response's watermark_field as parse_event checked it.
+def store_response(response_store, campaign_id, status, response, watermark_field):
+    version = response_store.get_response_version(response["id"])
+    if version is not None:
+        updated_at = normalize_timestamp(response.get(watermark_field))
+        if version["updated_at"] is not None and updated_at is not None and version["updated_at"] >= updated_at:
+            return []
+    response_store.upsert_responses(campaign_id, status, [response])
+    if version is not None and version["status"] != status:
+        return [status, version["status"]]
+    return [status]
+
+
+# Collects build requests per job and calls trigger(job, categories) once per burst: delay
+# seconds after the last request, and no later than max_delay seconds after the first.
+class BuildDebouncer:
+    def __init__(self, trigger, delay, max_delay):
+        self.trigger = trigger
+        self.delay = delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    # Add categories to the job's next build. Returns the seconds until it starts.
+    def touch(self, job, categories):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.pending.get(job)
+            if entry is None:
+                entry = self.pending[job] = {"categories": set(), "first": now, "timer": None}
+            entry["categories"].update(categories)
+            if entry["timer"] is not None:
+                entry["timer"].cancel()
+            wait = max(0.0, min(self.delay, entry["first"] + self.max_delay - now))
+            timer = threading.Timer(wait, self.fire, (job,))
+            timer.daemon = True
+            entry["timer"] = timer
+            timer.start()
+            return wait
+
+    def fire(self, job):
+        with self.lock:
+            entry = self.pending.get(job)
+            # A timer replaced by a later event may still fire; only the current one builds
+            if entry is None or entry["timer"] is not threading.current_thread():
+                return
+            del self.pending[job]
+        try:
+            self.trigger(job, sorted(entry["categories"]))
+        except Exception as e:
+            logger.error(f"Unable to start the {job} build for {sorted(entry['categories'])}: {e}")
+
+    # Jobs with a build waiting, and the categories it covers
+    def waiting(self):
+        with self.lock:
+            return {job: sorted(entry["categories"]) for job, entry in self.pending.items()}